@@ -0,0 +1,143 @@
+# Archivo: gridbot_binance/core/archive.py
+# Arxiu Parquet (zstd) de l'històric que el manteniment treu de SQLite:
+#   data/archive/trades/<PARELL>/<AAAA-MM>/part-<ts_min>.parquet
+#   data/archive/balance/<AAAA-MM>/part-<ts_min>.parquet
+# Cada fitxer es nomena pel timestamp mínim del bloc: tornar a exportar el mateix bloc el sobreescriu.
+import os
+import glob
+from datetime import datetime, timezone
+import numpy as np
+from utils.logger import log
+
+try:
+    import pandas as pd
+    import pyarrow  # noqa: F401  (motor de to_parquet / read_parquet)
+except ImportError:  # Dependència opcional: sense ella no s'arxiva ni es purga res
+    pd = None
+
+ARCHIVE_DIR = os.path.join('data', 'archive')
+ARCHIVE_COMPRESSION = 'zstd'
+
+# kind -> (columna de temps, factor a segons, clau única)
+KINDS = {
+    'trades': ('timestamp', 1000, 'id'),
+    'balance': ('timestamp', 1, 'timestamp'),
+}
+
+def is_available():
+    return pd is not None
+
+def _month(ts, factor):
+    return datetime.fromtimestamp(ts / factor, tz=timezone.utc).strftime('%Y-%m')
+
+def _symbol_dir(symbol):
+    return symbol.replace('/', '_')
+
+def _write(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    df.to_parquet(tmp, compression=ARCHIVE_COMPRESSION, index=False)
+    os.replace(tmp, path)
+
+def archive_rows(kind, columns, rows):
+    """Exporta un bloc de files al Parquet particionat. True si tot s'ha escrit (llavors es poden esborrar)."""
+    if pd is None:
+        log.warning("Arxiu Parquet no disponible (falten pandas/pyarrow): no es purga l'històric.")
+        return False
+    if not rows: return True
+    ts_col, factor, _ = KINDS[kind]
+    try:
+        df = pd.DataFrame.from_records(rows, columns=list(columns))
+        df['_month'] = [_month(ts, factor) for ts in df[ts_col]]
+        group_keys = ['symbol', '_month'] if kind == 'trades' else ['_month']
+        for keys, part in df.groupby(group_keys, sort=False):
+            keys = keys if isinstance(keys, tuple) else (keys,)
+            folders = [_symbol_dir(keys[0]), keys[1]] if kind == 'trades' else [keys[0]]
+            path = os.path.join(ARCHIVE_DIR, kind, *folders, f"part-{int(part[ts_col].min())}.parquet")
+            _write(part.drop(columns='_month'), path)
+        return True
+    except Exception as e:
+        log.error(f"Error arxivant {kind} a Parquet: {e}")
+        return False
+
+def _read_archive(kind, symbol, from_ts, to_ts):
+    """Llegeix només les carpetes de mes que toquen el rang demanat"""
+    ts_col, factor, _ = KINDS[kind]
+    base = os.path.join(ARCHIVE_DIR, kind)
+    if kind == 'trades': base = os.path.join(base, _symbol_dir(symbol) if symbol else '*')
+    first = _month(from_ts, factor) if from_ts else None
+    last = _month(to_ts, factor) if to_ts is not None else None
+    frames = []
+    for path in glob.glob(os.path.join(base, '*', 'part-*.parquet')):
+        month = os.path.basename(os.path.dirname(path))
+        if (first and month < first) or (last and month > last): continue
+        try:
+            frames.append(pd.read_parquet(path))
+        except Exception as e:
+            log.warning(f"No s'ha pogut llegir {path}: {e}")
+    if not frames: return None
+    df = pd.concat(frames, ignore_index=True)
+    mask = df[ts_col] >= from_ts
+    if to_ts is not None: mask &= df[ts_col] < to_ts
+    return df[mask]
+
+def _union(kind, columns, live_rows, archived):
+    _, _, key = KINDS[kind]
+    live = pd.DataFrame.from_records(live_rows, columns=list(columns))
+    if archived is None or archived.empty: df = live
+    elif live.empty: df = archived
+    else: df = pd.concat([archived, live], ignore_index=True)
+    return df.drop_duplicates(subset=key, keep='last').sort_values('timestamp').reset_index(drop=True)
+
+def query_trades(db, symbol=None, from_ms=0, to_ms=None):
+    """Trades d'un rang de temps (arxiu Parquet + trade_history) en un DataFrame ordenat per timestamp"""
+    from core.database import TRADE_COLUMNS
+    live = db.get_trades_range(symbol, from_ms, to_ms)
+    if pd is None: return live
+    return _union('trades', TRADE_COLUMNS, live, _read_archive('trades', symbol, from_ms, to_ms))
+
+def query_balance_history(db, from_ts=0, to_ts=None):
+    """Equity (timestamp, equity) d'un rang de temps, unint l'arxiu Parquet i balance_history"""
+    from core.database import BALANCE_COLUMNS
+    live = [r for r in db.get_balance_history(from_ts) if to_ts is None or r[0] < to_ts]
+    if pd is None: return live
+    return _union('balance', BALANCE_COLUMNS, live, _read_archive('balance', None, from_ts, to_ts))
+
+# Totals de PnL dels trades arxivats per parell (get_stats): es rellegeixen només si canvien els fitxers
+_flows_cache = {}   # symbol -> (signatura dels fitxers, timestamps, cash_flow, qty_delta)
+
+def archived_symbols():
+    """Parells que tenen trades a l'arxiu"""
+    base = os.path.join(ARCHIVE_DIR, 'trades')
+    if pd is None or not os.path.isdir(base): return []
+    return [name.replace('_', '/') for name in os.listdir(base) if os.path.isdir(os.path.join(base, name))]
+
+def _symbol_flows(symbol):
+    paths = sorted(glob.glob(os.path.join(ARCHIVE_DIR, 'trades', _symbol_dir(symbol), '*', 'part-*.parquet')))
+    try: signature = tuple((path, os.path.getmtime(path)) for path in paths)
+    except OSError: signature = None   # Un fitxer s'està reescrivint: es rellegeix
+    cached = _flows_cache.get(symbol)
+    if cached and signature is not None and cached[0] == signature: return cached[1:]
+    frames = []
+    for path in paths:
+        try: frames.append(pd.read_parquet(path, columns=['id', 'side', 'amount', 'cost', 'fee_cost', 'timestamp']))
+        except Exception as e: log.warning(f"No s'ha pogut llegir {path}: {e}")
+    if frames:
+        df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='id', keep='last')
+        cost, amount = df['cost'].fillna(0.0), df['amount'].fillna(0.0)
+        # Mateixes regles que CASH_FLOW_SQL / QTY_DELTA_SQL
+        cash_flow = cost.where(df['side'] == 'sell', -cost) - df['fee_cost'].fillna(0.0)
+        qty_delta = amount.where(df['side'] == 'buy', -amount)
+        flows = (df['timestamp'].to_numpy(), cash_flow.to_numpy(), qty_delta.to_numpy())
+    else:
+        flows = (np.empty(0), np.empty(0), np.empty(0))
+    _flows_cache[symbol] = (signature,) + flows
+    return flows
+
+def trade_totals(symbol, from_ms=0, to_ms=None):
+    """(cash_flow, qty_delta, trades) dels trades arxivats del parell amb from_ms <= timestamp < to_ms"""
+    if pd is None: return 0.0, 0.0, 0
+    timestamps, cash_flow, qty_delta = _symbol_flows(symbol)
+    mask = timestamps >= from_ms
+    if to_ms is not None: mask &= timestamps < to_ms
+    return float(cash_flow[mask].sum()), float(qty_delta[mask].sum()), int(mask.sum())
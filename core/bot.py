@@ -1,12 +1,17 @@
 # Archivo: gridbot_binance/core/bot.py
 from core.exchange import BinanceConnector
-from core.database import BotDatabase
+from core.database import BotDatabase, CANDLE_BASE_TIMEFRAME, bump_version
+from core.market_state import MarketState
+from core.grid import get_tick_size, plan_grid_actions, find_order_at
+from core.archive import archive_rows, is_available as archive_available
+from core.events import EventBus
 from utils.logger import log
 from utils.telegram import send_msg 
 import time
-import math
 import threading
 import copy
+import bisect
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from colorama import Fore, Style
 
@@ -15,6 +20,8 @@ class GridBot:
         self.connector = BinanceConnector()
         self.db = BotDatabase()
         self.config = self.connector.config
+        # Estado de mercado por par compartido entre hilos (un fetch por dato y ciclo)
+        self.market_state = MarketState(self.connector, self.config.get('system', {}).get('cycle_delay', 5))
         self.pairs_map = {}
         self._refresh_pairs_map()
         self.levels = {} 
@@ -28,9 +35,49 @@ class GridBot:
         self.session_trades_count = {} 
         
         self.last_prune_time = 0
+        # Arxiu Parquet opcional: es comprova un sol cop. Sense pandas/pyarrow es purga sense arxivar (com abans)
+        self._archive = archive_rows if archive_available() else None
+        if self._archive is None:
+            log.warning("Arxiu Parquet no disponible (falten pandas/pyarrow): l'històric antic es purgarà sense arxivar.")
         self.last_daily_report_date = None
         self.last_backup_time = 0 # Timer per al backup de PnL
 
+        # Reconciliació concurrent per parell (system.max_workers)
+        self._executor = None
+        self._executor_size = 0
+        self._symbol_locks = {}
+        self.last_cycle_time = 0.0
+
+        # Motor por eventos: solo se reconcilia un par si el precio cruza una frontera de nivel,
+        # hay un fill o cambia la config. Barrido lento periódico como red de seguridad.
+        self._wake_event = threading.Event()
+        self._dirty_lock = threading.Lock()
+        self._dirty = set()
+        self._level_bounds = {}
+        self._last_region = {}
+        self._last_sweep = 0
+
+        # Detecció de fills per diferència entre snapshots consecutius d'ordres obertes
+        self._known_orders = {}   # symbol -> (timestamp, {order_id: ordre})
+        self._fill_lock = threading.Lock()
+        # Sincronització incremental de trades (cursor persistit a la BD per parell)
+        self._trade_sync_lock = threading.Lock()
+        self._last_trade_sync = 0
+        self._alert_lock = threading.Lock()
+        # Snapshot de estado del dashboard: lo publica el recolector tras cada ciclo y /api/status solo lo lee
+        self.status_snapshot = None
+        self._status_lock = threading.Lock()
+        self._status_version = 0
+        self.status_checked_at = 0   # Último recálculo (aunque el contenido no haya cambiado)
+        # Cambios para el dashboard (SSE): precio, órdenes, trades, equity, estado del motor y del snapshot
+        self.events = EventBus()
+        self._published_prices = {}
+        self._published_orders = {}
+        # Timeframes de gràfic que el dashboard està mirant: (symbol, timeframe) -> última petició
+        self._chart_timeframes = {}
+        self._chart_lock = threading.Lock()
+        self.market_state.on_open_orders = self._diff_open_orders
+
     def _refresh_pairs_map(self):
         self.pairs_map = {p['symbol']: p for p in self.config['pairs'] if p['enabled']}
         self.active_pairs = list(self.pairs_map.keys())
@@ -54,17 +101,18 @@ class GridBot:
 
     def _data_collector_loop(self):
         while self.is_running:
-            if self.is_paused or not self.connector.exchange:
+            if self.is_paused or not self.connector.exchange or self.connector.is_rate_limited():
                 time.sleep(1)
                 continue
             
-            # --- MANTENIMENT BASE DE DADES (Cada 24h) ---
-            if time.time() - self.last_prune_time > 86400:
+            # --- MANTENIMENT BASE DE DADES (per lots, cada minut) ---
+            # Pas curt amb pressupost de temps: si queda feina continua al següent minut
+            if time.time() - self.last_prune_time > self.config.get('system', {}).get('maintenance_interval', 60):
                 try:
-                    log.info("🧹 Ejecutando mantenimiento de Base de Datos...")
-                    d_trades, d_bal = self.db.prune_old_data(days_keep=30)
-                    if d_trades > 0 or d_bal > 0:
-                        log.success(f"DB optimizada: Borrados {d_trades} trades y {d_bal} registros antiguos.")
+                    # Lo que se purga se exporta antes a data/archive (Parquet); si falla no se borra nada
+                    res = self.db.maintenance_step(days_keep=30, archive=self._archive)
+                    if res['trades'] > 0 or res['balance'] > 0:
+                        log.success(f"DB optimizada: {'Archivados y borrados' if self._archive else 'Borrados'} {res['trades']} trades y {res['balance']} registros antiguos.")
                     self.last_prune_time = time.time()
                 except Exception as e:
                     log.error(f"Error en mantenimiento DB: {e}")
@@ -104,29 +152,48 @@ class GridBot:
                 except Exception as e:
                     log.error(f"Error enviando informe diario: {e}")
 
+            self.connector.keepalive_stream()
+
             current_pairs = list(self.active_pairs)
+            user_stream = self.connector.has_user_stream()
+            # Con user stream los fills llegan por WebSocket; el sync REST solo tapa posibles huecos de conexión
+            sync_interval = self.config.get('system', {}).get('trade_sync_interval', 300)
+            sync_trades = not user_stream or time.time() - self._last_trade_sync >= sync_interval
+            if sync_trades: self._last_trade_sync = time.time()
             for symbol in current_pairs:
                 try:
-                    price = self.connector.fetch_current_price(symbol)
-                    candles = self.connector.fetch_candles(symbol, limit=500) 
-                    self.db.update_market_snapshot(symbol, price, candles)
+                    # Mismo estado del ciclo que usa el hilo de trading (sin volver a pedirlo al exchange)
+                    state = self.market_state.snapshot(symbol)
+                    price = state['price']
+                    self._publish_market_changes(symbol, price, state['open_orders'])
+                    # Solo viajan (y se persisten) las velas nuevas o la vela en curso
+                    _, changed_candles = self.connector.get_candles(symbol, limit=500)
+                    self.db.update_market_snapshot(symbol, price, changed_candles)
+                    self._refresh_chart_timeframes(symbol)
 
-                    open_orders = self.connector.fetch_open_orders(symbol) or []
                     grid_levels = self.levels.get(symbol, [])
-                    self.db.update_grid_status(symbol, open_orders, grid_levels)
+                    self.db.update_grid_status(symbol, state['open_orders'], grid_levels)
 
-                    trades = self.connector.fetch_my_trades(symbol, limit=10)
-                    self.db.save_trades(trades)
-                    
-                    self._check_and_alert_trades(symbol, trades)
+                    if user_stream:
+                        fills = self.connector.pop_stream_fills(symbol)
+                        new_trades = self.db.save_trades(fills)
+                        self._check_and_alert_trades(symbol, fills)
+                        self._publish_trades(symbol, new_trades)
+                    if sync_trades:
+                        # Solo devuelve trades posteriores al cursor: nada se repite ni se pierde
+                        self._sync_symbol_trades(symbol)
                 except Exception: pass
                 time.sleep(1) 
             
+            try: self.publish_status()
+            except Exception as e: log.error(f"Error publicando estado: {e}")
+
             if int(time.time()) % 60 == 0:
                 try:
                     total_equity = self.calculate_total_equity()
                     if total_equity > 0:
                         self.db.log_balance_snapshot(total_equity)
+                        self.events.publish('equity', {'time': int(time.time() * 1000), 'equity': round(total_equity, 2)})
                 except: pass
 
             time.sleep(2) 
@@ -149,7 +216,7 @@ class GridBot:
                 qty_delta = qty_deltas.get(symbol, 0.0)
                 price = prices.get(symbol, 0.0)
                 if price == 0:
-                     price = self.connector.fetch_current_price(symbol)
+                     price = self.market_state.get_price(symbol)
                 
                 # PnL Sessió = CashFlow + (QtyDelta * Price)
                 session_pnl = cf + (qty_delta * price)
@@ -157,81 +224,199 @@ class GridBot:
                 self.db.update_pnl_backup(symbol, session_pnl)
             except: pass
 
+    def publish_status(self):
+        """Precalcula cartera, PnL por estrategia y estadísticas y los publica como snapshot versionado"""
+        with self._status_lock:
+            balances = self.connector.get_balance_snapshot() if self.connector.exchange else {}
+            def get_bal_safe(asset):
+                data = (balances or {}).get(asset, {})
+                return float(data.get('free', 0.0)) + float(data.get('used', 0.0))
+
+            pairs = self.config.get('pairs', [])
+            symbols = [p['symbol'] for p in pairs]
+            prices = self.db.get_all_prices()
+            missing = [s for s in symbols if not prices.get(s)]
+            if missing and self.connector.exchange: prices.update(self.market_state.get_prices(missing))
+
+            usdc_balance = get_bal_safe('USDC')
+            portfolio = [{"name": "USDC", "value": round(usdc_balance, 2)}]
+            total_equity = usdc_balance
+            holding_values = {}
+            for symbol in symbols:
+                base = symbol.split('/')[0]
+                price = prices.get(symbol, 0.0)
+                if price > 0:
+                    val = get_bal_safe(base) * price
+                    holding_values[symbol] = val
+                    if val > 0.5:
+                        portfolio.append({"name": base, "value": round(val, 2)})
+                        total_equity += val
+
+            session_stats = self.db.get_stats(from_timestamp=self.global_start_time)
+            global_stats = self.db.get_stats(from_timestamp=0)
+            accumulated = self.db.get_accumulated_pnl_map()
+
+            strategies, acc_global_pnl, acc_session_pnl = [], 0.0, 0.0
+            for pair_config in pairs:
+                symbol = pair_config['symbol']
+                strat_conf = pair_config.get('strategy', {})
+                is_enabled = pair_config.get('enabled', False)
+                trades_count = global_stats['per_coin_stats']['trades'].get(symbol, 0)
+                # PnL Sessió = CashFlow + (QtyDelta * Price); Global = sessions arxivades + sessió
+                pnl_session = (session_stats['per_coin_stats']['qty_delta'].get(symbol, 0.0) * prices.get(symbol, 0.0)
+                               + session_stats['per_coin_stats']['cash_flow'].get(symbol, 0.0))
+                pnl_global = accumulated.get(symbol, 0.0) + pnl_session
+                acc_global_pnl += pnl_global
+                acc_session_pnl += pnl_session
+                if is_enabled or trades_count > 0 or holding_values.get(symbol, 0.0) > 1.0:
+                    strategies.append({
+                        "symbol": symbol,
+                        "enabled": is_enabled,
+                        "grids": strat_conf.get('grids_quantity', '-'),
+                        "amount": strat_conf.get('amount_per_grid', '-'),
+                        "spread": strat_conf.get('grid_spread', '-'),
+                        "total_trades": trades_count,
+                        "total_pnl": round(pnl_global, 2),
+                        "session_pnl": round(pnl_session, 2)
+                    })
+
+            content = {
+                "session_start": self.global_start_time,
+                "first_run": self.db.get_first_run_timestamp(),
+                "active_pairs": list(self.active_pairs),
+                "balance_usdc": round(usdc_balance, 2),
+                "total_usdc_value": round(total_equity, 2),
+                "portfolio_distribution": portfolio,
+                "session_trades_distribution": session_stats['trades_distribution'],
+                "global_trades_distribution": global_stats['trades_distribution'],
+                "strategies": strategies,
+                "stats": {
+                    "session": {"trades": session_stats['trades'], "profit": round(acc_session_pnl, 2), "best_coin": session_stats['best_coin']},
+                    "global": {"trades": global_stats['trades'], "profit": round(acc_global_pnl, 2), "best_coin": global_stats['best_coin']}
+                }
+            }
+            self.status_checked_at = time.time()
+            previous = self.status_snapshot
+            if previous is not None and all(previous[k] == v for k, v in content.items()): return previous
+            self._status_version += 1
+            # Se sustituye el dict entero: los lectores nunca ven un snapshot a medias
+            self.status_snapshot = dict(content, version=self._status_version, updated_at=time.time())
+            # Solo viajan las claves que han cambiado: el dashboard las aplica sobre su copia (versión previa + 1)
+            changes = {k: v for k, v in content.items() if previous is None or previous[k] != v}
+            self.events.publish('status', {'version': self._status_version, 'changes': changes})
+            return self.status_snapshot
+
+    def engine_status(self):
+        if not self.is_running: return "Stopped"
+        return "Paused" if self.is_paused else "Running"
+
+    def _publish_engine_state(self):
+        self.events.publish('engine', {'status': self.engine_status()})
+
+    def _publish_market_changes(self, symbol, price, open_orders):
+        """Solo emite eventos si el precio o el conjunto de órdenes abiertas ha cambiado desde el último ciclo"""
+        if price and self._published_prices.get(symbol) != price:
+            self._published_prices[symbol] = price
+            self.events.publish('price', {'symbol': symbol, 'price': price})
+        order_ids = frozenset(str(o['id']) for o in open_orders)
+        if self._published_orders.get(symbol) != order_ids:
+            self._published_orders[symbol] = order_ids
+            spread = self._get_params(symbol).get('grid_spread', 1.0)
+            # Mismos campos que /api/orders (entry_price de las ventas incluido): el dashboard no tiene que volver a pedirlas
+            orders = [{'id': str(o['id']), 'symbol': symbol, 'side': o['side'], 'price': float(o['price']), 'amount': float(o['amount']),
+                       'entry_price': float(o['price']) / (1 + spread / 100.0) if o['side'] == 'sell' else 0.0} for o in open_orders]
+            self.events.publish('orders', {'symbol': symbol, 'open_orders': orders})
+
+    def _publish_trades(self, symbol, new_trades):
+        """Filas tal como las guarda la BD (con buy_id ya asignado por las alertas) para añadirlas al historial del dashboard"""
+        if not new_trades: return
+        rows = self.db.get_trades_by_ids([t['id'] for t in new_trades])
+        if rows: self.events.publish('trades', {'symbol': symbol, 'trades': rows})
+
     def _check_and_alert_trades(self, symbol, trades):
         if not trades: return
-        strat = self.pairs_map.get(symbol, {}).get('strategy', self.config['default_strategy'])
-        spread_pct = strat.get('grid_spread', 1.0)
+        # El recolector y la detecció de fills poden processar el mateix trade alhora
+        with self._alert_lock:
+            strat = self.pairs_map.get(symbol, {}).get('strategy', self.config['default_strategy'])
+            spread_pct = strat.get('grid_spread', 1.0)
 
-        if symbol not in self.session_trades_count:
-            self.session_trades_count[symbol] = 0
+            if symbol not in self.session_trades_count:
+                self.session_trades_count[symbol] = 0
 
-        for t in trades:
-            tid = t['id']
-            side = t['side'].upper()
+            for t in trades:
+                tid = t['id']
+                side = t['side'].upper()
             
-            buy_id_assigned = None
-            if side == 'BUY':
-                 buy_id_assigned = self.db.assign_id_to_trade_if_missing(tid)
+                buy_id_assigned = None
+                if side == 'BUY':
+                     buy_id_assigned = self.db.assign_id_to_trade_if_missing(tid)
 
-            if tid in self.processed_trade_ids: continue
+                if tid in self.processed_trade_ids: continue
             
-            if t['timestamp'] < (self.global_start_time * 1000):
-                self.processed_trade_ids.add(tid)
-                continue
+                if t['timestamp'] < (self.global_start_time * 1000):
+                    self.processed_trade_ids.add(tid)
+                    continue
 
-            self.processed_trade_ids.add(tid)
-            self.session_trades_count[symbol] += 1
+                self.processed_trade_ids.add(tid)
+                self.session_trades_count[symbol] += 1
+                # Un fill cambia los saldos: el próximo ciclo pedirá un snapshot nuevo
+                self.connector.invalidate_balance()
+                self.market_state.invalidate(symbol, 'open_orders')
+                self.wake(symbol)
             
-            price = float(t['price'])
-            amount = float(t['amount'])
-            cost = float(t['cost'])
+                price = float(t['price'])
+                amount = float(t['amount'])
+                cost = float(t['cost'])
             
-            fee_cost = 0.0
-            fee_currency = ""
-            if 'fee' in t and t['fee']:
-                fee_cost = float(t['fee'].get('cost', 0.0))
-                fee_currency = t['fee'].get('currency', '')
+                fee_cost = 0.0
+                fee_currency = ""
+                if 'fee' in t and t['fee']:
+                    fee_cost = float(t['fee'].get('cost', 0.0))
+                    fee_currency = t['fee'].get('currency', '')
             
-            # Normalitzem comissió
-            fee_in_usdc = fee_cost
-            if fee_currency != 'USDC' and fee_currency != 'USDT':
-                fee_in_usdc = fee_cost * price
+                # Normalitzem comissió (si es paga en BNB o un altre actiu no la podem convertir: s'estima amb la tarifa real)
+                base, quote = symbol.split('/')
+                fees = self.connector.get_trading_fees(symbol)
+                if fee_currency in (quote, 'USDC', 'USDT'): fee_in_usdc = fee_cost
+                elif fee_currency == base: fee_in_usdc = fee_cost * price
+                else: fee_in_usdc = cost * fees.get(t.get('takerOrMaker') or 'maker', 0.0)
 
-            # Forcem un backup immediat després d'una operació important
-            try:
-                self._backup_current_session_pnl()
-            except: pass
+                # Forcem un backup immediat després d'una operació important
+                try:
+                    self._backup_current_session_pnl()
+                except: pass
 
-            msg = ""
-            if side == 'BUY':
-                header_id = f"(ID #{buy_id_assigned})" if buy_id_assigned else ""
-                if self.session_trades_count[symbol] == 1:
-                    header = f"🚀 🟢 <b>ENTRADA {header_id}</b>"
-                else:
-                    header = f"🟢 <b>COMPRA {header_id}</b>"
-                msg = (f"{header}\nPar: <b>{symbol}</b>\nPrecio: {price:.4f}\nCantidad: {amount}\nCoste Total: {cost:.2f} USDC")
+                msg = ""
+                if side == 'BUY':
+                    header_id = f"(ID #{buy_id_assigned})" if buy_id_assigned else ""
+                    if self.session_trades_count[symbol] == 1:
+                        header = f"🚀 🟢 <b>ENTRADA {header_id}</b>"
+                    else:
+                        header = f"🟢 <b>COMPRA {header_id}</b>"
+                    msg = (f"{header}\nPar: <b>{symbol}</b>\nPrecio: {price:.4f}\nCantidad: {amount}\nCoste Total: {cost:.2f} USDC")
             
-            else: # SELL
-                linked_id = self.db.find_linked_buy_id(symbol, price, spread_pct)
-                if linked_id: self.db.set_trade_buy_id(tid, linked_id)
-
-                id_text = f"#{linked_id}" if linked_id else "?"
-                buy_price_ref = price / (1 + (spread_pct / 100))
-                gross_profit = (price - buy_price_ref) * amount
-                total_fees_est = fee_in_usdc * 2 
-                net_profit = gross_profit - total_fees_est
-                if net_profit < 0: net_profit = 0.0
-                percent_profit = (net_profit / cost) * 100 if cost > 0 else 0.0
+                else: # SELL
+                    linked_id = self.db.find_linked_buy_id(symbol, price, spread_pct)
+                    if linked_id: self.db.set_trade_buy_id(tid, linked_id)
+
+                    id_text = f"#{linked_id}" if linked_id else "?"
+                    buy_price_ref = price / (1 + (spread_pct / 100))
+                    gross_profit = (price - buy_price_ref) * amount
+                    # Comissió real de la venda + la de la compra enllaçada (ordre límit del grid = maker)
+                    total_fees_est = fee_in_usdc + buy_price_ref * amount * fees['maker']
+                    net_profit = gross_profit - total_fees_est
+                    if net_profit < 0: net_profit = 0.0
+                    percent_profit = (net_profit / cost) * 100 if cost > 0 else 0.0
                 
-                msg = (f"🔴 <b>VENTA (Cierra ID {id_text})</b>\n"
-                       f"Par: <b>{symbol}</b>\n"
-                       f"Precio Venta: {price:.4f}\n"
-                       f"Total Recibido: {cost:.2f} USDC\n"
-                       f"------------------\n"
-                       f"💰 <b>Beneficio Neto Est.: +{net_profit:.3f} USDC</b>\n"
-                       f"📈 <i>Rentabilidad Op.: {percent_profit:.2f}%</i>")
+                    msg = (f"🔴 <b>VENTA (Cierra ID {id_text})</b>\n"
+                           f"Par: <b>{symbol}</b>\n"
+                           f"Precio Venta: {price:.4f}\n"
+                           f"Total Recibido: {cost:.2f} USDC\n"
+                           f"------------------\n"
+                           f"💰 <b>Beneficio Neto Est.: +{net_profit:.3f} USDC</b>\n"
+                           f"📈 <i>Rentabilidad Op.: {percent_profit:.2f}%</i>")
 
-            send_msg(msg)
+                send_msg(msg)
 
     def _get_params(self, symbol):
         pair_config = self.pairs_map.get(symbol, {})
@@ -268,7 +453,7 @@ class GridBot:
         except: return 0.0
 
     def _ensure_grid_consistency(self, symbol):
-        current_price = self.connector.fetch_current_price(symbol)
+        current_price = self.market_state.get_price(symbol)
         if current_price == 0: return 
 
         params = self._get_params(symbol)
@@ -310,7 +495,7 @@ class GridBot:
             else:
                 log.error(f"Falta USDC para compra inicial de {symbol}.")
 
-        open_orders = self.connector.fetch_open_orders(symbol)
+        open_orders = self.market_state.get_open_orders(symbol)
         
         if symbol not in self.levels:
             self.levels[symbol] = self._generate_fixed_levels(symbol, current_price)
@@ -326,11 +511,11 @@ class GridBot:
              if current_price > trigger_price:
                  log.warning(f"🚀 TRAILING UP: {symbol} ha roto techo ({max_level}). Moviendo rejilla...")
                  lowest_level = my_levels.pop(0)
-                 for o in open_orders:
-                     if math.isclose(o['price'], lowest_level, rel_tol=1e-5):
-                         log.info(f"🗑️ Cancelando orden inferior {o['id']} ({lowest_level}) para liberar grid.")
-                         self.connector.cancel_order(o['id'], symbol)
-                         break
+                 o = find_order_at(open_orders, lowest_level, get_tick_size(self.connector.exchange.market(symbol)))
+                 if o:
+                     log.info(f"🗑️ Cancelando orden inferior {o['id']} ({lowest_level}) para liberar grid.")
+                     self.connector.cancel_order(o['id'], symbol)
+                     self.market_state.invalidate(symbol, 'open_orders')
                  new_top = max_level * (1 + spread_val)
                  try:
                     p_str = self.connector.exchange.price_to_precision(symbol, new_top)
@@ -341,58 +526,220 @@ class GridBot:
                  send_msg(f"🧗 <b>TRAILING UP {symbol}</b>\nEl precio ha subido. Grid desplazado hacia arriba.\nNuevo techo: {new_top}")
                  return 
 
-        base_asset, quote_asset = symbol.split('/')
         spread_val = params['grid_spread'] / 100
         margin = current_price * (spread_val * 0.1) 
 
+        # Una sola consulta por ciclo (antes se repetía para cada nivel de venta)
+        last_buy_price = self.db.get_last_buy_price(symbol)
+        min_sell_price = last_buy_price * (1 + (spread_val * 0.5))
+
+        desired = {}
         for level_price in my_levels:
-            target_side = None
-            if level_price > current_price + margin: target_side = 'sell'
-            elif level_price < current_price - margin: target_side = 'buy'
-            else: continue 
-
-            if target_side == 'sell':
-                last_buy_price = self.db.get_last_buy_price(symbol)
-                min_sell_price = last_buy_price * (1 + (spread_val * 0.5))
-                if level_price < min_sell_price:
-                    continue
+            if level_price > current_price + margin:
+                if level_price >= min_sell_price: desired[level_price] = 'sell'
+            elif level_price < current_price - margin:
+                desired[level_price] = 'buy'
 
-            exists = False
-            for o in open_orders:
-                if math.isclose(o['price'], level_price, rel_tol=1e-5):
-                    if o['side'] == target_side: exists = True
-                    else:
-                        self.connector.exchange.cancel_order(o['id'], symbol)
-                        exists = False 
-                    break
-            if exists: continue 
-
-            amount = self._get_amount_for_level(symbol, level_price)
-            if amount == 0: continue
-
-            if target_side == 'buy':
-                balance = self.connector.get_asset_balance(quote_asset)
-                if balance < amount * level_price: continue
-            else: 
-                balance = self.connector.get_asset_balance(base_asset)
-                reserved = self.reserved_inventory.get(base_asset, 0.0)
-                if (balance - reserved) < amount * 0.99: continue
-                if balance < amount and balance > amount * 0.9:
-                      try: amount = float(self.connector.exchange.amount_to_precision(symbol, balance))
-                      except: pass
-
-            log.warning(f"[{symbol}] Creando orden {target_side} @ {level_price}")
-            self.connector.place_order(symbol, target_side, amount, level_price)
-
-        for o in open_orders:
-            match_found = False
-            for lvl in my_levels:
-                if math.isclose(o['price'], lvl, rel_tol=1e-5):
-                    match_found = True
-                    break
-            if not match_found:
+        tick_size = get_tick_size(self.connector.exchange.market(symbol))
+        actions = plan_grid_actions(my_levels, desired, open_orders, tick_size)
+        # Tras tocar órdenes, el siguiente lector (recolector o próximo ciclo) las vuelve a pedir
+        if actions: self.market_state.invalidate(symbol, 'open_orders')
+        for act in actions:
+            if act['action'] == 'cancel':
+                o = act['order']
                 log.info(f"🧹 Limpiando orden huérfana {o['id']} ({o['price']}) - Fuera de rango.")
                 self.connector.cancel_order(o['id'], symbol)
+                continue
+            if act['action'] == 'replace':
+                self.connector.cancel_order(act['order']['id'], symbol)
+            self._place_level_order(symbol, act['side'], act['price'])
+        return True
+
+    def _place_level_order(self, symbol, target_side, level_price):
+        base_asset, quote_asset = symbol.split('/')
+        amount = self._get_amount_for_level(symbol, level_price)
+        if amount == 0: return
+
+        if target_side == 'buy':
+            balance = self.connector.get_asset_balance(quote_asset)
+            if balance < amount * level_price: return
+        else: 
+            balance = self.connector.get_asset_balance(base_asset)
+            reserved = self.reserved_inventory.get(base_asset, 0.0)
+            if (balance - reserved) < amount * 0.99: return
+            if balance < amount and balance > amount * 0.9:
+                  try: amount = float(self.connector.exchange.amount_to_precision(symbol, balance))
+                  except: pass
+
+        log.warning(f"[{symbol}] Creando orden {target_side} @ {level_price}")
+        self.connector.place_order(symbol, target_side, amount, level_price)
+
+    # --- TIMEFRAMES DEL GRÀFIC ---
+    def watch_chart_timeframe(self, symbol, timeframe):
+        """El dashboard demana un timeframe que no surt de la BD: el recol·lector el manté al buffer mentre es consulti"""
+        with self._chart_lock: self._chart_timeframes[(symbol, timeframe)] = time.time()
+
+    def _refresh_chart_timeframes(self, symbol):
+        ttl = self.config.get('system', {}).get('chart_timeframe_ttl', 300)
+        now = time.time()
+        with self._chart_lock:
+            for key, ts in list(self._chart_timeframes.items()):
+                if now - ts > ttl: del self._chart_timeframes[key]
+            timeframes = [tf for (sym, tf) in self._chart_timeframes if sym == symbol and tf != CANDLE_BASE_TIMEFRAME]
+        for tf in timeframes:
+            # Incremental (since=última vela): una crida lleugera per cicle i timeframe vist
+            _, changed = self.connector.get_candles(symbol, timeframe=tf, limit=500)
+            if changed: bump_version(('candles', symbol, tf))
+
+    # --- MOTOR PER ESDEVENIMENTS ---
+    def wake(self, symbol=None, immediate=True):
+        """Marca un par (o todos si symbol=None) para reconciliar. immediate=False espera al siguiente tick."""
+        with self._dirty_lock:
+            if symbol is None: self._dirty.update(self.active_pairs)
+            else: self._dirty.add(symbol)
+        if immediate: self._wake_event.set()
+
+    def _diff_open_orders(self, symbol, orders):
+        """Una orden que desaparece sin que la hayamos cancelado se ha ejecutado: buscamos sus trades ya"""
+        if self.connector.has_user_stream(): return  # Los fills ya llegan por WebSocket
+        now = time.time()
+        current = {str(o['id']): o for o in orders}
+        with self._fill_lock:
+            prev_ts, previous = self._known_orders.get(symbol, (0, None))
+            self._known_orders[symbol] = (now, current)
+        if previous is None or not self.is_running: return
+        gone = [oid for oid in previous if oid not in current and not self.connector.was_cancelled(symbol, oid, prev_ts)]
+        if not gone: return
+        log.info(f"🔎 {symbol}: {len(gone)} orden(es) desaparecida(s) sin cancelar. Buscando fills...")
+        self._sync_symbol_trades(symbol)
+        self.wake(symbol)
+
+    def _sync_symbol_trades(self, symbol, since=None, max_pages=5, alert=True):
+        """Trades posteriores al cursor persistido (paginando por fromId): no se pierde ninguno tras una caída"""
+        with self._trade_sync_lock:
+            last_id, last_ts = self.db.get_trade_cursor(symbol)
+            if last_id is None:
+                # Sin trades todavía: se reanuda desde la última ventana explorada, no desde el inicio de sesión
+                if since is None: since = int(self.global_start_time * 1000)
+                # (1 min de solape por si un trade se indexa con retraso respecto a su timestamp)
+                if last_ts: since = max(since, int(last_ts) - 60000)
+            trades, caught_up, scanned_ts = self.connector.sync_trades(symbol, last_id=last_id, since=since, max_pages=max_pages)
+            if not trades:
+                if last_id is None and scanned_ts: self.db.set_trade_scan_ts(symbol, scanned_ts)
+                return []
+            new_trades = self.db.save_trades(trades)
+            last = max(trades, key=lambda t: int(t['id']))
+            self.db.set_trade_cursor(symbol, int(last['id']), last['timestamp'])
+        if not caught_up: log.warning(f"[{symbol}] Sync de trades incompleto ({len(trades)} nuevos). Se continuará en el próximo ciclo.")
+        if alert: self._check_and_alert_trades(symbol, trades)
+        else: self.processed_trade_ids.update(t['id'] for t in trades)
+        self._publish_trades(symbol, new_trades)
+        return trades
+
+    def _catch_up_trades(self):
+        """Al arrancar: recupera (acotado) los trades ejecutados mientras el bot estaba parado"""
+        sys_cfg = self.config.get('system', {})
+        max_pages = sys_cfg.get('trade_catchup_pages', 10)
+        since = int((time.time() - sys_cfg.get('trade_catchup_hours', 24) * 3600) * 1000)
+        total = 0
+        for symbol in self.active_pairs:
+            try: total += len(self._sync_symbol_trades(symbol, since=since, max_pages=max_pages, alert=False))
+            except Exception as e: log.error(f"Error recuperando trades {symbol}: {e}")
+        if total: log.info(f"📥 Recuperados {total} trades del periodo sin conexión.")
+
+    def _rebuild_level_index(self, symbol):
+        """Fronteras ordenadas de precio donde cambia la decisión del grid (lado de cada nivel y trailing)"""
+        levels = sorted(self.levels.get(symbol, []))
+        if not levels:
+            self._level_bounds.pop(symbol, None)
+            return
+        params = self._get_params(symbol)
+        spread_val = params['grid_spread'] / 100
+        m = spread_val * 0.1
+        bounds = []
+        for lvl in levels:
+            # Nivel = venta si price < lvl/(1+m), compra si price > lvl/(1-m), neutro en medio
+            bounds.append(lvl / (1 + m))
+            bounds.append(lvl / (1 - m))
+        if params.get('trailing_enabled', False):
+            bounds.append(levels[-1] * (1 + (spread_val * 0.2)))
+        bounds.sort()
+        self._level_bounds[symbol] = bounds
+
+    def _price_region(self, symbol, price):
+        bounds = self._level_bounds.get(symbol)
+        if bounds is None or not price: return None
+        return bisect.bisect_right(bounds, price)
+
+    def _collect_dirty_symbols(self, poll):
+        symbols = list(self.active_pairs)
+        with self._dirty_lock:
+            dirty = set(self._dirty)
+            self._dirty.clear()
+
+        sweep_interval = self.config.get('system', {}).get('sweep_interval', 60)
+        if time.time() - self._last_sweep >= sweep_interval:
+            dirty.update(symbols)
+            self._last_sweep = time.time()
+
+        prices = self.market_state.get_prices(symbols, max_age=poll)
+        for symbol in symbols:
+            if symbol not in self.levels:
+                dirty.add(symbol)
+                continue
+            region = self._price_region(symbol, prices.get(symbol, 0.0))
+            if region is not None and region != self._last_region.get(symbol):
+                dirty.add(symbol)
+        return [s for s in symbols if s in dirty], prices
+
+    def _after_reconcile(self, symbols, prices):
+        for symbol in symbols:
+            self._rebuild_level_index(symbol)
+            region = self._price_region(symbol, prices.get(symbol, 0.0))
+            if region is not None: self._last_region[symbol] = region
+
+    # --- RECONCILIACIÓ CONCURRENT ---
+    def _reconcile_workers(self, n_symbols):
+        """Nº de fils per ciclo: limitado por config y por el presupuesto de peso API restante"""
+        max_workers = self.config.get('system', {}).get('max_workers', 4)
+        usage = self.connector.governor.usage_ratio()
+        if usage > 0.7: max_workers = 1
+        elif usage > 0.5: max_workers = max(1, max_workers // 2)
+        return max(1, min(max_workers, n_symbols))
+
+    def _reconcile_symbol(self, symbol):
+        """Aislamiento por par: un error o un par lento no afecta al resto"""
+        lock = self._symbol_locks.setdefault(symbol, threading.Lock())
+        if not lock.acquire(blocking=False): return
+        done = False
+        try:
+            done = self._ensure_grid_consistency(symbol)
+        except Exception as e:
+            log.error(f"Error reconciliando {symbol}: {e}")
+        finally:
+            lock.release()
+        # Salida anticipada (compra inicial, trailing, sin precio...): se repite en el siguiente tick
+        if not done: self.wake(symbol, immediate=False)
+
+    def _reconcile_cycle(self, symbols):
+        """Reconcilia todos los pares y espera a que acaben todos (barrera por ciclo)"""
+        start = time.time()
+        workers = self._reconcile_workers(len(symbols))
+        if workers <= 1:
+            for symbol in symbols: self._reconcile_symbol(symbol)
+        else:
+            if self._executor is None or self._executor_size != workers:
+                if self._executor: self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grid")
+                self._executor_size = workers
+            wait([self._executor.submit(self._reconcile_symbol, s) for s in symbols])
+        self.last_cycle_time = time.time() - start
+
+    def _stop_executor(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._executor_size = 0
 
     def _handle_smart_reload(self):
         print() 
@@ -402,6 +749,7 @@ class GridBot:
         new_testnet = new_config.get('system', {}).get('use_testnet', True)
         self.config = new_config
         self._refresh_pairs_map()
+        self.market_state.max_age = new_config.get('system', {}).get('cycle_delay', 5)
         
         if old_testnet != new_testnet:
             network_name = "TESTNET" if new_testnet else "REAL"
@@ -409,15 +757,21 @@ class GridBot:
             send_msg(f"🔄 <b>CAMBIO DE RED</b>\nEl bot ha pasado a modo: <b>{network_name}</b>")
             self.levels = {}
             self.reserved_inventory = {}
+            self.market_state.clear()
             self.db.reset_all_statistics()
             self.processed_trade_ids.clear()
             self.session_trades_count = {} 
+            self._known_orders = {}
             log.info("Recalculando patrimonio en la nueva red...")
             initial_equity = self.calculate_total_equity()
             self.db.set_session_start_balance(initial_equity)
             self.db.set_global_start_balance_if_not_exists(initial_equity)
             self.capture_initial_snapshots()
             self.global_start_time = time.time()
+            self.connector.start_stream(self.active_pairs, on_fill=self.wake)
+            self._level_bounds = {}
+            self._last_region = {}
+            self.wake()
             log.success(f"✅ Sistema reiniciado en modo {network_name}.")
             return
 
@@ -433,7 +787,11 @@ class GridBot:
             
         added = new_symbols - active_running_symbols
         for symbol in added: log.success(f"✨ Activando {symbol}.")
+
+        if removed or added or self.connector.stream:
+            self.connector.start_stream(self.active_pairs, on_fill=self.wake)
         
+        self.wake()
         log.info("✅ Recarga completada.")
         send_msg("⚙️ <b>CONFIGURACIÓN ACTUALIZADA</b>\nNuevos parámetros aplicados.")
 
@@ -441,6 +799,7 @@ class GridBot:
         print()
         log.warning(f"MANUAL: Cerrando orden {order_id} ({side}) en {symbol}...")
         res = self.connector.cancel_order(order_id, symbol)
+        self.market_state.invalidate(symbol, 'open_orders')
         if side == 'buy':
             log.success(f"Orden {order_id} cancelada. USDC recuperados.")
             send_msg(f"🗑️ <b>ORDEN CANCELADA (Manual)</b>\n{symbol} - {side}")
@@ -457,6 +816,8 @@ class GridBot:
                 return False
 
     def calculate_total_equity(self):
+        # Un snapshot de saldos + un solo ticker por lotes, sin importar cuántos pares haya
+        prices = self.market_state.get_prices(self.active_pairs)
         total_usdc = 0.0
         try:
             total_usdc += self.connector.get_total_balance('USDC')
@@ -466,18 +827,17 @@ class GridBot:
             try:
                 qty = self.connector.get_total_balance(base)
                 if qty > 0:
-                    price = self.connector.fetch_current_price(symbol)
-                    total_usdc += (qty * price)
+                    total_usdc += (qty * prices.get(symbol, 0.0))
             except: pass
         return total_usdc
 
     def capture_initial_snapshots(self):
+        prices = self.market_state.get_prices(self.active_pairs)
         for symbol in self.active_pairs:
             base = symbol.split('/')[0]
             try:
                 qty = self.connector.get_total_balance(base)
-                price = self.connector.fetch_current_price(symbol)
-                initial_value = qty * price
+                initial_value = qty * prices.get(symbol, 0.0)
                 self.db.set_coin_initial_balance(symbol, initial_value)
             except Exception as e:
                 log.error(f"Error snapshot {symbol}: {e}")
@@ -486,6 +846,7 @@ class GridBot:
         print()
         log.warning("⛔ ACCIÓN DE USUARIO: PAUSANDO BOT...")
         self.is_paused = True
+        self._publish_engine_state()
         send_msg("⏸️ <b>BOT PAUSADO</b>\nSe han detenido todas las operaciones.")
         return True
 
@@ -493,6 +854,7 @@ class GridBot:
         print()
         log.success("▶️ ACCIÓN DE USUARIO: REANUDANDO BOT...")
         self.is_paused = False
+        self._publish_engine_state()
         send_msg("▶️ <b>BOT REANUDADO</b>\nContinuando operaciones.")
         return True
 
@@ -503,6 +865,7 @@ class GridBot:
         count = 0
         for symbol in self.active_pairs:
             self.connector.cancel_all_orders(symbol)
+            self.market_state.invalidate(symbol, 'open_orders')
             grid_levels = self.levels.get(symbol, [])
             self.db.update_grid_status(symbol, [], grid_levels)
             count += 1
@@ -516,11 +879,12 @@ class GridBot:
         self.panic_cancel_all()
         time.sleep(2) 
 
+        prices = self.market_state.get_prices(self.active_pairs)
         for symbol in self.active_pairs:
             try:
                 base_asset = symbol.split('/')[0]
                 amount = self.connector.get_asset_balance(base_asset)
-                price = self.connector.fetch_current_price(symbol)
+                price = prices.get(symbol, 0.0)
                 value_usdc = amount * price
                 
                 if value_usdc > 2.0: 
@@ -556,18 +920,28 @@ class GridBot:
         
         self.global_start_time = time.time()
         self.processed_trade_ids.clear()
+        self._known_orders = {}
+        self._last_trade_sync = 0
+        self._catch_up_trades()
+        try: self.publish_status()
+        except Exception as e: log.error(f"Error publicando estado: {e}")
 
         send_msg(f"🚀 <b>MOTOR INICIADO</b>\nPatrimonio inicial: {initial_equity:.2f} USDC")
 
         log.warning("Limpiando órdenes antiguas iniciales...")
         for symbol in self.active_pairs:
             self.connector.cancel_all_orders(symbol)
+
+        if self.connector.start_stream(self.active_pairs, on_fill=self.wake):
+            log.info("📶 Modo STREAMING activado: precios, órdenes y fills por WebSocket.")
         
         log.info("Arrancando motores...")
         time.sleep(2)
         
         self.is_running = True
         self.is_paused = False 
+        self._last_sweep = 0
+        self._publish_engine_state()
         
         data_thread = threading.Thread(target=self._data_collector_loop, daemon=True)
         data_thread.start()
@@ -590,17 +964,20 @@ class GridBot:
         if not self.is_running: return
         log.warning("Deteniendo lógica del bot...")
         self.is_running = False
+        self._publish_engine_state()
+        self.connector.stop_stream()
+        self._stop_executor()
         
         # Forcem un últim backup abans de parar
         try:
             self._backup_current_session_pnl()
         except: pass
+        self.db.flush()
 
         send_msg("🛑 <b>MOTOR DETENIDO</b>\nEl bot se ha apagado.")
         log.success("Bot detenido.")
 
     def _monitoring_loop(self):
-        delay = self.config['system']['cycle_delay']
         spin_chars = ["|", "/", "-", "\\"]
         idx = 0
         while self.is_running:
@@ -618,23 +995,41 @@ class GridBot:
                 time.sleep(1)
                 continue
 
+            self._wake_event.clear()
             if self.connector.check_and_reload_config():
                 self._handle_smart_reload()
+
+            if self.connector.is_rate_limited():
+                wait_s = int(self.connector.governor.remaining_block())
+                log.status(f"{Fore.RED}LÍMITE API{Fore.RESET} - Circuito abierto, reanudando en {wait_s}s... {spin_chars[idx]}")
+                idx = (idx + 1) % 4
+                time.sleep(1)
+                continue
             
-            for symbol in self.active_pairs:
-                self._ensure_grid_consistency(symbol)
+            # Precio de todos los pares (1 llamada por lotes o memoria del stream) y solo
+            # se reconcilian los que han cruzado una frontera, tienen un fill o toca barrido
+            poll = self.config.get('system', {}).get('price_poll_interval', 1)
+            dirty, prices = self._collect_dirty_symbols(poll)
+            if dirty:
+                self._reconcile_cycle(dirty)
+                self._after_reconcile(dirty, prices)
             
-            display_status = f"{Fore.GREEN}EN MARCHA{Fore.RESET} | Monitorizando {len(self.active_pairs)} pares | {spin_chars[idx]}"
+            weight_pct = self.connector.governor.usage_ratio() * 100
+            display_status = f"{Fore.GREEN}EN MARCHA{Fore.RESET} | Monitorizando {len(self.active_pairs)} pares ({len(dirty)} activos) | Ciclo {self.last_cycle_time:.1f}s | Peso API {weight_pct:.0f}% | {spin_chars[idx]}"
             log.status(display_status)
             idx = (idx + 1) % 4
-            time.sleep(delay)
+            # Dormimos hasta el siguiente tick de precio o hasta que un evento (fill, config) nos despierte
+            self._wake_event.wait(poll)
 
     def _shutdown(self):
         self.is_running = False
+        self.connector.stop_stream()
+        self._stop_executor()
         # Forcem un últim backup en sortir per Ctrl+C
         try:
             self._backup_current_session_pnl()
         except: pass
+        self.db.close()
         print()
         log.warning("--- DETENIENDO GRIDBOT ---")
         log.success("Bot detenido.")
\ No newline at end of file
@@ -3,100 +3,585 @@ import sqlite3
 import json
 import time
 import os
+import threading
+import numpy as np
+from core import archive
 from utils.logger import log
 
 DB_FOLDER = "data"
 DB_NAME = "bot_data.db"
 DB_PATH = os.path.join(DB_FOLDER, DB_NAME)
+SCHEMA_VERSION = 6   # Última migració de BotDatabase._migrations (PRAGMA user_version)
+
+# Pragmas por conexión (journal_mode=WAL es persistente y se fija una vez en _init_db)
+CONN_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;",     # Con WAL es seguro ante cuelgues del proceso y mucho más rápido que FULL
+    "PRAGMA cache_size=-8192;",       # 8 MB de caché de páginas por conexión
+    "PRAGMA mmap_size=268435456;",    # Lecturas vía mmap (hasta 256 MB)
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA journal_size_limit=67108864;",  # Tras cada checkpoint el fichero WAL se recorta a 64 MB como máximo
+)
+
+# Mantenimiento incremental: lotes pequeños en transacciones cortas (ninguna escritura del bot espera más de unos ms)
+MAINT_BATCH_ROWS = 200
+MAINT_VACUUM_PAGES = 128
+MAINT_ARCHIVE_ROWS = MAINT_BATCH_ROWS * 5   # Filas exportadas al Parquet por bloque: se borran enteras, así que el bloque cabe en el presupuesto
+MAINT_VACUUM_MB_PER_SEC = 50   # Estimación para avisar de la duración del VACUUM único
+MAINT_PAUSE = 0.01   # Pausa entre lotes: deja pasar a los escritores que esperan el lock (su busy handler reintenta con backoff)
+
+TRADE_COLUMNS = ('id', 'symbol', 'side', 'price', 'amount', 'cost', 'fee_cost', 'fee_currency', 'timestamp', 'buy_id')
+BALANCE_COLUMNS = ('timestamp', 'equity')
+
+# Agregats de PnL per parell i hora (get_stats suma cubetes en lloc de recórrer tots els trades)
+PNL_BUCKET_MS = 3600 * 1000
+# Mateixes regles que get_stats: 'sell' suma el cost, qualsevol altre costat el resta; la comissió sempre resta
+CASH_FLOW_SQL = "(CASE WHEN side='sell' THEN COALESCE(cost, 0) ELSE -COALESCE(cost, 0) END) - COALESCE(fee_cost, 0)"
+QTY_DELTA_SQL = "(CASE WHEN side='buy' THEN COALESCE(amount, 0) ELSE -COALESCE(amount, 0) END)"
+
+# Velas: el recolector guarda la base (15m); los timeframes superiores se agregan al leer
+CANDLE_BASE_TIMEFRAME = '15m'
+CANDLE_FIELDS = ('time', 'open', 'high', 'low', 'close', 'volume')
+TIMEFRAME_UNITS_MS = {'m': 60 * 1000, 'h': 3600 * 1000, 'd': 86400 * 1000, 'w': 7 * 86400 * 1000}
+
+def timeframe_to_ms(timeframe):
+    """'15m' -> 900000, '4h' -> 14400000 (None si no se reconoce)"""
+    try: return int(timeframe[:-1]) * TIMEFRAME_UNITS_MS[timeframe[-1]]
+    except (ValueError, KeyError, IndexError, TypeError): return None
+
+def resample_ohlcv(arrays, timeframe_ms):
+    """Agrega arrays OHLCV a un timeframe mayor (open=primero, high=max, low=min, close=último, volumen=suma)"""
+    t = arrays['time']
+    if len(t) == 0: return arrays
+    group = (t // timeframe_ms).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    ends = np.r_[starts[1:], len(t)] - 1
+    return {
+        'time': group[starts] * timeframe_ms,
+        'open': arrays['open'][starts],
+        'high': np.maximum.reduceat(arrays['high'], starts),
+        'low': np.minimum.reduceat(arrays['low'], starts),
+        'close': arrays['close'][ends],
+        'volume': np.add.reduceat(arrays['volume'], starts),
+    }
+
+def downsample_ohlcv(arrays, max_points, base_ms):
+    """Agrupa velas en trams múltiplos del timeframe original hasta que caben en max_points (OHLC exacto)"""
+    t = arrays['time']
+    if not max_points or len(t) <= max_points: return arrays
+    span = int(t[-1] - t[0]) + base_ms
+    step = -(-span // (max_points * base_ms)) * base_ms   # ceil al múltiplo de la vela base
+    return resample_ohlcv(arrays, step)
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: reduce la serie (x, y) a n_out puntos conservando picos y valles.
+    Las medias de cada tramo se calculan de golpe con NumPy; el bucle solo elige el punto de cada tramo.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3: return x, y
+    # Tramos interiores: el primer y el último punto se conservan siempre
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sums_x, sums_y = np.add.reduceat(x[:-1], edges[:-1]), np.add.reduceat(y[:-1], edges[:-1])
+    counts = np.diff(edges)
+    avg_x, avg_y = sums_x / counts, sums_y / counts
+    # Ancla del tramo siguiente: su media (para el último tramo, el último punto)
+    next_x, next_y = np.r_[avg_x[1:], x[-1]], np.r_[avg_y[1:], y[-1]]
+
+    picks = np.empty(n_out, dtype=np.int64)
+    picks[0], picks[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[prev] - next_x[i]) * (by - y[prev]) - (x[prev] - bx) * (next_y[i] - y[prev]))
+        prev = lo + int(np.argmax(area))
+        picks[i + 1] = prev
+    return x[picks], y[picks]
+
+# Rollups d'equity: 5 min, 1 h i 1 dia (OHLC). El raw es purga als 30 dies i el tram de 5 min
+# als BALANCE_5M_KEEP_DAYS; l'horari i el diari es guarden sempre (mida gairebé constant)
+BALANCE_TIERS = (300, 3600, 86400)
+BALANCE_5M_KEEP_DAYS = 180
+LTTB_SOURCE_POINTS = 50000   # Puntos máximos que se leen para LTTB (los 30 días de raw a 1/min caben enteros)
+
+def _upsert_balance_rollups(cursor, points):
+    """Actualitza els trams OHLC amb punts (timestamp, equity) en ordre cronològic"""
+    rows = [(tier, int(ts) // tier * tier, eq, eq, eq, eq) for ts, eq in points for tier in BALANCE_TIERS]
+    cursor.executemany('''
+        INSERT INTO balance_rollups (tier, bucket_start, open, high, low, close, samples) VALUES (?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(tier, bucket_start) DO UPDATE SET
+            high = MAX(high, excluded.high),
+            low = MIN(low, excluded.low),
+            close = excluded.close,
+            samples = samples + 1
+    ''', rows)
+
+# Escriptura diferida de snapshots (market_data, candles, grid_status, pnl_backup, balance_history)
+WRITE_BEHIND_INTERVAL = 1.0
+WRITE_BEHIND_MAX_BALANCES = 1440   # Punts d'equity que es guarden en cua si la BD falla (un dia a 1/min); els més antics es descarten
+WRITE_BEHIND_JOIN_TIMEOUT = 5.0
+
+# --- VERSIONS DE DADES ---
+# Comptadors en memòria que pugen amb cada escriptura (per parell o per tipus de dada).
+# El servidor web els fa servir com a clau de caché i ETag de les respostes.
+VERSION_ALL = 'all'   # Canvis en bloc (resets, esborrats, sessions): invaliden qualsevol resposta
+_data_versions = {}
+_versions_lock = threading.Lock()
+
+def bump_version(*keys):
+    with _versions_lock:
+        for key in keys: _data_versions[key] = _data_versions.get(key, 0) + 1
+
+def data_version(*keys):
+    with _versions_lock:
+        return tuple(_data_versions.get(key, 0) for key in keys)
+
+def _open_conn():
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    for pragma in CONN_PRAGMAS:
+        try: conn.execute(pragma)
+        except sqlite3.Error: pass
+    return conn
+
+class _SnapshotWriter:
+    """
+    Cua write-behind única per procés (compartida pel bot i pel servidor web).
+    Els snapshots repetits d'un mateix parell es fusionen (només val l'últim) i tot el que
+    s'ha acumulat s'escriu en UNA transacció cada WRITE_BEHIND_INTERVAL segons.
+    Els trades i els canvis d'estat no passen per aquí: continuen sent síncrons.
+    """
+    def __init__(self, interval=WRITE_BEHIND_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()        # Protegeix la cua
+        self._flush_lock = threading.Lock()  # Una sola transacció d'escriptura alhora
+        self._pending = {}                   # (tipus, symbol) -> dades (l'últim guanya)
+        self._balances = []                  # Punts d'equity: no es fusionen, s'agrupen
+        self._event = threading.Event()
+        self._thread = None
+        self._running = False
+        self._generation = 0                 # stop() la incrementa: un fil d'una generació antiga surt del bucle
+        self._conn = None
+
+    def submit(self, kind, symbol, data):
+        with self._lock:
+            key = (kind, symbol)
+            previous = self._pending.get(key)
+            if kind == 'market' and previous:
+                # Les veles no es perden en fusionar: s'acumulen per (timeframe, open_time)
+                merged = dict(previous['candles'])
+                merged.update(data['candles'])
+                data['candles'] = merged
+            self._pending[key] = data
+        self._ensure_thread()
+
+    def submit_balance(self, timestamp, equity):
+        with self._lock:
+            self._balances.append((timestamp, equity))
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._running: return
+        with self._lock:
+            if self._running: return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, args=(self._generation,), daemon=True)
+            self._thread.start()
+
+    def _run(self, generation):
+        while self._generation == generation:
+            self._event.wait(self.interval)
+            self._event.clear()
+            if self._generation != generation: break
+            self.flush()
+
+    def flush(self):
+        """Escriu ara tot el pendent (una transacció). Es pot cridar des de qualsevol fil."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                balances, self._balances = self._balances, []
+            if not pending and not balances: return
+            try:
+                if self._conn is None: self._conn = _open_conn()
+                with self._conn as conn:
+                    cursor = conn.cursor()
+                    for (kind, symbol), data in pending.items():
+                        if kind == 'market': self._write_market(cursor, symbol, data)
+                        elif kind == 'grid': self._write_grid(cursor, symbol, data)
+                        elif kind == 'pnl':
+                            cursor.execute("INSERT OR REPLACE INTO pnl_backup (symbol, pnl_value, updated_at) VALUES (?, ?, ?)",
+                                           (symbol, data['pnl'], data['ts']))
+                    if balances:
+                        cursor.executemany("INSERT OR IGNORE INTO balance_history (timestamp, equity) VALUES (?, ?)", balances)
+                        _upsert_balance_rollups(cursor, balances)
+                bump_version(*{('market', symbol) for kind, symbol in pending if kind in ('market', 'grid')})
+                if balances: bump_version('balance')
+            except Exception as e:
+                log.error(f"Error escribiendo snapshots en BD: {e}. Se reintentará en el próximo lote.")
+                self._requeue(pending, balances)
+
+    def _requeue(self, pending, balances):
+        """Torna a la cua el que no s'ha pogut escriure sense trepitjar el que hi hagi arribat mentrestant"""
+        with self._lock:
+            for key, data in pending.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = data
+                elif key[0] == 'market':
+                    # El preu nou guanya; les veles antigues que no s'han escrit s'hi afegeixen per sota
+                    merged = dict(data['candles'])
+                    merged.update(newer['candles'])
+                    newer['candles'] = merged
+            self._balances = balances + self._balances
+            dropped = len(self._balances) - WRITE_BEHIND_MAX_BALANCES
+            if dropped > 0:
+                self._balances = self._balances[dropped:]
+                log.warning(f"Cua d'equity plena: es descarten {dropped} punts antics no escrits.")
+
+    def _write_market(self, cursor, symbol, data):
+        cursor.execute('''INSERT INTO market_data (symbol, price, updated_at) VALUES (?, ?, ?)
+                          ON CONFLICT(symbol) DO UPDATE SET price=excluded.price, updated_at=excluded.updated_at''',
+                       (symbol, data['price'], data['ts']))
+        if not data['candles']: return
+        cursor.executemany('''INSERT OR REPLACE INTO candles (symbol, timeframe, open_time, open, high, low, close, volume)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                           [(symbol, tf, open_time, c[1], c[2], c[3], c[4], c[5]) for (tf, open_time), c in data['candles'].items()])
+        # Mantenemos solo las últimas 'keep' velas (como el ring buffer en memoria)
+        for tf in {tf for tf, _ in data['candles']}:
+            cursor.execute('''DELETE FROM candles WHERE symbol=? AND timeframe=? AND open_time < (
+                                SELECT open_time FROM candles WHERE symbol=? AND timeframe=? ORDER BY open_time DESC LIMIT 1 OFFSET ?)''',
+                           (symbol, tf, symbol, tf, data['keep'] - 1))
+
+    def _write_grid(self, cursor, symbol, data):
+        # Upsert que no toca setup_done (abans calia llegir-lo primer per no perdre'l)
+        cursor.execute('''INSERT INTO grid_status (symbol, open_orders_json, grid_levels_json, updated_at) VALUES (?, ?, ?, ?)
+                          ON CONFLICT(symbol) DO UPDATE SET open_orders_json=excluded.open_orders_json,
+                              grid_levels_json=excluded.grid_levels_json, updated_at=excluded.updated_at''',
+                       (symbol, data['orders'], data['levels'], data['ts']))
+
+    def stop(self):
+        """Atura el fil (esperant que acabi) i buida la cua (apagat). Un submit posterior n'arrenca un de nou."""
+        with self._lock:
+            self._running = False
+            self._generation += 1
+            thread, self._thread = self._thread, None
+        self._event.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(WRITE_BEHIND_JOIN_TIMEOUT)
+        self.flush()
+        with self._flush_lock:
+            if self._conn is not None:
+                try: self._conn.close()
+                except sqlite3.Error: pass
+                self._conn = None
+
+_writer = _SnapshotWriter()
 
 class BotDatabase:
     def __init__(self):
         if not os.path.exists(DB_FOLDER):
             os.makedirs(DB_FOLDER)
+        # Una conexión persistente por hilo (bot, recolector, workers y threadpool de FastAPI)
+        self._local = threading.local()
+        self._conns = {}          # ident del hilo -> (hilo, conexión)
+        self._conns_lock = threading.Lock()
+        self._generation = 0      # close() la incrementa: los hilos reabren en su próximo acceso
+        self._auto_vacuum_checked = False
         self._init_db()
 
     def _get_conn(self):
-        """Abre una conexión nueva segura para el hilo actual"""
-        return sqlite3.connect(DB_PATH, timeout=30) 
+        """Conexión del hilo actual (se abre una sola vez y se reutiliza; 'with' solo delimita la transacción)"""
+        cached = getattr(self._local, 'conn', None)
+        if cached and cached[0] == self._generation: return cached[1]
+
+        conn = _open_conn()
+        current = threading.current_thread()
+        with self._conns_lock:
+            # Las conexiones de hilos que ya han terminado (p.ej. workers del pool) se cierran aquí
+            for ident, (thread, old) in list(self._conns.items()):
+                if not thread.is_alive() or ident == current.ident:
+                    try: old.close()
+                    except sqlite3.Error: pass
+                    del self._conns[ident]
+            self._conns[current.ident] = (current, conn)
+            self._local.conn = (self._generation, conn)
+        return conn
+
+    def flush(self):
+        """
+        Escribe ya los snapshots pendientes de la cola write-behind.
+        Los métodos que borran o reinician esas tablas lo llaman primero para conservar el orden.
+        """
+        _writer.flush()
+
+    def close(self):
+        """Vacía la cola y cierra todas las conexiones abiertas (apagado). Un uso posterior reabre bajo demanda."""
+        _writer.stop()
+        with self._conns_lock:
+            self._generation += 1
+            for _, conn in self._conns.values():
+                try: conn.close()
+                except sqlite3.Error: pass
+            self._conns = {}
+
+    def _enable_incremental_vacuum(self, conn):
+        """
+        auto_vacuum=INCREMENTAL. En una BD nova s'aplica directament; en una ja creada cal un VACUUM únic,
+        que no es fa aquí (bloquejaria l'arrencada) sinó a la primera passada de manteniment.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2: return True
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+
+    def _convert_to_incremental_vacuum(self, conn):
+        """VACUUM únic que activa auto_vacuum incremental en una BD existent (avisa de la mida i del temps estimat)"""
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        size_mb = page_count * page_size / (1024 * 1024)
+        log.warning(f"🧹 Activant auto_vacuum incremental: VACUUM únic de {size_mb:.0f} MB "
+                    f"(~{max(1, round(size_mb / MAINT_VACUUM_MB_PER_SEC))}s, les escriptures esperaran)...")
+        start = time.perf_counter()
+        try:
+            self.flush()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            log.success(f"auto_vacuum incremental actiu ({time.perf_counter() - start:.1f}s).")
+        except Exception as e:
+            log.warning(f"No s'ha pogut activar auto_vacuum incremental: {e}")
 
     def _init_db(self):
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            
-            try: cursor.execute("PRAGMA journal_mode=WAL;")
-            except: pass
-            
-            cursor.execute('''CREATE TABLE IF NOT EXISTS market_data (symbol TEXT PRIMARY KEY, price REAL, candles_json TEXT, updated_at REAL)''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS grid_status (symbol TEXT PRIMARY KEY, open_orders_json TEXT, grid_levels_json TEXT, updated_at REAL)''')
-            
-            try: cursor.execute("ALTER TABLE grid_status ADD COLUMN setup_done BOOLEAN DEFAULT 0")
-            except: pass 
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS trade_history (
-                    id TEXT PRIMARY KEY,
-                    symbol TEXT,
-                    side TEXT,
-                    price REAL,
-                    amount REAL,
-                    cost REAL,
-                    fee_cost REAL,
-                    fee_currency TEXT,
-                    timestamp REAL,
-                    buy_id INTEGER
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS balance_history (
-                    timestamp REAL PRIMARY KEY,
-                    equity REAL
-                )
-            ''')
-            
-            cursor.execute('''CREATE TABLE IF NOT EXISTS bot_info (key TEXT PRIMARY KEY, value TEXT)''')
-            
-            # --- SISTEMA PNL PER SESSIONS (Robust) ---
-            
-            # 1. HISTÒRIC: Resultats consolidats de sessions anteriors
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS pnl_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    symbol TEXT,
-                    pnl_value REAL,
-                    timestamp REAL
-                )
-            ''')
-
-            # 2. BACKUP: Estat actual de la sessió viva (per si hi ha crash)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS pnl_backup (
-                    symbol TEXT PRIMARY KEY,
-                    pnl_value REAL,
-                    updated_at REAL
-                )
-            ''')
-            # -----------------------------------------------------
-
-            cursor.execute("SELECT value FROM bot_info WHERE key='next_buy_id'")
-            if not cursor.fetchone():
-                cursor.execute("INSERT INTO bot_info (key, value) VALUES (?, ?)", ('next_buy_id', '1'))
-                
-            cursor.execute("SELECT value FROM bot_info WHERE key='first_run'")
-            if not cursor.fetchone():
-                cursor.execute("INSERT INTO bot_info (key, value) VALUES (?, ?)", ('first_run', str(time.time())))
-            
-            conn.commit()
+        """Arrencada: una lectura de PRAGMA user_version; només s'executen les migracions pendents"""
+        conn = self._get_conn()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION: return
+        if not self._enable_incremental_vacuum(conn):
+            log.info("auto_vacuum incremental pendent: el VACUUM únic es farà a la primera passada de manteniment.")
+        try: conn.execute("PRAGMA journal_mode=WAL;")
+        except: pass
+        self._migrate(conn)
+
+    # --- MIGRACIONS D'ESQUEMA (PRAGMA user_version) ---
+
+    def _migrations(self):
+        """Migracions numerades en ordre. Les BDs antigues (user_version=0) ja poden tenir part de l'esquema: cada pas és idempotent."""
+        return (
+            (1, "esquema base", self._m1_base_schema),
+            (2, "índexs de trade_history", self._m2_trade_indexes),
+            (3, "cursors de sincronització de trades", self._m3_trade_cursors),
+            (4, "agregats de PnL per hores", self._m4_pnl_buckets),
+            (5, "velas fila a fila", self._m5_candles),
+            (6, "rollups d'equity", self._m6_balance_rollups),
+        )
+
+    def _migrate(self, conn):
+        """Aplica cada migració pendent en la seva pròpia transacció, juntament amb el nou user_version"""
+        for version, name, step in self._migrations():
+            # BEGIN IMMEDIATE serialitza dues instàncies que arrenquen alhora (bot + servidor web)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                log.info(f"🗄️ Migració BD v{version}: {name}...")
+                step(conn.cursor())
+                conn.execute(f"PRAGMA user_version={version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _m1_base_schema(self, cursor):
+        cursor.execute('''CREATE TABLE IF NOT EXISTS market_data (symbol TEXT PRIMARY KEY, price REAL, candles_json TEXT, updated_at REAL)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS grid_status (symbol TEXT PRIMARY KEY, open_orders_json TEXT, grid_levels_json TEXT, updated_at REAL)''')
+        cursor.execute("PRAGMA table_info(grid_status)")
+        if 'setup_done' not in [col[1] for col in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE grid_status ADD COLUMN setup_done BOOLEAN DEFAULT 0")
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS trade_history (
+                id TEXT PRIMARY KEY,
+                symbol TEXT,
+                side TEXT,
+                price REAL,
+                amount REAL,
+                cost REAL,
+                fee_cost REAL,
+                fee_currency TEXT,
+                timestamp REAL,
+                buy_id INTEGER
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS balance_history (
+                timestamp REAL PRIMARY KEY,
+                equity REAL
+            )
+        ''')
+        
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_info (key TEXT PRIMARY KEY, value TEXT)''')
+        
+        # --- SISTEMA PNL PER SESSIONS (Robust) ---
+        
+        # 1. HISTÒRIC: Resultats consolidats de sessions anteriors
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pnl_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT,
+                pnl_value REAL,
+                timestamp REAL
+            )
+        ''')
+
+        # 2. BACKUP: Estat actual de la sessió viva (per si hi ha crash)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pnl_backup (
+                symbol TEXT PRIMARY KEY,
+                pnl_value REAL,
+                updated_at REAL
+            )
+        ''')
+        # -----------------------------------------------------
+
+        cursor.execute("INSERT OR IGNORE INTO bot_info (key, value) VALUES (?, ?)", ('next_buy_id', '1'))
+        cursor.execute("INSERT OR IGNORE INTO bot_info (key, value) VALUES (?, ?)", ('first_run', str(time.time())))
+
+    def _m2_trade_indexes(self, cursor):
+        # Índexs de les consultes calentes de trade_history (sense ells totes fan SCAN de la taula):
+        #  - (symbol, side, timestamp): última compra, compra vinculada a una venda
+        #  - (symbol, timestamp): últims trades del parell (dashboard), esborrats per parell
+        #  - (timestamp): estadístiques de sessió i purga per antiguitat
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_symbol_side_ts ON trade_history (symbol, side, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_symbol_ts ON trade_history (symbol, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_ts ON trade_history (timestamp)")
+
+    def _m3_trade_cursors(self, cursor):
+        # Cursor de sincronització incremental de trades (últim id/timestamp vist per parell)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS trade_cursors (
+                symbol TEXT PRIMARY KEY,
+                last_id INTEGER,
+                last_ts REAL,
+                updated_at REAL
+            )
+        ''')
+
+    def _m4_pnl_buckets(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pnl_buckets (
+                symbol TEXT,
+                bucket_start INTEGER,
+                cash_flow REAL,
+                qty_delta REAL,
+                trades INTEGER,
+                PRIMARY KEY (symbol, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        # BDs amb trades anteriors a la taula d'agregats
+        self._rebuild_pnl_buckets(cursor)
+
+    def _m5_candles(self, cursor):
+        # Velas fila a fila: el recolector solo hace upsert de las velas que cambian
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS candles (
+                symbol TEXT,
+                timeframe TEXT,
+                open_time INTEGER,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                volume REAL,
+                PRIMARY KEY (symbol, timeframe, open_time)
+            ) WITHOUT ROWID
+        ''')
+        # Els blobs candles_json antics passen a files de la taula candles i es buiden
+        cursor.execute("SELECT symbol, candles_json FROM market_data WHERE candles_json IS NOT NULL")
+        for sym, blob in cursor.fetchall():
+            try:
+                rows = [(sym, CANDLE_BASE_TIMEFRAME, int(c[0]), c[1], c[2], c[3], c[4], c[5]) for c in json.loads(blob)]
+                cursor.executemany('''INSERT OR IGNORE INTO candles (symbol, timeframe, open_time, open, high, low, close, volume)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            except Exception: pass
+        cursor.execute("UPDATE market_data SET candles_json=NULL WHERE candles_json IS NOT NULL")
+
+    def _m6_balance_rollups(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS balance_rollups (
+                tier INTEGER,
+                bucket_start INTEGER,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                samples INTEGER,
+                PRIMARY KEY (tier, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        # Rollups d'equity a partir de l'històric existent (si ja n'hi ha, poden cobrir dades ja purgades: es conserven)
+        cursor.execute("SELECT 1 FROM balance_rollups LIMIT 1")
+        if cursor.fetchone(): return
+        cursor.execute("SELECT timestamp, equity FROM balance_history ORDER BY timestamp ASC")
+        points = cursor.fetchall()
+        if points: _upsert_balance_rollups(cursor, points)
+
+    # --- AGREGATS PNL PER HORES ---
+
+    def _add_to_pnl_bucket(self, cursor, symbol, side, cost, fee, amount, timestamp):
+        cash_flow = (cost if side == 'sell' else -cost) - (fee or 0.0)
+        qty_delta = amount if side == 'buy' else -amount
+        bucket = int(timestamp) // PNL_BUCKET_MS * PNL_BUCKET_MS
+        cursor.execute('''
+            INSERT INTO pnl_buckets (symbol, bucket_start, cash_flow, qty_delta, trades) VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(symbol, bucket_start) DO UPDATE SET
+                cash_flow = cash_flow + excluded.cash_flow,
+                qty_delta = qty_delta + excluded.qty_delta,
+                trades = trades + 1
+        ''', (symbol, bucket, cash_flow, qty_delta))
+
+    def _rebuild_pnl_buckets(self, cursor, symbol=None):
+        """Recalcula les cubetes des de trade_history (totes o les d'un parell)"""
+        clause, params = (" WHERE symbol=?", [symbol]) if symbol is not None else ("", [])
+        cursor.execute(f"DELETE FROM pnl_buckets{clause}", params)
+        cursor.execute(f'''
+            INSERT INTO pnl_buckets (symbol, bucket_start, cash_flow, qty_delta, trades)
+            SELECT symbol, CAST(timestamp AS INTEGER) / {PNL_BUCKET_MS} * {PNL_BUCKET_MS} AS b,
+                   SUM({CASH_FLOW_SQL}), SUM({QTY_DELTA_SQL}), COUNT(*)
+            FROM trade_history{clause}
+            GROUP BY symbol, b
+        ''', params)
+
+    def _sum_stats_range(self, cursor, symbol, start_ms):
+        """_sum_pnl_range + els trades ja arxivats a Parquet (els anteriors al trade viu més antic del parell)"""
+        cash_flow, qty_delta, count = self._sum_pnl_range(cursor, symbol, start_ms)
+        cursor.execute("SELECT MIN(timestamp) FROM trade_history WHERE symbol=?", (symbol,))
+        oldest_live = cursor.fetchone()[0]
+        if oldest_live is not None and start_ms >= oldest_live: return cash_flow, qty_delta, count
+        archived_cf, archived_qty, archived_count = archive.trade_totals(symbol, start_ms, oldest_live)
+        return cash_flow + archived_cf, qty_delta + archived_qty, count + archived_count
+
+    def _sum_pnl_range(self, cursor, symbol, start_ms):
+        """(cash_flow, qty_delta, trades) del parell des de start_ms: cubetes senceres + la primera hora parcial en cru"""
+        first_full = -(-int(start_ms) // PNL_BUCKET_MS) * PNL_BUCKET_MS
+        cursor.execute("SELECT SUM(cash_flow), SUM(qty_delta), SUM(trades) FROM pnl_buckets WHERE symbol=? AND bucket_start >= ?",
+                       (symbol, first_full))
+        cash_flow, qty_delta, count = cursor.fetchone()
+        cash_flow, qty_delta, count = cash_flow or 0.0, qty_delta or 0.0, count or 0
+        if first_full > start_ms:
+            cursor.execute(f'''
+                SELECT SUM({CASH_FLOW_SQL}), SUM({QTY_DELTA_SQL}), COUNT(*) FROM trade_history
+                WHERE symbol=? AND timestamp >= ? AND timestamp < ?
+            ''', (symbol, start_ms, first_full))
+            part_cf, part_qty, part_count = cursor.fetchone()
+            cash_flow += part_cf or 0.0
+            qty_delta += part_qty or 0.0
+            count += part_count or 0
+        return cash_flow, qty_delta, count
 
     # --- GESTIÓ DE PNL SESSIONS ---
 
     def update_pnl_backup(self, symbol, current_pnl):
-        """Guarda el PnL de la sessió actual a la taula de seguretat (Backup)."""
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT OR REPLACE INTO pnl_backup (symbol, pnl_value, updated_at) VALUES (?, ?, ?)", 
-                           (symbol, current_pnl, time.time()))
-            conn.commit()
+        """Guarda el PnL de la sessió actual a la taula de seguretat (Backup). Diferit: s'escriu en el següent lot."""
+        _writer.submit('pnl', symbol, {'pnl': current_pnl, 'ts': time.time()})
 
     def archive_session_stats(self):
         """
@@ -104,6 +589,7 @@ class BotDatabase:
         Agafa el backup de la sessió anterior (si existeix) i el guarda a l'històric permanent.
         Després neteja el backup per començar de 0.
         """
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             
@@ -122,8 +608,9 @@ class BotDatabase:
                 # 2. Netegem el backup per començar la nova sessió neta
                 cursor.execute("DELETE FROM pnl_backup")
                 conn.commit()
-                return True
-            return False
+        if not rows: return False
+        bump_version(VERSION_ALL)
+        return True
 
     def get_accumulated_pnl(self, symbol):
         """Retorna la suma de TOTES les sessions anteriors (Històric)."""
@@ -134,21 +621,32 @@ class BotDatabase:
             # Si és None (no hi ha historial), retorna 0.0
             return row[0] if row and row[0] is not None else 0.0
 
+    def get_accumulated_pnl_map(self):
+        """get_accumulated_pnl de tots els parells amb una sola consulta: {symbol: suma}"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT symbol, SUM(pnl_value) FROM pnl_history GROUP BY symbol")
+            return {sym: total or 0.0 for sym, total in cursor.fetchall()}
+
     def reset_global_pnl_history(self):
         """Esborra tot l'històric i el backup. Reset Global total."""
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM pnl_history")
             cursor.execute("DELETE FROM pnl_backup")
             conn.commit()
+        bump_version(VERSION_ALL)
             
     def reset_global_pnl_for_symbol(self, symbol):
         """Esborra historial només d'una moneda"""
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM pnl_history WHERE symbol=?", (symbol,))
             cursor.execute("DELETE FROM pnl_backup WHERE symbol=?", (symbol,))
             conn.commit()
+        bump_version(VERSION_ALL)
 
     # -------------------------------------------------------
     # RESTA DE FUNCIONS (Sense canvis, només manteniment)
@@ -156,21 +654,26 @@ class BotDatabase:
     def get_next_buy_id(self):
         with self._get_conn() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT value FROM bot_info WHERE key='next_buy_id'")
-            row = cursor.fetchone()
-            current_id = int(row[0]) if row else 1
-            assigned_id = current_id
-            next_id = current_id + 1
-            if next_id > 1000: next_id = 1
-            cursor.execute("INSERT OR REPLACE INTO bot_info (key, value) VALUES (?, ?)", ('next_buy_id', str(next_id)))
+            assigned_id = self._take_next_buy_id(cursor)
             conn.commit()
             return assigned_id
 
+    def _take_next_buy_id(self, cursor):
+        """Reserva el siguiente ID de compra (1..1000 cíclico) dentro de la transacción del cursor dado"""
+        cursor.execute("SELECT value FROM bot_info WHERE key='next_buy_id'")
+        row = cursor.fetchone()
+        current_id = int(row[0]) if row else 1
+        next_id = current_id + 1
+        if next_id > 1000: next_id = 1
+        cursor.execute("INSERT OR REPLACE INTO bot_info (key, value) VALUES (?, ?)", ('next_buy_id', str(next_id)))
+        return current_id
+
     def set_trade_buy_id(self, trade_id, buy_id):
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE trade_history SET buy_id = ? WHERE id = ?", (buy_id, trade_id))
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def get_last_buy_price(self, symbol):
         with self._get_conn() as conn:
@@ -194,10 +697,7 @@ class BotDatabase:
             return row[0] if row else None
 
     def log_balance_snapshot(self, equity):
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO balance_history (timestamp, equity) VALUES (?, ?)", (time.time(), equity))
-            conn.commit()
+        _writer.submit_balance(time.time(), equity)
 
     def get_balance_history(self, from_timestamp=0):
         with self._get_conn() as conn:
@@ -206,6 +706,49 @@ class BotDatabase:
             rows = cursor.fetchall()
             return rows
 
+    def get_balance_series(self, from_timestamp=0, max_points=500, to_timestamp=None):
+        """
+        Equity entre from_timestamp y to_timestamp reducida con LTTB a max_points puntos [(timestamp, equity)].
+        Fuente: el nivel más fino que cubre el rango con <= LTTB_SOURCE_POINTS puntos (raw -> 5 min -> 1 h -> 1 dia).
+        """
+        end = time.time() if to_timestamp is None else to_timestamp
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(bucket_start) FROM balance_rollups WHERE tier=?", (BALANCE_TIERS[-1],))
+            first = cursor.fetchone()[0]
+            if first is None: return []
+            start = max(from_timestamp, first)
+            span = max(end - start, 1)
+
+            cursor.execute("SELECT value FROM bot_info WHERE key='balance_raw_pruned_before'")
+            row = cursor.fetchone()
+            raw_cutoff = float(row[0]) if row else 0.0
+            rows = None
+            if from_timestamp >= raw_cutoff:
+                cursor.execute("SELECT COUNT(*) FROM balance_history WHERE timestamp >= ? AND timestamp <= ?", (from_timestamp, end))
+                if cursor.fetchone()[0] <= LTTB_SOURCE_POINTS:
+                    cursor.execute("SELECT timestamp, equity FROM balance_history WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp ASC",
+                                   (from_timestamp, end))
+                    rows = cursor.fetchall()
+
+            if rows is None:
+                fine_cutoff = time.time() - BALANCE_5M_KEEP_DAYS * 86400
+                tier = BALANCE_TIERS[-1]
+                for t in BALANCE_TIERS:
+                    if t == BALANCE_TIERS[0] and start < fine_cutoff: continue
+                    if span / t <= LTTB_SOURCE_POINTS:
+                        tier = t
+                        break
+                cursor.execute('''SELECT MAX(bucket_start, ?), close FROM balance_rollups
+                                  WHERE tier=? AND bucket_start >= ? AND bucket_start <= ? ORDER BY bucket_start ASC''',
+                               (from_timestamp, tier, int(from_timestamp) // tier * tier, end))
+                rows = cursor.fetchall()
+
+        if len(rows) <= max_points: return rows
+        data = np.array(rows, dtype=np.float64)
+        ts, equity = lttb(data[:, 0], data[:, 1], max_points)
+        return list(zip(ts.tolist(), equity.tolist()))
+
     def set_session_start_balance(self, value):
         with self._get_conn() as conn:
             cursor = conn.cursor()
@@ -267,20 +810,39 @@ class BotDatabase:
             cursor.execute("DELETE FROM bot_info WHERE key='coins_initial_equity'")
             conn.commit()
 
-    def update_market_snapshot(self, symbol, price, candles):
+    def update_market_snapshot(self, symbol, price, candles=None, timeframe='15m', keep=500):
+        """Encola el precio y las velas nuevas/modificadas; se escriben en el siguiente lote (write-behind)"""
+        _writer.submit('market', symbol, {
+            'price': price, 'ts': time.time(), 'keep': keep,
+            'candles': {(timeframe, int(c[0])): c for c in (candles or [])}
+        })
+
+    def get_candle_arrays(self, symbol, timeframe=CANDLE_BASE_TIMEFRAME, from_ms=0, to_ms=None):
+        """
+        Velas como arrays NumPy {'time', 'open', 'high', 'low', 'close', 'volume'} (sin JSON), opcionalmente en un rango.
+        Si el timeframe no está guardado pero es múltiplo de la base, se agrega desde la base.
+        """
         with self._get_conn() as conn:
             cursor = conn.cursor()
-            cursor.execute('''INSERT OR REPLACE INTO market_data (symbol, price, candles_json, updated_at) VALUES (?, ?, ?, ?)''', (symbol, price, json.dumps(candles), time.time()))
-            conn.commit()
+            query = """SELECT open_time, open, high, low, close, volume FROM candles
+                       WHERE symbol=? AND timeframe=? AND open_time >= ? AND open_time <= ? ORDER BY open_time ASC"""
+            to_ms = 2**62 if to_ms is None else to_ms
+            rows = cursor.execute(query, (symbol, timeframe, from_ms, to_ms)).fetchall()
+            resample_ms = None
+            if not rows and timeframe != CANDLE_BASE_TIMEFRAME:
+                tf_ms, base_ms = timeframe_to_ms(timeframe), timeframe_to_ms(CANDLE_BASE_TIMEFRAME)
+                if tf_ms and tf_ms > base_ms and tf_ms % base_ms == 0:
+                    rows = cursor.execute(query, (symbol, CANDLE_BASE_TIMEFRAME, from_ms // tf_ms * tf_ms, to_ms)).fetchall()
+                    resample_ms = tf_ms
+
+        data = np.array(rows, dtype=np.float64).reshape(-1, len(CANDLE_FIELDS))
+        arrays = {name: data[:, i] for i, name in enumerate(CANDLE_FIELDS)}
+        arrays['time'] = arrays['time'].astype(np.int64)
+        return resample_ohlcv(arrays, resample_ms) if resample_ms else arrays
 
     def update_grid_status(self, symbol, orders, levels):
-        with self._get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT setup_done FROM grid_status WHERE symbol=?", (symbol,))
-            row = cursor.fetchone()
-            setup_val = row[0] if row else 0
-            cursor.execute('''INSERT OR REPLACE INTO grid_status (symbol, open_orders_json, grid_levels_json, updated_at, setup_done) VALUES (?, ?, ?, ?, ?)''', (symbol, json.dumps(orders), json.dumps(levels), time.time(), setup_val))
-            conn.commit()
+        # Se serializa ya: las listas pueden cambiar antes de que se escriba el lote
+        _writer.submit('grid', symbol, {'orders': json.dumps(orders), 'levels': json.dumps(levels), 'ts': time.time()})
 
     def set_symbol_setup_done(self, symbol, status=True):
         with self._get_conn() as conn:
@@ -300,7 +862,9 @@ class BotDatabase:
             return False
 
     def save_trades(self, trades):
-        if not trades: return
+        """Guarda trades y devuelve solo los que eran nuevos (los duplicados se ignoran)"""
+        inserted = []
+        if not trades: return inserted
         with self._get_conn() as conn:
             cursor = conn.cursor()
             for t in trades:
@@ -325,16 +889,68 @@ class BotDatabase:
                         INSERT OR IGNORE INTO trade_history (id, symbol, side, price, amount, cost, fee_cost, fee_currency, timestamp)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                     ''', (t['id'], t['symbol'], t['side'], t['price'], t['amount'], t['cost'], fee_in_quote, 'USDC_EQ', t['timestamp']))
+                    if cursor.rowcount == 1:
+                        # Agregat actualitzat a la mateixa transacció (només si el trade era nou)
+                        self._add_to_pnl_bucket(cursor, t['symbol'], t['side'], float(t['cost'] or 0.0), fee_in_quote,
+                                                float(t['amount'] or 0.0), t['timestamp'])
+                        inserted.append(t)
                 except Exception as e: 
                     log.error(f"Error guardando trade DB: {e}")
                     pass
             conn.commit()
+        bump_version(*{('trades', t['symbol']) for t in inserted})
+        return inserted
+
+    def get_trades_by_ids(self, ids):
+        """Filas de trade_history (id, side, price, amount, cost, timestamp, buy_id) de los ids dados, más recientes primero"""
+        if not ids: return []
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join(['?'] * len(ids))
+            cursor.execute(f"""SELECT id, side, price, amount, cost, timestamp, buy_id FROM trade_history
+                               WHERE id IN ({placeholders}) ORDER BY timestamp DESC""", [str(i) for i in ids])
+            cols = [d[0] for d in cursor.description]
+            return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
+    def get_trade_cursor(self, symbol):
+        """(last_id, last_ts) del último trade sincronizado o (None, None) si no hay cursor"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT last_id, last_ts FROM trade_cursors WHERE symbol=?", (symbol,))
+            row = cursor.fetchone()
+            return (row[0], row[1]) if row else (None, None)
+
+    def set_trade_cursor(self, symbol, last_id, last_ts):
+        """Avanza el cursor (nunca retrocede aunque lleguen trades desordenados)"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO trade_cursors (symbol, last_id, last_ts, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(symbol) DO UPDATE SET
+                    last_id = MAX(COALESCE(trade_cursors.last_id, 0), excluded.last_id),
+                    last_ts = MAX(COALESCE(trade_cursors.last_ts, 0), excluded.last_ts),
+                    updated_at = excluded.updated_at
+            ''', (symbol, last_id, last_ts, time.time()))
+            conn.commit()
+
+    def set_trade_scan_ts(self, symbol, scanned_ts):
+        """Par sin ningún trade: guarda hasta dónde se ha explorado para no recorrer otra vez las mismas ventanas"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO trade_cursors (symbol, last_id, last_ts, updated_at) VALUES (?, NULL, ?, ?)
+                ON CONFLICT(symbol) DO UPDATE SET
+                    last_ts = MAX(COALESCE(trade_cursors.last_ts, 0), excluded.last_ts),
+                    updated_at = excluded.updated_at
+                WHERE trade_cursors.last_id IS NULL
+            ''', (symbol, scanned_ts, time.time()))
+            conn.commit()
 
     def get_pair_data(self, symbol):
         with self._get_conn() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("SELECT * FROM market_data WHERE symbol=?", (symbol,))
+            cursor.execute("SELECT price FROM market_data WHERE symbol=?", (symbol,))
             market_row = cursor.fetchone()
             market = {}
             if market_row:
@@ -357,10 +973,10 @@ class BotDatabase:
                     t_dict = dict(zip(cols, row))
                     if 'buy_id' not in t_dict: t_dict['buy_id'] = None
                     trades.append(t_dict)
-            
+
+            # Las velas ya no viajan aquí: get_candle_arrays() las sirve como arrays NumPy
             return {
                 "price": market.get('price', 0.0),
-                "candles": json.loads(market.get('candles_json', '[]')) if market.get('candles_json') else [],
                 "open_orders": json.loads(grid.get('open_orders_json', '[]')) if grid.get('open_orders_json') else [],
                 "grid_levels": json.loads(grid.get('grid_levels_json', '[]')) if grid.get('grid_levels_json') else [],
                 "trades": trades
@@ -383,12 +999,10 @@ class BotDatabase:
 
     def get_stats(self, from_timestamp=0):
         # Aquesta funció segueix sent l'encarregada de calcular la SESSIÓ ACTUAL
+        # Cost O(parells x hores) sobre pnl_buckets en lloc de O(trades)
+        from_ms = int(from_timestamp * 1000)
         with self._get_conn() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT symbol, side, cost, fee_cost, amount, timestamp FROM trade_history WHERE timestamp >= ?", (int(from_timestamp * 1000),))
-            rows = cursor.fetchall()
-
-            total_trades = len(rows)
             cash_flow_per_coin = {} 
             qty_delta_per_coin = {} 
             trades_per_coin = {} 
@@ -401,25 +1015,23 @@ class BotDatabase:
                 try: coin_sessions[sym] = float(v)
                 except: pass
 
-            for symbol, side, cost, fee, amount, ts in rows:
-                session_start_coin = coin_sessions.get(symbol, 0.0)
-                if from_timestamp > 0 and session_start_coin > 0 and ts < (session_start_coin * 1000):
-                    continue
-                
-                val = cost if side == 'sell' else -cost
-                net_val = val - (fee if fee else 0.0)
-                
-                if symbol not in cash_flow_per_coin: cash_flow_per_coin[symbol] = 0.0
-                cash_flow_per_coin[symbol] += net_val
+            total_trades = 0
+            cursor.execute("SELECT DISTINCT symbol FROM pnl_buckets")
+            symbols = [row[0] for row in cursor.fetchall()]
+            symbols += [s for s in archive.archived_symbols() if s not in symbols]
+            for symbol in symbols:
+                cash_flow, qty_delta, count = self._sum_stats_range(cursor, symbol, from_ms)
+                # El total de trades no aplica l'inici de sessió per moneda (igual que abans)
+                total_trades += count
 
-                if symbol not in qty_delta_per_coin: qty_delta_per_coin[symbol] = 0.0
-                if side == 'buy':
-                    qty_delta_per_coin[symbol] += amount
-                else:
-                    qty_delta_per_coin[symbol] -= amount
+                session_start_coin = coin_sessions.get(symbol, 0.0)
+                if from_timestamp > 0 and session_start_coin > 0 and session_start_coin * 1000 > from_ms:
+                    cash_flow, qty_delta, count = self._sum_stats_range(cursor, symbol, session_start_coin * 1000)
+                if count == 0: continue
 
-                if symbol not in trades_per_coin: trades_per_coin[symbol] = 0
-                trades_per_coin[symbol] += 1
+                cash_flow_per_coin[symbol] = cash_flow
+                qty_delta_per_coin[symbol] = qty_delta
+                trades_per_coin[symbol] = count
 
             best_coin = "-"
             highest_cf = -99999999.0
@@ -458,32 +1070,121 @@ class BotDatabase:
                 except: pass
             return all_orders
 
-    def prune_old_data(self, days_keep=30):
+    def maintenance_step(self, days_keep=30, budget_ms=200, archive=None):
+        """
+        Manteniment per lots amb pressupost de temps (substitueix la purga + VACUUM complet diari):
+        purga trades/equity antics en transaccions de MAINT_BATCH_ROWS files, allibera pàgines amb
+        incremental_vacuum i fa un checkpoint PASSIVE del WAL (no bloqueja mai els escriptors).
+        archive(kind, columns, rows) -> bool: si es passa, les files s'exporten ABANS d'esborrar-les;
+        si l'exportació falla no s'esborra res. Retorna el que s'ha fet; 'done'=False si queda feina.
+        """
+        self.flush()
+        deadline = time.perf_counter() + budget_ms / 1000
         cutoff = time.time() - (days_keep * 24 * 3600)
-        cutoff_ms = cutoff * 1000
-        
-        # FIX VACUUM: Execució fora de transacció
-        deleted_trades = 0
-        deleted_balance = 0
-        with self._get_conn() as conn:
+        result = {'trades': 0, 'balance': 0, 'rollups': 0, 'pages': 0, 'archive_failed': False, 'done': False}
+        conn = self._get_conn()
+
+        # 0. BD antiga sense auto_vacuum incremental: aquesta passada és el VACUUM únic (sense ell incremental_vacuum no fa res)
+        if not self._auto_vacuum_checked:
+            self._auto_vacuum_checked = True
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                self._convert_to_incremental_vacuum(conn)
+                return result
+
+        # 1. Trades i equity antics: bloc de MAINT_ARCHIVE_ROWS -> arxiu -> esborrat per ids en lots curts
+        jobs = (
+            ('trades', 'trade_history', TRADE_COLUMNS, cutoff * 1000, self._delete_trades_batch),
+            ('balance', 'balance_history', BALANCE_COLUMNS, cutoff, self._delete_balance_batch),
+        )
+        block_cost = 0.0   # Durada de l'últim bloc: no se n'obre un altre si no hi cap dins el pressupost
+        for key, table, columns, bound, delete_batch in jobs:
+            while True:
+                block_start = time.perf_counter()
+                if block_start + block_cost >= deadline: return result
+                rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                                    (bound, MAINT_ARCHIVE_ROWS)).fetchall()
+                if not rows: break
+                if archive and not archive(key, columns, rows):
+                    result['archive_failed'] = True
+                    break
+                # El bloc exportat s'esborra sencer (encara que s'acabi el pressupost) perquè l'arxiu no dupliqui files
+                keys = [r[0] for r in rows]
+                for i in range(0, len(keys), MAINT_BATCH_ROWS):
+                    result[key] += delete_batch(conn, keys[i:i + MAINT_BATCH_ROWS])
+                    time.sleep(MAINT_PAUSE)
+                if key == 'balance':
+                    with conn: conn.execute("INSERT OR REPLACE INTO bot_info (key, value) VALUES (?, ?)", ('balance_raw_pruned_before', str(cutoff)))
+                block_cost = time.perf_counter() - block_start
+                if len(rows) < MAINT_ARCHIVE_ROWS: break
+
+        # 2. Tram de rollups de 5 min de més de BALANCE_5M_KEEP_DAYS (l'horari i el diari es queden)
+        fine_cutoff = time.time() - BALANCE_5M_KEEP_DAYS * 86400
+        while True:
+            if time.perf_counter() >= deadline: return result
+            with conn:
+                deleted = conn.execute(f'''DELETE FROM balance_rollups WHERE tier={BALANCE_TIERS[0]} AND bucket_start IN (
+                                             SELECT bucket_start FROM balance_rollups WHERE tier={BALANCE_TIERS[0]} AND bucket_start < ? LIMIT ?)''',
+                                       (fine_cutoff, MAINT_BATCH_ROWS)).rowcount
+            result['rollups'] += deleted
+            if deleted < MAINT_BATCH_ROWS: break
+            time.sleep(MAINT_PAUSE)
+
+        # 3. Pàgines lliures -> disc, de MAINT_VACUUM_PAGES en MAINT_VACUUM_PAGES
+        try:
+            while time.perf_counter() < deadline:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free == 0: break
+                conn.execute(f"PRAGMA incremental_vacuum({MAINT_VACUUM_PAGES})").fetchall()
+                result['pages'] += min(free, MAINT_VACUUM_PAGES)
+                time.sleep(MAINT_PAUSE)
+            else:
+                return result
+            # 4. Checkpoint PASSIVE: copia el que pot del WAL sense esperar lectors ni escriptors
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        except Exception as e:
+            log.warning(f"Manteniment incremental de la BD (no crític): {e}")
+            return result
+
+        result['done'] = True
+        return result
+
+    def _delete_trades_batch(self, conn, ids):
+        """Esborra trades per id restant abans la seva aportació de pnl_buckets (mateixa transacció)"""
+        placeholders = ','.join(['?'] * len(ids))
+        with conn:
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM trade_history WHERE timestamp < ?", (cutoff_ms,))
-            deleted_trades = cursor.rowcount
-            
-            cursor.execute("DELETE FROM balance_history WHERE timestamp < ?", (cutoff,))
-            deleted_balance = cursor.rowcount
-            conn.commit()
-            
-        if deleted_trades > 0 or deleted_balance > 0:
-            try:
-                # isolation_level=None activa el mode autocommit
-                vacuum_conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
-                vacuum_conn.execute("VACUUM")
-                vacuum_conn.close()
-            except Exception as e:
-                log.warning(f"No s'ha pogut fer VACUUM (no crític): {e}")
-
-        return deleted_trades, deleted_balance
+            cursor.execute(f'''
+                SELECT symbol, CAST(timestamp AS INTEGER) / {PNL_BUCKET_MS} * {PNL_BUCKET_MS},
+                       SUM({CASH_FLOW_SQL}), SUM({QTY_DELTA_SQL}), COUNT(*)
+                FROM trade_history WHERE id IN ({placeholders}) GROUP BY 1, 2
+            ''', ids)
+            deltas = [(cf, qty, n, sym, bucket) for sym, bucket, cf, qty, n in cursor.fetchall()]
+            cursor.executemany('''UPDATE pnl_buckets SET cash_flow = cash_flow - ?, qty_delta = qty_delta - ?, trades = trades - ?
+                                  WHERE symbol=? AND bucket_start=?''', deltas)
+            cursor.execute("DELETE FROM pnl_buckets WHERE trades <= 0")
+            cursor.execute(f"DELETE FROM trade_history WHERE id IN ({placeholders})", ids)
+            deleted = cursor.rowcount
+        bump_version(VERSION_ALL)
+        return deleted
+
+    def _delete_balance_batch(self, conn, timestamps):
+        with conn:
+            deleted = conn.execute(f"DELETE FROM balance_history WHERE timestamp IN ({','.join(['?'] * len(timestamps))})", timestamps).rowcount
+        bump_version('balance')
+        return deleted
+
+    def get_trades_range(self, symbol=None, from_ms=0, to_ms=None):
+        """Files de trade_history (columnes TRADE_COLUMNS) en un rang de temps, per als informes"""
+        sql = f"SELECT {', '.join(TRADE_COLUMNS)} FROM trade_history WHERE timestamp >= ?"
+        params = [from_ms]
+        if to_ms is not None:
+            sql += " AND timestamp < ?"
+            params.append(to_ms)
+        if symbol is not None:
+            sql += " AND symbol=?"
+            params.append(symbol)
+        with self._get_conn() as conn:
+            return conn.execute(sql + " ORDER BY timestamp ASC", params).fetchall()
 
     def assign_id_to_trade_if_missing(self, trade_id):
         with self._get_conn() as conn:
@@ -495,8 +1196,11 @@ class BotDatabase:
                 found_id = row[0]
                 return found_id
                 
-            new_id = self.get_next_buy_id() 
-        self.set_trade_buy_id(trade_id, new_id)
+            # Reserva del ID y asignación en la misma transacción (antes abría una segunda conexión anidada)
+            new_id = self._take_next_buy_id(cursor)
+            cursor.execute("UPDATE trade_history SET buy_id = ? WHERE id = ?", (new_id, trade_id))
+            conn.commit()
+        bump_version(VERSION_ALL)
         return new_id
 
     def get_buy_trade_uuid_for_sell_order(self, symbol, sell_price, spread_pct):
@@ -514,6 +1218,7 @@ class BotDatabase:
             return row[0] if row else None
 
     def delete_history_smart(self, symbol, keep_uuids):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             if not keep_uuids:
@@ -524,19 +1229,22 @@ class BotDatabase:
                 params = [symbol] + keep_uuids
                 cursor.execute(sql, params)
             count = cursor.rowcount
+            self._rebuild_pnl_buckets(cursor, symbol=symbol)
             
             # També netegem el PnL d'aquesta moneda en particular
             cursor.execute("DELETE FROM pnl_backup WHERE symbol=?", (symbol,))
             cursor.execute("DELETE FROM pnl_history WHERE symbol=?", (symbol,))
             
             conn.commit()
-            return count
+        bump_version(VERSION_ALL)
+        return count
 
     def set_session_start_time(self, timestamp):
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("INSERT OR REPLACE INTO bot_info (key, value) VALUES (?, ?)", ('session_start_time', str(timestamp)))
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def get_session_start_time(self):
         with self._get_conn() as conn:
@@ -566,13 +1274,20 @@ class BotDatabase:
             cursor.execute("DELETE FROM bot_info WHERE key='session_start_balance'")
             cursor.execute("DELETE FROM bot_info WHERE key LIKE 'session_start_%'")
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def reset_all_statistics(self):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM trade_history")
+            cursor.execute("DELETE FROM pnl_buckets")
             cursor.execute("DELETE FROM balance_history")
+            cursor.execute("DELETE FROM balance_rollups")
+            cursor.execute("DELETE FROM bot_info WHERE key='balance_raw_pruned_before'")
             cursor.execute("UPDATE grid_status SET setup_done=0")
+            # Els ids de trade no són comparables entre xarxes (testnet/real)
+            cursor.execute("DELETE FROM trade_cursors")
             
             # Reset complet de les taules PnL
             cursor.execute("DELETE FROM pnl_history")
@@ -588,36 +1303,49 @@ class BotDatabase:
             cursor.execute("DELETE FROM bot_info WHERE key LIKE 'session_start_%'")
             
             conn.commit()
+        bump_version(VERSION_ALL)
         return True
 
     def clear_balance_history(self):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM balance_history")
+            cursor.execute("DELETE FROM balance_rollups")
+            cursor.execute("DELETE FROM bot_info WHERE key='balance_raw_pruned_before'")
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def clear_all_trades_history(self):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM trade_history")
+            cursor.execute("DELETE FROM pnl_buckets")
             # En un clear history total, també esborrem la comptabilitat PnL
             cursor.execute("DELETE FROM pnl_history")
             cursor.execute("DELETE FROM pnl_backup")
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def clear_orders_cache(self):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE grid_status SET open_orders_json = '[]'")
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def delete_trades_for_symbol(self, symbol):
+        self.flush()
         with self._get_conn() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM trade_history WHERE symbol=?", (symbol,))
+            cursor.execute("DELETE FROM pnl_buckets WHERE symbol=?", (symbol,))
             cursor.execute("DELETE FROM pnl_backup WHERE symbol=?", (symbol,))
             cursor.execute("DELETE FROM pnl_history WHERE symbol=?", (symbol,))
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def set_coin_session_start(self, symbol, timestamp):
         key = f"session_start_{symbol}"
@@ -625,6 +1353,7 @@ class BotDatabase:
             cursor = conn.cursor()
             cursor.execute("INSERT OR REPLACE INTO bot_info (key, value) VALUES (?, ?)", (key, str(timestamp)))
             conn.commit()
+        bump_version(VERSION_ALL)
 
     def get_coin_session_start(self, symbol):
         key = f"session_start_{symbol}"
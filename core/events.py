@@ -0,0 +1,44 @@
+# Archivo: gridbot_binance/core/events.py
+import json
+import threading
+from collections import deque
+
+class EventBus:
+    """
+    Bus de eventos del bot hacia el dashboard (SSE).
+    Los hilos del bot publican cambios (precio, órdenes, trades, equity, estado del motor);
+    cada cliente lee desde su último id, así que el coste depende de los cambios y no del nº de pestañas.
+    """
+    def __init__(self, maxlen=500):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=maxlen)   # (id, tipo, json)
+        self._seq = 0
+        self._waiters = set()                 # Callbacks sin argumentos para despertar a los clientes
+
+    @property
+    def last_id(self):
+        return self._seq
+
+    def publish(self, kind, data):
+        payload = json.dumps(data, default=str)
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, kind, payload))
+            waiters = list(self._waiters)
+        for wake in waiters:
+            try: wake()
+            except Exception: pass
+
+    def since(self, last_id):
+        """Eventos posteriores a last_id, o None si ya han salido del buffer (el cliente debe recargarlo todo)"""
+        with self._lock:
+            if last_id == self._seq: return []
+            # id mayor que el actual = el bot se ha reiniciado; menor que el buffer = el cliente se ha quedado atrás
+            if last_id > self._seq or not self._events or last_id < self._events[0][0] - 1: return None
+            return [e for e in self._events if e[0] > last_id]
+
+    def add_waiter(self, wake):
+        with self._lock: self._waiters.add(wake)
+
+    def remove_waiter(self, wake):
+        with self._lock: self._waiters.discard(wake)
@@ -3,18 +3,128 @@ import ccxt
 import os
 import json5
 import time
+import threading
+from collections import deque, OrderedDict
 from dotenv import load_dotenv
 from utils.logger import log
+from core.stream import BinanceStream, STREAM_URL_REAL, STREAM_URL_TEST
 
 # Cargamos .env (override=True permite recargar si cambia)
 load_dotenv(dotenv_path='config/.env', override=True)
 
+# --- PRIORIDADES DE LLAMADA (Gobernador de peso API) ---
+PRIORITY_HIGH = 0    # Crear / cancelar órdenes
+PRIORITY_NORMAL = 1  # Precio, órdenes abiertas, saldo
+PRIORITY_LOW = 2     # Velas, trades, info de cuenta, tickers completos
+
+# --- CACHÉ TTL DE DATOS LENTOS (segundos, sobreescribibles en system.cache_ttl) ---
+CACHE_TTLS = {
+    'account': 3600,   # Nivel VIP
+    'fees': 3600,      # Comisiones maker/taker de todos los pares (una sola llamada)
+    'tickers': 30,     # fetch_tickers() de todo el exchange (peso 80)
+}
+CACHE_RETRY = 60       # Tras un fallo no se vuelve a pedir la clave hasta pasados min(TTL, CACHE_RETRY) segundos
+
+class RateLimitDeferred(Exception):
+    """Llamada aplazada por el gobernador (presupuesto agotado o circuito abierto)"""
+    pass
+
+class RateLimitGovernor:
+    """
+    Presupuesto de peso por minuto compartido por todos los hilos.
+    Se sincroniza con la cabecera X-MBX-USED-WEIGHT-1M de Binance y actúa como
+    circuit breaker ante un 418/429: en lugar de dormir el hilo, rechaza llamadas hasta que expire el bloqueo.
+    """
+    # Fracción del límite a partir de la cual se aplaza cada prioridad
+    THRESHOLDS = {PRIORITY_HIGH: 0.95, PRIORITY_NORMAL: 0.80, PRIORITY_LOW: 0.60}
+
+    def __init__(self, weight_limit=6000):
+        self.weight_limit = weight_limit
+        self.used_weight = 0
+        self.window_minute = int(time.time() // 60)
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _roll_window(self, now):
+        # Binance reinicia el contador en cada minuto natural
+        minute = int(now // 60)
+        if minute != self.window_minute:
+            self.window_minute = minute
+            self.used_weight = 0
+
+    def acquire(self, priority, weight=1):
+        now = time.time()
+        with self._lock:
+            if now < self.blocked_until: return False
+            self._roll_window(now)
+            if self.used_weight + weight > self.weight_limit * self.THRESHOLDS[priority]:
+                return False
+            # Estimación local hasta que la cabecera de la respuesta nos dé el valor real
+            self.used_weight += weight
+            return True
+
+    def update_from_headers(self, headers):
+        if not headers: return
+        used = None
+        for k, v in headers.items():
+            if k.lower() == 'x-mbx-used-weight-1m':
+                used = v
+                break
+        if used is None: return
+        try: used = int(used)
+        except (TypeError, ValueError): return
+        with self._lock:
+            self._roll_window(time.time())
+            self.used_weight = used
+
+    def trip(self, seconds):
+        """Abre el circuito. Devuelve True si estaba cerrado (para loguear solo una vez)"""
+        now = time.time()
+        with self._lock:
+            was_open = now < self.blocked_until
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            return not was_open
+
+    def is_open(self):
+        return time.time() < self.blocked_until
+
+    def remaining_block(self):
+        return max(0.0, self.blocked_until - time.time())
+
+    def usage_ratio(self):
+        with self._lock:
+            self._roll_window(time.time())
+            return self.used_weight / self.weight_limit if self.weight_limit else 0.0
+# -------------------------------------------------------
+
 class BinanceConnector:
     def __init__(self):
         self.exchange = None
         self.config_path = 'config/config.json5'
         self.last_config_mtime = 0 
         self.config = self._load_config()
+        self.governor = RateLimitGovernor(self.config.get('system', {}).get('weight_limit', 6000))
+
+        # Snapshot de saldos compartido (un solo fetch_balance por TTL para todo el sistema)
+        self._balance_lock = threading.Lock()
+        self._balance_cache = None
+        self._balance_ts = 0
+
+        # Ring buffer de velas por (símbolo, timeframe): precarga una vez y luego solo velas nuevas
+        self._candle_lock = threading.Lock()
+        self._candle_buffers = {}
+
+        # Cancelaciones recientes: permiten distinguir una orden cancelada de una ejecutada
+        self._cancel_lock = threading.Lock()
+        self._cancelled_ids = OrderedDict()
+        self._cancel_all_ts = {}
+
+        # Caché TTL compartida (info de cuenta, comisiones, tickers completos)
+        self._ttl_lock = threading.Lock()
+        self._ttl_entries = {}
+
+        # Mode streaming opcional (system.streaming.enabled): preu, ordres i fills en memòria
+        self.stream = None
         self._connect()
         try:
             if self.exchange: self.exchange.load_markets()
@@ -43,10 +153,13 @@ class BinanceConnector:
                     new_testnet = new_config.get('system', {}).get('use_testnet', True)
                     
                     self.config = new_config
+                    self.governor.weight_limit = new_config.get('system', {}).get('weight_limit', 6000)
                     
                     if old_testnet != new_testnet or self.exchange is None:
                         log.warning(f"🔄 RECONFIGURACIÓN DE RED: {'TESTNET' if new_testnet else 'REAL'}. Conectando...")
                         self._connect()
+                        self.invalidate_balance(drop=True)
+                        with self._candle_lock: self._candle_buffers = {}
                         try: 
                             if self.exchange: self.exchange.load_markets()
                         except: pass
@@ -100,6 +213,75 @@ class BinanceConnector:
             log.error(f"❌ Error de conexión CRÍTICO: {e}")
             self.exchange = None
 
+    # --- MODE STREAMING (WebSocket) ---
+    def start_stream(self, symbols, on_fill=None):
+        """Arrenca (o reinicia) el stream si està activat a la config. Retorna True si queda actiu."""
+        self.stop_stream()
+        conf = self.config.get('system', {}).get('streaming', {}) or {}
+        if not conf.get('enabled', False) or not self.exchange or not symbols: return False
+
+        use_testnet = self.config.get('system', {}).get('use_testnet', True)
+        url = conf.get('url') or (STREAM_URL_TEST if use_testnet else STREAM_URL_REAL)
+        try:
+            symbol_ids = {self.exchange.market(s)['id']: s for s in symbols}
+        except Exception as e:
+            log.error(f"Stream: símbol desconegut ({e}).")
+            return False
+
+        # 'listen_key' fix a la config només per al servidor fals local (fake_stream.py)
+        listen_key = conf.get('listen_key')
+        if not listen_key:
+            try:
+                res = self._api(PRIORITY_HIGH, 2, self.exchange.public_post_userdatastream)
+                listen_key = res.get('listenKey')
+            except Exception as e:
+                self._handle_api_error(e, "listenKey")
+                log.warning("Stream sense user data: els fills es continuaran consultant per REST.")
+        self._listen_key_ts = time.time()
+
+        self.stream = BinanceStream(url, symbol_ids, listen_key=listen_key, on_balance=self._apply_stream_balance, on_fill=on_fill)
+        if not self.stream.start():
+            self.stream = None
+            return False
+        return True
+
+    def stop_stream(self):
+        if self.stream:
+            self.stream.stop()
+            self.stream = None
+
+    def is_streaming(self):
+        return self.stream is not None and self.stream.connected
+
+    def keepalive_stream(self):
+        """Renova el listenKey cada 30 min (Binance el caduca als 60)"""
+        if not self.stream or not self.stream.listen_key: return
+        if self.config.get('system', {}).get('streaming', {}).get('listen_key'): return
+        if time.time() - getattr(self, '_listen_key_ts', 0) < 1800: return
+        try:
+            self._api(PRIORITY_NORMAL, 2, self.exchange.public_put_userdatastream, {'listenKey': self.stream.listen_key})
+            self._listen_key_ts = time.time()
+        except Exception as e:
+            self._handle_api_error(e, "keepalive listenKey")
+
+    def has_user_stream(self):
+        """True si els fills arriben pel user data stream (si no, cal consultar-los per REST)"""
+        return self.is_streaming() and bool(self.stream.listen_key)
+
+    def pop_stream_fills(self, symbol):
+        return self.stream.pop_fills(symbol) if self.stream else []
+
+    def _apply_stream_balance(self, balances):
+        """Aplica un outboundAccountPosition al snapshot de saldos compartit"""
+        with self._balance_lock:
+            bal = self._balance_cache
+            if not bal: return
+            for asset, (free, locked) in balances.items():
+                bal[asset] = {'free': free, 'used': locked, 'total': free + locked}
+                for k, v in (('free', free), ('used', locked), ('total', free + locked)):
+                    if isinstance(bal.get(k), dict): bal[k][asset] = v
+    # ------------------------------------
+
     def validate_connection(self):
         if not self.exchange: return False
         try:
@@ -108,14 +290,39 @@ class BinanceConnector:
         except Exception:
             return False
 
+    # --- LLAMADAS REST CON PRESUPUESTO DE PESO ---
+    def _api(self, priority, weight, fn, *args, **kwargs):
+        """Ejecuta una llamada REST solo si el gobernador lo permite y actualiza el peso usado"""
+        if not self.governor.acquire(priority, weight):
+            raise RateLimitDeferred(f"peso {self.governor.used_weight}/{self.governor.weight_limit}")
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.governor.update_from_headers(getattr(self.exchange, 'last_response_headers', None))
+
+    def is_rate_limited(self):
+        return self.governor.is_open()
+
     # --- GESTOR DE ERRORES CENTRALIZADO ---
     def _handle_api_error(self, e, context=""):
+        if isinstance(e, RateLimitDeferred):
+            # Llamada aplazada a propósito: se reintentará en el próximo ciclo
+            return
         err_str = str(e).lower()
-        if "418" in err_str or "too much request weight" in err_str or "-1003" in err_str:
-            log.error(f"🚨 IP BANEADA TEMPORALMENTE POR BINANCE (418).")
-            log.warning("⏳ Pausando el bot durante 2 minutos para enfriar la conexión...")
-            time.sleep(120) # Espera 2 minutos
-            log.success("🔄 Reanudando operaciones...")
+        # Només errors de límit de ccxt (429/418 ja mapejats) o el codi -1003 de Binance: un "429" dins d'un preu o id no compta
+        if isinstance(e, (ccxt.DDoSProtection, ccxt.RateLimitExceeded)) or "too much request weight" in err_str or "-1003" in err_str:
+            banned = "418" in err_str or "banned" in err_str
+            seconds = 120 if banned else 60
+            headers = getattr(self.exchange, 'last_response_headers', None) or {}
+            for k, v in headers.items():
+                if k.lower() == 'retry-after':
+                    try: seconds = max(1, int(v))
+                    except (TypeError, ValueError): pass
+                    break
+            if self.governor.trip(seconds):
+                if banned: log.error("🚨 IP BANEADA TEMPORALMENTE POR BINANCE (418).")
+                else: log.error("🚨 LÍMITE DE PESO API ALCANZADO (429).")
+                log.warning(f"⏳ Circuito abierto {seconds}s: llamadas REST en pausa para enfriar la conexión...")
         elif "content-length" in err_str or "json" in err_str:
             # Ignoramos errores puntuales de red
             pass
@@ -123,78 +330,170 @@ class BinanceConnector:
             log.error(f"Error API ({context}): {e}")
     # --------------------------------------------
 
-    # --- FUNCIÓ MODIFICADA: ESTAT DEL COMPTE (SOLUCIÓ 0%) ---
+    # --- CACHÉ TTL COMPARTIDA ---
+    def _cache_ttl(self, key):
+        return self.config.get('system', {}).get('cache_ttl', {}).get(key, CACHE_TTLS[key])
+
+    def _cached(self, key, fetch):
+        """
+        Valor de 'fetch()' cacheado durante el TTL de 'key'.
+        Si varios hilos fallan a la vez solo uno llama al exchange (el resto espera su resultado);
+        un valor caducado hace menos de 2 TTL se sirve al momento y se refresca en segundo plano.
+        fetch() devuelve None si falla: se sirve el último valor conocido (o None) y el fallo también
+        se recuerda, así no se reintenta en cada llamada mientras el exchange siga fallando.
+        """
+        with self._ttl_lock:
+            entry = self._ttl_entries.setdefault(key, {'value': None, 'ts': 0, 'failed_ts': 0, 'lock': threading.Lock(), 'refreshing': False})
+        ttl = self._cache_ttl(key)
+        now = time.time()
+        age = now - entry['ts']
+        if entry['value'] is not None and age < ttl: return entry['value']
+        if now - entry['failed_ts'] < min(ttl, CACHE_RETRY): return entry['value']
+        if entry['value'] is not None and age < ttl * 2:
+            with self._ttl_lock:
+                start = not entry['refreshing']
+                entry['refreshing'] = True
+            if start: threading.Thread(target=self._refresh_cached, args=(key, entry, fetch), daemon=True).start()
+            return entry['value']
+        with entry['lock']:
+            # Otro hilo lo ha descargado (o ha fallado) mientras esperábamos el lock
+            if entry['value'] is not None and time.time() - entry['ts'] < ttl: return entry['value']
+            if time.time() - entry['failed_ts'] < min(ttl, CACHE_RETRY): return entry['value']
+            self._store_cached(entry, fetch())
+            return entry['value']
+
+    def _refresh_cached(self, key, entry, fetch):
+        try:
+            with entry['lock']: self._store_cached(entry, fetch())
+        except Exception as e:
+            log.warning(f"Error refrescando caché '{key}': {e}")
+        finally:
+            with self._ttl_lock: entry['refreshing'] = False
+
+    def _store_cached(self, entry, value):
+        if value is None:
+            entry['failed_ts'] = time.time()
+            return
+        entry['failed_ts'] = 0
+        entry['value'] = value
+        entry['ts'] = time.time()
+
+    def invalidate_cache(self, key=None):
+        with self._ttl_lock:
+            for k, entry in self._ttl_entries.items():
+                if key is None or k == key: entry['ts'] = entry['failed_ts'] = 0
+
+    def _fetch_all_fees(self):
+        try:
+            fees = self._api(PRIORITY_LOW, 1, self.exchange.fetch_trading_fees)
+            return {sym: {'maker': float(f.get('maker') or 0.0), 'taker': float(f.get('taker') or 0.0)}
+                    for sym, f in (fees or {}).items()}
+        except Exception as e:
+            self._handle_api_error(e, "comissions")
+            return None
+
+    def get_trading_fees(self, symbol):
+        """Comissions reals {'maker', 'taker'} (fracció, 0.001 = 0.1%) del parell, amb caché"""
+        if not self.exchange: return {'maker': 0.0, 'taker': 0.0}
+        fees = self._cached('fees', self._fetch_all_fees) or {}
+        if symbol in fees: return fees[symbol]
+        # Sense resposta del compte (testnet, circuit obert...): tarifa base del mercat
+        market = (self.exchange.markets or {}).get(symbol, {})
+        return {'maker': float(market.get('maker') or 0.0), 'taker': float(market.get('taker') or 0.0)}
+
+    def _fetch_vip_tier(self):
+        if self.exchange.sandbox: return 'Testnet'
+        if not hasattr(self.exchange, 'sapi_get_account_status'): return 'VIP 0'
+        try:
+            res = self._api(PRIORITY_LOW, 1, self.exchange.sapi_get_account_status)
+            # La resposta sol ser {'data': 'Normal'} o {'data': '1'}
+            level = res.get('data', 'Normal')
+            return 'VIP 0' if level == 'Normal' else f"VIP {level}"
+        except Exception as e:
+            self._handle_api_error(e, "estat del compte")
+            return None
+
     def get_account_status(self):
         """Retorna nivell VIP i comissions reals buscant en diversos parells"""
         if not self.exchange:
             return {'tier': 'N/A', 'maker': 0, 'taker': 0}
-        
-        info = {'tier': 'VIP 0', 'maker': 0.0, 'taker': 0.0}
-        
-        try:
-            # 1. Intentem obtenir comissions provant diversos parells comuns
-            # Molts parells tenen 0% per promoció, així que busquem el primer que tingui fee > 0
-            test_pairs = ['BTC/USDT', 'ETH/USDT', 'BNB/USDT', 'BTC/USDC']
-            found_fee = False
-            
-            for pair in test_pairs:
-                try:
-                    fees = self.exchange.fetch_trading_fee(pair)
-                    if fees:
-                        maker = fees.get('maker', 0.0)
-                        taker = fees.get('taker', 0.0)
-                        
-                        # Si trobem una comissió > 0, assumim que és la tarifa real del compte
-                        if maker > 0 or taker > 0:
-                            info['maker'] = maker * 100 
-                            info['taker'] = taker * 100
-                            found_fee = True
-                            break
-                        
-                        # Si és 0, guardem el valor provisional però seguim buscant
-                        info['maker'] = maker * 100
-                        info['taker'] = taker * 100
-                except: continue
-            
-            # 2. Obtenim nivell VIP
-            if hasattr(self.exchange, 'sapi_get_account_status'):
-                res = self.exchange.sapi_get_account_status()
-                # La resposta sol ser {'data': 'Normal'} o {'data': '1'}
-                level = res.get('data', 'Normal')
-                if level == 'Normal':
-                    info['tier'] = 'VIP 0'
-                else:
-                    info['tier'] = f"VIP {level}"
-            
-            if self.exchange.sandbox:
-                info['tier'] = 'Testnet'
 
-        except Exception as e:
-            log.error(f"Error obtenint estat del compte: {e}")
-        
+        info = {'tier': self._cached('account', self._fetch_vip_tier) or 'VIP 0', 'maker': 0.0, 'taker': 0.0}
+        # Molts parells tenen 0% per promoció, així que busquem el primer que tingui fee > 0
+        for pair in ['BTC/USDT', 'ETH/USDT', 'BNB/USDT', 'BTC/USDC']:
+            fees = self.get_trading_fees(pair)
+            info['maker'] = fees['maker'] * 100
+            info['taker'] = fees['taker'] * 100
+            if fees['maker'] > 0 or fees['taker'] > 0: break
         return info
+
+    def get_all_tickers(self):
+        """fetch_tickers() de tot l'exchange amb caché (peso 80): per valorar la cartera sencera"""
+        if not self.exchange: return {}
+        def fetch():
+            try:
+                return self._api(PRIORITY_LOW, 80, self.exchange.fetch_tickers)
+            except Exception as e:
+                self._handle_api_error(e, "fetch_tickers")
+                return None
+        return self._cached('tickers', fetch) or {}
     # -------------------------------------------------------
 
+    # --- SNAPSHOT DE SALDOS COMPARTIDO ---
+    def get_balance_snapshot(self, force=False):
+        """Devuelve el último fetch_balance() si tiene menos de 'balance_ttl' segundos.
+        Todas las consultas de saldo (bot, web, limpieza) leen de aquí."""
+        if not self.exchange: return {}
+        ttl = self.config.get('system', {}).get('balance_ttl', 5)
+        with self._balance_lock:
+            if not force and self._balance_cache is not None and (time.time() - self._balance_ts) < ttl:
+                return self._balance_cache
+            try:
+                self._balance_cache = self._api(PRIORITY_NORMAL, 20, self.exchange.fetch_balance)
+                self._balance_ts = time.time()
+            except Exception as e:
+                self._handle_api_error(e, "fetch_balance")
+                # Si falla, servimos el último snapshot conocido antes que un saldo 0 falso
+                if self._balance_cache is None: return {}
+            return self._balance_cache
+
+    def invalidate_balance(self, drop=False):
+        """Fuerza a que la próxima lectura vuelva a pedir saldos (tras cancelar, ejecutar o detectar un fill)"""
+        with self._balance_lock:
+            self._balance_ts = 0
+            if drop: self._balance_cache = None
+
+    def _reserve_balance_local(self, asset, qty):
+        """Pasa 'qty' de free a used en el snapshot local tras crear una orden límite (sin pedir saldo de nuevo)"""
+        with self._balance_lock:
+            bal = self._balance_cache
+            if not bal or asset not in bal: return
+            entry = bal[asset]
+            free = float(entry.get('free') or 0.0)
+            used = float(entry.get('used') or 0.0)
+            qty = min(qty, free)
+            entry['free'] = free - qty
+            entry['used'] = used + qty
+            if isinstance(bal.get('free'), dict): bal['free'][asset] = entry['free']
+            if isinstance(bal.get('used'), dict): bal['used'][asset] = entry['used']
+    # ------------------------------------
+
     def get_asset_balance(self, asset):
-        if not self.exchange: return 0.0
+        balance = self.get_balance_snapshot()
         try:
-            balance = self.exchange.fetch_balance()
-            return float(balance.get(asset, {}).get('free', 0.0))
-        except Exception as e:
-            self._handle_api_error(e, f"balance {asset}")
+            return float(balance.get(asset, {}).get('free', 0.0) or 0.0)
+        except Exception:
             return 0.0
 
     def get_total_balance(self, asset):
-        if not self.exchange: return 0.0
+        balance = self.get_balance_snapshot()
         try:
-            balance = self.exchange.fetch_balance()
             if asset in balance:
-                free = float(balance[asset].get('free', 0.0))
-                used = float(balance[asset].get('used', 0.0)) 
+                free = float(balance[asset].get('free', 0.0) or 0.0)
+                used = float(balance[asset].get('used', 0.0) or 0.0)
                 return free + used
             return 0.0
-        except Exception as e:
-            self._handle_api_error(e, f"total balance {asset}")
+        except Exception:
             return 0.0
 
     # --- NUEVA FUNCIÓN OPTIMIZADA: DESCARGA EN GRUPO (BATCH) ---
@@ -203,7 +502,7 @@ class BinanceConnector:
         if not self.exchange or not symbols_list: return {}
         try:
             # fetch_tickers (plural) obtiene datos de múltiples pares a la vez
-            tickers = self.exchange.fetch_tickers(symbols_list)
+            tickers = self._api(PRIORITY_NORMAL, 2 if len(symbols_list) <= 20 else 40, self.exchange.fetch_tickers, symbols_list)
             prices = {}
             for sym, data in tickers.items():
                 if 'last' in data and data['last']:
@@ -217,8 +516,11 @@ class BinanceConnector:
     def fetch_current_price(self, symbol):
         # Mantenemos esta por compatibilidad, pero recomendamos usar batch
         if not self.exchange: return 0.0
+        if self.stream:
+            price = self.stream.get_price(symbol)
+            if price: return price
         try:
-            ticker = self.exchange.fetch_ticker(symbol)
+            ticker = self._api(PRIORITY_NORMAL, 2, self.exchange.fetch_ticker, symbol)
             return float(ticker['last'])
         except Exception as e:
             self._handle_api_error(e, f"price {symbol}")
@@ -228,8 +530,12 @@ class BinanceConnector:
         if not self.exchange: return None
         params = {}
         try:
-            order = self.exchange.create_order(symbol, 'limit', side, amount, price, params)
+            order = self._api(PRIORITY_HIGH, 1, self.exchange.create_order, symbol, 'limit', side, amount, price, params)
             log.trade(symbol, side, price, amount)
+            if self.stream: self.stream.track_order(order)
+            base, quote = symbol.split('/')
+            if side == 'buy': self._reserve_balance_local(quote, amount * price)
+            else: self._reserve_balance_local(base, amount)
             return order
         except ccxt.InsufficientFunds as e:
              log.error(f"FONDOS INSUFICIENTES: {e}")
@@ -242,7 +548,9 @@ class BinanceConnector:
         if not self.exchange: return None
         try:
             log.warning(f"Ejecutando Venta a Mercado {symbol} Cantidad: {amount}")
-            return self.exchange.create_order(symbol, 'market', 'sell', amount)
+            order = self._api(PRIORITY_HIGH, 1, self.exchange.create_order, symbol, 'market', 'sell', amount)
+            self.invalidate_balance()
+            return order
         except Exception as e:
             self._handle_api_error(e, "market sell")
             return None
@@ -260,52 +568,188 @@ class BinanceConnector:
             # Aplicamos precisión del exchange
             amount_base = self.exchange.amount_to_precision(symbol, amount_base)
             
-            return self.exchange.create_order(symbol, 'market', 'buy', amount_base)
+            order = self._api(PRIORITY_HIGH, 1, self.exchange.create_order, symbol, 'market', 'buy', amount_base)
+            self.invalidate_balance()
+            return order
         except Exception as e:
             self._handle_api_error(e, "market buy")
             return None
 
+    def _record_cancel(self, symbol, order_id=None):
+        """Se anota ANTES de la llamada (un snapshot de órdenes en pleno cancel no debe parecer un fill).
+        Devuelve el valor anterior para deshacerlo si el cancel falla."""
+        with self._cancel_lock:
+            if order_id is None:
+                previous = self._cancel_all_ts.get(symbol)
+                self._cancel_all_ts[symbol] = time.time()
+                return previous
+            self._cancelled_ids[(symbol, str(order_id))] = True
+            if len(self._cancelled_ids) > 2000: self._cancelled_ids.popitem(last=False)
+            return None
+
+    def _undo_cancel(self, symbol, order_id=None, previous=None):
+        """El cancel ha fallado (p.ej. OrderNotFound porque se acaba de ejecutar): su desaparición sí es un fill"""
+        with self._cancel_lock:
+            if order_id is not None:
+                self._cancelled_ids.pop((symbol, str(order_id)), None)
+            elif previous is None:
+                self._cancel_all_ts.pop(symbol, None)
+            else:
+                self._cancel_all_ts[symbol] = previous
+
+    def was_cancelled(self, symbol, order_id, since_ts=0):
+        """True si la orden la hemos cancelado nosotros (individualmente o con un cancel_all posterior a since_ts)"""
+        with self._cancel_lock:
+            if (symbol, str(order_id)) in self._cancelled_ids: return True
+            return self._cancel_all_ts.get(symbol, 0) >= since_ts
+
     def cancel_order(self, order_id, symbol):
         if not self.exchange: return None
+        self._record_cancel(symbol, order_id)
         try:
-            return self.exchange.cancel_order(order_id, symbol)
+            res = self._api(PRIORITY_HIGH, 1, self.exchange.cancel_order, order_id, symbol)
+            if self.stream: self.stream.forget_order(symbol, order_id)
+            self.invalidate_balance()
+            return res
         except Exception as e:
+            self._undo_cancel(symbol, order_id)
             self._handle_api_error(e, f"cancel {order_id}")
             return None
 
     def cancel_all_orders(self, symbol):
         if not self.exchange: return None
+        previous = self._record_cancel(symbol)
         try:
-            return self.exchange.cancel_all_orders(symbol)
+            res = self._api(PRIORITY_HIGH, 1, self.exchange.cancel_all_orders, symbol)
+            if self.stream: self.stream.forget_order(symbol)
+            self.invalidate_balance()
+            return res
         except ccxt.OrderNotFound:
+            self._undo_cancel(symbol, previous=previous)
             return None
         except Exception as e:
+            self._undo_cancel(symbol, previous=previous)
             # Ignoramos error específico de Binance cuando no hay órdenes (-2011)
             if "-2011" in str(e): return None
             self._handle_api_error(e, f"cancel all {symbol}")
             return None
             
-    def fetch_open_orders(self, symbol):
-        if not self.exchange: return []
+    def fetch_open_orders(self, symbol, strict=False):
+        """strict=True devuelve None si falla (para no confundir un error con 'no hay órdenes')"""
+        if not self.exchange: return None if strict else []
+        if self.stream:
+            cached = self.stream.get_open_orders(symbol)
+            if cached is not None: return cached
         try:
-            return self.exchange.fetch_open_orders(symbol)
+            orders = self._api(PRIORITY_NORMAL, 6, self.exchange.fetch_open_orders, symbol)
+            if self.stream and self.stream.connected: self.stream.sync_open_orders(symbol, orders)
+            return orders
         except Exception as e:
             self._handle_api_error(e, f"open orders {symbol}")
-            return []
+            return None if strict else []
 
     # Cambio solicitado: Límite por defecto a 500
     def fetch_candles(self, symbol, timeframe='15m', limit=500):
         if not self.exchange: return []
         try:
-            return self.exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+            return self._api(PRIORITY_LOW, 2, self.exchange.fetch_ohlcv, symbol, timeframe, limit=limit)
         except Exception as e:
             self._handle_api_error(e, f"candles {symbol}")
             return []
 
-    def fetch_my_trades(self, symbol, limit=20):
+    def get_candles(self, symbol, timeframe='15m', limit=500):
+        """
+        Velas desde el ring buffer local. La primera llamada descarga 'limit' velas;
+        las siguientes solo piden desde la última vela abierta (since=) y la actualizan.
+        Devuelve (velas, cambiadas) para que la BD solo persista lo que ha cambiado.
+        """
+        if not self.exchange: return [], []
+        key = (symbol, timeframe)
+        with self._candle_lock:
+            buf = self._candle_buffers.get(key)
+            last_ts = buf[-1][0] if buf else None
+
+        if last_ts is None:
+            fresh = self.fetch_candles(symbol, timeframe=timeframe, limit=limit)
+            if not fresh: return [], []
+            with self._candle_lock:
+                self._candle_buffers[key] = deque(fresh, maxlen=limit)
+            return list(fresh), list(fresh)
+
+        # Si el hueco es mayor que el buffer (bot pausado mucho tiempo) recargamos entero
+        tf_ms = self.exchange.parse_timeframe(timeframe) * 1000
+        missing = int((self.exchange.milliseconds() - last_ts) // tf_ms) + 1
+        if missing >= limit:
+            with self._candle_lock: self._candle_buffers.pop(key, None)
+            return self.get_candles(symbol, timeframe, limit)
+
+        try:
+            new_rows = self._api(PRIORITY_LOW, 2, self.exchange.fetch_ohlcv, symbol, timeframe, since=last_ts, limit=max(2, missing + 1))
+        except Exception as e:
+            self._handle_api_error(e, f"candles {symbol}")
+            new_rows = []
+
+        changed = []
+        with self._candle_lock:
+            buf = self._candle_buffers.get(key)
+            if buf is None: return [], []
+            for c in new_rows or []:
+                if c[0] == buf[-1][0]:
+                    if c != buf[-1]:
+                        buf[-1] = c
+                        changed.append(c)
+                elif c[0] > buf[-1][0]:
+                    buf.append(c)
+                    changed.append(c)
+            return list(buf), changed
+
+    def peek_candles(self, symbol, timeframe='15m'):
+        """Copia del ring buffer sin pedir nada al exchange ni consumir las velas 'cambiadas' (lectura del dashboard)"""
+        with self._candle_lock:
+            return list(self._candle_buffers.get((symbol, timeframe), ()))
+
+    def fetch_my_trades(self, symbol, limit=20, since=None):
         if not self.exchange: return []
         try:
-            return self.exchange.fetch_my_trades(symbol, limit=limit)
+            return self._api(PRIORITY_LOW, 20, self.exchange.fetch_my_trades, symbol, since=since, limit=limit)
         except Exception as e:
             self._handle_api_error(e, f"trades {symbol}")
-            return []
\ No newline at end of file
+            return []
+
+    def sync_trades(self, symbol, last_id=None, since=None, max_pages=5, page_size=1000):
+        """
+        Trades nuevos desde el cursor, paginando hacia delante hasta ponerse al día.
+        Con last_id pagina por 'fromId' (exacto, sin huecos ni duplicados); sin cursor arranca
+        desde 'since' y avanza por ventanas de 24h (límite de Binance para startTime).
+        Devuelve (trades, al_dia, explorado_hasta). al_dia=False si se agota max_pages o falla la red;
+        explorado_hasta (ms) es hasta dónde se han recorrido ventanas vacías sin cursor (None si no aplica).
+        """
+        if not self.exchange: return [], False, None
+        collected = []
+        now_ms = int(time.time() * 1000)
+        window = 24 * 3600 * 1000
+        for _ in range(max_pages):
+            by_id = last_id is not None
+            try:
+                if by_id:
+                    page = self._api(PRIORITY_LOW, 20, self.exchange.fetch_my_trades, symbol,
+                                     limit=page_size, params={'fromId': int(last_id) + 1})
+                else:
+                    page = self._api(PRIORITY_LOW, 20, self.exchange.fetch_my_trades, symbol,
+                                     since=since, limit=page_size)
+            except Exception as e:
+                self._handle_api_error(e, f"sync trades {symbol}")
+                return collected, False, None if by_id else since
+            page = page or []
+            if by_id: page = [t for t in page if int(t['id']) > int(last_id)]
+            if page:
+                collected.extend(page)
+                last_id = max(int(t['id']) for t in page)
+                since = max(t['timestamp'] for t in page)
+            if by_id:
+                if len(page) < page_size: return collected, True, None
+            elif not page:
+                # Ventana vacía: saltamos a la siguiente (con el primer trade ya se pagina por id)
+                if since is None or since + window >= now_ms: return collected, True, now_ms
+                since += window
+        return collected, False, None if last_id is not None else since
\ No newline at end of file
@@ -0,0 +1,61 @@
+# Archivo: gridbot_binance/core/grid.py
+# Reconciliador del grid: compara niveles deseados y órdenes abiertas en TICKS enteros
+# (sin math.isclose ni dependencia del redondeo float). No toca el exchange: solo
+# devuelve el plan de acciones, así se puede probar de forma aislada.
+
+def get_tick_size(market):
+    """Tick de precio del mercado (filtro PRICE_FILTER de Binance o precisión de CCXT)"""
+    try:
+        for f in market.get('info', {}).get('filters', []):
+            if f.get('filterType') == 'PRICE_FILTER' and float(f.get('tickSize', 0)) > 0:
+                return float(f['tickSize'])
+    except Exception: pass
+    precision = market.get('precision', {}).get('price')
+    if precision is None: return 1e-8
+    # CCXT en modo DECIMAL_PLACES devuelve nº de decimales (entero >= 1) en vez del tick
+    if isinstance(precision, int) and precision >= 1: return 10 ** -precision
+    return float(precision)
+
+def to_ticks(price, tick_size):
+    return int(round(float(price) / tick_size))
+
+def plan_grid_actions(levels, desired, open_orders, tick_size):
+    """
+    levels: todos los niveles del grid (precios).
+    desired: {precio_nivel: 'buy' | 'sell'} niveles que deben tener orden en este ciclo.
+    open_orders: órdenes abiertas del exchange (dicts con 'id', 'price', 'side').
+
+    Devuelve una lista de acciones en orden de ejecución (primero las que liberan saldo):
+      {'action': 'cancel',  'order': o}                     -> orden huérfana (fuera de todo nivel)
+      {'action': 'replace', 'order': o, 'price', 'side'}    -> nivel con orden del lado contrario
+      {'action': 'place',   'price', 'side'}                -> nivel deseado sin orden
+    Coste O(niveles + órdenes).
+    """
+    level_ticks = {to_ticks(p, tick_size) for p in levels}
+
+    orders_by_tick = {}
+    cancels = []
+    for o in open_orders:
+        tick = to_ticks(o['price'], tick_size)
+        if tick not in level_ticks:
+            cancels.append({'action': 'cancel', 'order': o})
+        elif tick not in orders_by_tick:
+            # Igual que antes: si hay duplicados en un nivel, manda la primera orden
+            orders_by_tick[tick] = o
+
+    replaces, places = [], []
+    for price, side in desired.items():
+        existing = orders_by_tick.get(to_ticks(price, tick_size))
+        if existing is None:
+            places.append({'action': 'place', 'price': price, 'side': side})
+        elif existing['side'] != side:
+            replaces.append({'action': 'replace', 'order': existing, 'price': price, 'side': side})
+
+    return cancels + replaces + places
+
+def find_order_at(open_orders, price, tick_size):
+    """Primera orden abierta exactamente en el tick de 'price' (o None)"""
+    target = to_ticks(price, tick_size)
+    for o in open_orders:
+        if to_ticks(o['price'], tick_size) == target: return o
+    return None
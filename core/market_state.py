@@ -0,0 +1,105 @@
+# Archivo: gridbot_binance/core/market_state.py
+import threading
+import time
+
+class MarketState:
+    """
+    Estado de mercado por par compartido entre el hilo de trading y el recolector.
+    Cada dato (precio, órdenes abiertas) se pide al exchange como máximo
+    una vez por ciclo: el primer hilo que lo necesita lo descarga y el resto reutiliza la misma copia,
+    así el dashboard, las alertas, el equity y las decisiones de trading ven exactamente los mismos datos.
+    """
+    def __init__(self, connector, max_age=5):
+        self.connector = connector
+        self.max_age = max_age
+        self._states = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        # Callback(symbol, orders) cada vez que llega un snapshot REST nuevo de órdenes abiertas
+        self.on_open_orders = None
+
+    def _entry(self, symbol):
+        with self._guard:
+            if symbol not in self._states:
+                self._states[symbol] = {'price': 0.0, 'open_orders': [], '_ts': {}}
+                self._locks[symbol] = threading.Lock()
+            return self._states[symbol], self._locks[symbol]
+
+    def _get(self, symbol, part, fetch, with_flag=False):
+        state, lock = self._entry(symbol)
+        fetched = False
+        # Un solo fetch por par y ciclo: si otro hilo ya lo está descargando, esperamos su resultado
+        with lock:
+            if time.time() - state['_ts'].get(part, 0) >= self.max_age:
+                value = fetch()
+                # Un precio 0 o un None son fallos de red: no se guardan como dato válido del ciclo
+                if value is not None and not (part == 'price' and not value):
+                    state[part] = value
+                    state['_ts'][part] = time.time()
+                    fetched = True
+            value = state[part]
+        return (value, fetched) if with_flag else value
+
+    def get_price(self, symbol):
+        if self.connector.is_streaming(): return self.connector.fetch_current_price(symbol)
+        return self._get(symbol, 'price', lambda: self.connector.fetch_current_price(symbol))
+
+    def get_prices(self, symbols, max_age=None):
+        """Precios de varios pares con UNA sola llamada (fetch_batch_prices) para los que estén caducados"""
+        prices, stale = {}, []
+        now = time.time()
+        max_age = self.max_age if max_age is None else max_age
+        for symbol in symbols:
+            if self.connector.is_streaming():
+                price = self.connector.fetch_current_price(symbol)
+                if price:
+                    prices[symbol] = price
+                    continue
+            state, _ = self._entry(symbol)
+            if state['price'] and now - state['_ts'].get('price', 0) < max_age:
+                prices[symbol] = state['price']
+            else:
+                stale.append(symbol)
+        if stale:
+            fresh = self.connector.fetch_batch_prices(stale)
+            for symbol in stale:
+                price = fresh.get(symbol, 0.0)
+                state, lock = self._entry(symbol)
+                with lock:
+                    if price:
+                        state['price'] = price
+                        state['_ts']['price'] = time.time()
+                    prices[symbol] = state['price']
+        return prices
+
+    def get_open_orders(self, symbol):
+        if self.connector.is_streaming(): return self.connector.fetch_open_orders(symbol) or []
+        orders, fetched = self._get(symbol, 'open_orders', lambda: self.connector.fetch_open_orders(symbol, strict=True), with_flag=True)
+        # Fuera del lock del par: el callback puede volver a consultar o invalidar el estado
+        if fetched and self.on_open_orders: self.on_open_orders(symbol, orders)
+        return list(orders)
+
+    def get_balance(self):
+        # El snapshot de saldos ya es único y compartido en el conector (TTL propio)
+        return self.connector.get_balance_snapshot()
+
+    def snapshot(self, symbol):
+        """Vista completa del par para este ciclo (precio, órdenes y saldos)"""
+        return {
+            'symbol': symbol,
+            'price': self.get_price(symbol),
+            'open_orders': self.get_open_orders(symbol),
+            'balance': self.get_balance()
+        }
+
+    def invalidate(self, symbol, part=None):
+        """Marca el dato como caducado (p.ej. tras crear o cancelar órdenes en ese par)"""
+        state, lock = self._entry(symbol)
+        with lock:
+            if part is None: state['_ts'] = {}
+            else: state['_ts'].pop(part, None)
+
+    def clear(self):
+        with self._guard:
+            self._states = {}
+            self._locks = {}
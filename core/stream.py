@@ -0,0 +1,175 @@
+# Archivo: gridbot_binance/core/stream.py
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+from utils.logger import log
+
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # Dependència opcional: sense ella el bot continua en mode REST
+    ws_connect = None
+
+STREAM_URL_REAL = "wss://stream.binance.com:9443/stream"
+STREAM_URL_TEST = "wss://stream.testnet.binance.vision/stream"
+
+class BinanceStream:
+    """
+    Client WebSocket (fil daemon) per al mode streaming.
+    Manté en memòria l'últim preu, les ordres obertes i els fills de cada parell
+    a partir dels streams 'miniTicker' i del user data stream (executionReport).
+    """
+    def __init__(self, url, symbol_ids, listen_key=None, on_balance=None, on_fill=None):
+        # symbol_ids: {'BTCUSDC': 'BTC/USDC', ...}
+        self.url = url
+        self.symbol_ids = dict(symbol_ids)
+        self.listen_key = listen_key
+        self.on_balance = on_balance
+        self.on_fill = on_fill    # Callback(symbol) per despertar el motor al moment
+
+        self._lock = threading.Lock()
+        self.prices = {}          # symbol -> (preu, timestamp)
+        self.open_orders = {}     # symbol -> {order_id: ordre}
+        self.synced = set()       # Símbols amb snapshot inicial d'ordres carregat
+        self._closed_ids = OrderedDict()  # Ordres tancades recentment (l'executionReport pot arribar abans que la resposta REST)
+        self.fills = {}           # symbol -> [trades pendents de consumir]
+
+        self.connected = False
+        self._running = False
+        self._ws = None
+        self._thread = None
+
+    # --- CICLE DE VIDA ---
+    def start(self):
+        if ws_connect is None:
+            log.error("Mode streaming no disponible: falta la llibreria 'websockets'.")
+            return False
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        self.connected = False
+        try:
+            if self._ws: self._ws.close()
+        except Exception: pass
+
+    def _build_url(self):
+        streams = [f"{sid.lower()}@miniTicker" for sid in self.symbol_ids]
+        if self.listen_key: streams.append(self.listen_key)
+        return f"{self.url}?streams={quote('/'.join(streams), safe='/@')}"
+
+    def _run(self):
+        backoff = 1
+        while self._running:
+            try:
+                with ws_connect(self._build_url(), open_timeout=10) as ws:
+                    self._ws = ws
+                    self.connected = True
+                    backoff = 1
+                    log.success(f"📶 Stream connectat ({len(self.symbol_ids)} parells).")
+                    for raw in ws:
+                        if not self._running: break
+                        self._on_message(raw)
+            except Exception as e:
+                if self._running: log.warning(f"Stream desconnectat: {e}. Reintentant en {backoff}s...")
+            self.connected = False
+            # Les ordres obertes s'han de tornar a sincronitzar per REST després d'un tall
+            with self._lock: self.synced.clear()
+            if self._running:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    # --- PROCESSAMENT DE MISSATGES ---
+    def _on_message(self, raw):
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        data = msg.get('data', msg)
+        etype = data.get('e')
+        if etype in ('24hrMiniTicker', '24hrTicker'):
+            symbol = self.symbol_ids.get(data.get('s'))
+            if symbol:
+                with self._lock: self.prices[symbol] = (float(data['c']), time.time())
+        elif etype == 'executionReport':
+            self._on_execution(data)
+        elif etype == 'outboundAccountPosition' and self.on_balance:
+            try: self.on_balance({b['a']: (float(b['f']), float(b['l'])) for b in data.get('B', [])})
+            except Exception: pass
+
+    def _on_execution(self, data):
+        symbol = self.symbol_ids.get(data.get('s'))
+        if not symbol: return
+        order_id = str(data.get('i'))
+        status = data.get('X')
+        price = float(data.get('p', 0.0))
+        amount = float(data.get('q', 0.0))
+        filled = float(data.get('z', 0.0))
+        with self._lock:
+            orders = self.open_orders.setdefault(symbol, {})
+            if status in ('NEW', 'PARTIALLY_FILLED') and data.get('o') == 'LIMIT':
+                orders[order_id] = {
+                    'id': order_id, 'symbol': symbol, 'type': 'limit', 'status': 'open',
+                    'side': data.get('S', '').lower(), 'price': price, 'amount': amount,
+                    'filled': filled, 'remaining': amount - filled, 'timestamp': data.get('T')
+                }
+            else:
+                orders.pop(order_id, None)
+                self._closed_ids[order_id] = True
+                if len(self._closed_ids) > 1000: self._closed_ids.popitem(last=False)
+
+            if data.get('x') == 'TRADE':
+                last_qty = float(data.get('l', 0.0))
+                last_price = float(data.get('L', 0.0))
+                fee_cost = float(data.get('n') or 0.0)
+                self.fills.setdefault(symbol, []).append({
+                    'id': str(data.get('t')), 'order': order_id, 'symbol': symbol,
+                    'side': data.get('S', '').lower(), 'price': last_price, 'amount': last_qty,
+                    'cost': last_price * last_qty, 'timestamp': data.get('T'),
+                    'takerOrMaker': 'maker' if data.get('m') else 'taker',
+                    'fee': {'cost': fee_cost, 'currency': data.get('N') or ''}
+                })
+        if data.get('x') == 'TRADE':
+            if self.on_fill:
+                try: self.on_fill(symbol)
+                except Exception: pass
+
+    # --- LECTURA DE L'ESTAT ---
+    def get_price(self, symbol, max_age=10):
+        with self._lock:
+            entry = self.prices.get(symbol)
+        if not entry or not self.connected: return None
+        price, ts = entry
+        return price if (time.time() - ts) <= max_age else None
+
+    def get_open_orders(self, symbol):
+        """Retorna les ordres obertes en memòria o None si el símbol no està sincronitzat"""
+        with self._lock:
+            if not self.connected or symbol not in self.synced: return None
+            return [dict(o) for o in self.open_orders.get(symbol, {}).values()]
+
+    def sync_open_orders(self, symbol, orders):
+        """Carrega el snapshot REST inicial; a partir d'aquí el mantenen els executionReport"""
+        with self._lock:
+            self.open_orders[symbol] = {str(o['id']): dict(o) for o in orders}
+            self.synced.add(symbol)
+
+    def track_order(self, order):
+        """Registra una ordre acabada de crear per REST abans que arribi el seu executionReport"""
+        if not order or order.get('type') != 'limit': return
+        with self._lock:
+            if str(order['id']) in self._closed_ids: return
+            self.open_orders.setdefault(order['symbol'], {})[str(order['id'])] = dict(order)
+
+    def forget_order(self, symbol, order_id=None):
+        with self._lock:
+            if order_id is None: self.open_orders[symbol] = {}
+            else: self.open_orders.get(symbol, {}).pop(str(order_id), None)
+
+    def pop_fills(self, symbol):
+        with self._lock:
+            return self.fills.pop(symbol, [])
@@ -0,0 +1,104 @@
+# Archivo: gridbot_binance/fake_stream.py
+"""
+Servidor WebSocket local que imita los streams de Binance para probar el modo streaming sin conexión.
+
+Uso:
+    python fake_stream.py --port 8765 --price BTCUSDC=60000 --fill-every 20
+
+Y en config.json5:
+    "streaming": { "enabled": true, "url": "ws://127.0.0.1:8765/stream", "listen_key": "fake" }
+
+- Cada cliente recibe un 'miniTicker' por segundo (paseo aleatorio) de los pares que pida en ?streams=.
+- Cualquier JSON enviado a ws://127.0.0.1:8765/control se reenvía tal cual a los clientes
+  suscritos al user data stream (p.ej. un executionReport hecho a mano).
+- Con --fill-every N se genera un executionReport FILLED sintético cada N segundos.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from websockets.sync.server import serve
+
+clients = {}  # websocket -> {'symbols': [...], 'user': nombre del user stream o None}
+clients_lock = threading.Lock()
+prices = {}
+trade_seq = [1000]
+
+def _broadcast_user(payload):
+    with clients_lock:
+        targets = [(ws, c) for ws, c in clients.items() if c['user']]
+    for ws, c in targets:
+        try: ws.send(json.dumps({"stream": c['user'], "data": payload}))
+        except Exception: pass
+
+def _execution_report(symbol_id, side, price, qty):
+    trade_seq[0] += 1
+    now = int(time.time() * 1000)
+    return {
+        "e": "executionReport", "E": now, "s": symbol_id, "S": side, "o": "LIMIT",
+        "i": trade_seq[0], "X": "FILLED", "x": "TRADE", "p": f"{price:.8f}", "q": f"{qty:.8f}",
+        "z": f"{qty:.8f}", "l": f"{qty:.8f}", "L": f"{price:.8f}", "n": "0", "N": "BNB",
+        "T": now, "t": trade_seq[0], "m": True
+    }
+
+def handler(ws):
+    url = urlparse(ws.request.path)
+    if url.path == '/control':
+        for raw in ws:
+            try: _broadcast_user(json.loads(raw))
+            except ValueError: pass
+        return
+
+    streams = parse_qs(url.query).get('streams', [''])[0].split('/')
+    if url.path.startswith('/ws/'): streams = [url.path[4:]]
+    symbols = [s.split('@')[0].upper() for s in streams if '@' in s]
+    user = next((s for s in streams if s and '@' not in s), None)
+    with clients_lock:
+        clients[ws] = {'symbols': symbols, 'user': user}
+    for sid in symbols: prices.setdefault(sid, 100.0)
+    print(f"[fake_stream] Cliente conectado: {symbols} (user data: {bool(user)})")
+    try:
+        for _ in ws: pass  # Mantenemos la conexión abierta hasta que el cliente cierre
+    finally:
+        with clients_lock: clients.pop(ws, None)
+
+def ticker_loop(fill_every):
+    last_fill = time.time()
+    while True:
+        time.sleep(1)
+        with clients_lock:
+            snapshot = list(clients.items())
+        for sid in list(prices):
+            prices[sid] *= 1 + random.uniform(-0.002, 0.002)
+        for ws, c in snapshot:
+            for sid in c['symbols']:
+                msg = {"stream": f"{sid.lower()}@miniTicker",
+                       "data": {"e": "24hrMiniTicker", "E": int(time.time() * 1000), "s": sid, "c": f"{prices[sid]:.8f}"}}
+                try: ws.send(json.dumps(msg))
+                except Exception: pass
+        if fill_every and prices and time.time() - last_fill >= fill_every:
+            last_fill = time.time()
+            sid = random.choice(list(prices))
+            _broadcast_user(_execution_report(sid, random.choice(["BUY", "SELL"]), prices[sid], 0.001))
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de streams Binance falso (pruebas offline)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--price', action='append', default=[], help="Precio inicial, p.ej. BTCUSDC=60000")
+    parser.add_argument('--fill-every', type=float, default=0, help="Segundos entre fills sintéticos (0 = nunca)")
+    args = parser.parse_args()
+
+    for item in args.price:
+        sid, value = item.split('=')
+        prices[sid.upper()] = float(value)
+
+    threading.Thread(target=ticker_loop, args=(args.fill_every,), daemon=True).start()
+    print(f"[fake_stream] Escuchando en ws://{args.host}:{args.port}/stream (control: /control)")
+    with serve(handler, args.host, args.port) as server:
+        server.serve_forever()
+
+if __name__ == "__main__":
+    main()
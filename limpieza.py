@@ -45,9 +45,19 @@ def main():
 
     grand_total_usdc = 0.0
 
+    # Un solo snapshot de saldos y un solo ticker por lotes para todos los activos
+    balances = {asset: connector.get_total_balance(asset) for asset in assets_to_check}
+    wanted = [f"{a}/USDC" for a, qty in balances.items() if qty > 0 and a != 'USDC']
+    # Un símbolo inexistente (p.ej. base deslistada) haría fallar el lote entero: solo van al lote los pares conocidos
+    markets = (connector.exchange.markets if connector.exchange else None) or {}
+    prices = connector.fetch_batch_prices([s for s in wanted if s in markets] if markets else wanted)
+    # Lo que falte del lote se pide par a par (como antes): solo se pierde el activo problemático
+    for symbol in wanted:
+        if symbol not in prices: prices[symbol] = connector.fetch_current_price(symbol)
+
     # Iteramos activos y calculamos valor aproximado
     for asset in sorted(list(assets_to_check)):
-        total_balance = connector.get_total_balance(asset)
+        total_balance = balances[asset]
         
         if total_balance > 0:
             usdc_value = 0.0
@@ -58,7 +68,7 @@ def main():
                 price_display = "(1.0)"
             else:
                 symbol = f"{asset}/USDC"
-                price = connector.fetch_current_price(symbol)
+                price = prices.get(symbol, 0.0)
                 if price:
                     usdc_value = total_balance * price
                     price_display = f"(@ {price:.4f})"
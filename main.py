@@ -42,6 +42,8 @@ def main():
         # Si el motor del bot estaba corriendo, lo paramos suavemente
         if bot.is_running:
             bot.stop_logic()
+        # Cerramos las conexiones SQLite persistentes (una por hilo)
+        bot.db.close()
             
         print(f"\n{Fore.GREEN}👋 ¡Sistema cerrado correctamente!{Style.RESET_ALL}\n")
         sys.exit(0)
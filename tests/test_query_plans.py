@@ -0,0 +1,62 @@
+# Archivo: gridbot_binance/tests/test_query_plans.py
+# Les consultes calentes sobre trade_history han de resoldre's amb índexs (migració v2):
+# cap pla pot contenir un 'SCAN trade_history' (recorregut sencer de la taula).
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_FOLDER', str(tmp_path))
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'bot_data.db'))
+    bot_db = database.BotDatabase()
+    now_ms = int(time.time() * 1000)
+    trades = [{
+        'id': str(i), 'order': f"o{i}", 'symbol': 'BTC/USDC' if i % 2 else 'ETH/USDC',
+        'side': 'buy' if i % 3 else 'sell', 'price': 100.0 + i, 'amount': 0.1,
+        'cost': 10.0 + i / 10, 'fee': None, 'timestamp': now_ms - i * 60000,
+    } for i in range(200)]
+    bot_db.save_trades(trades)
+    yield bot_db
+    bot_db.close()
+
+
+def _traced_statements(db, call):
+    """SQL (amb els paràmetres ja expandits) que executa 'call' sobre la connexió del fil"""
+    conn = db._get_conn()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+
+
+def _full_scans(db, statements):
+    conn = db._get_conn()
+    scans = []
+    for sql in statements:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+            if row[3].startswith('SCAN trade_history'): scans.append((sql.strip(), row[3]))
+    return scans
+
+
+@pytest.mark.parametrize('name, call', [
+    ('get_last_buy_price', lambda db: db.get_last_buy_price('BTC/USDC')),
+    ('find_linked_buy_id', lambda db: db.find_linked_buy_id('BTC/USDC', 150.0, 1.0)),
+    ('get_buy_trade_uuid_for_sell_order', lambda db: db.get_buy_trade_uuid_for_sell_order('BTC/USDC', 150.0, 1.0)),
+    ('get_stats', lambda db: db.get_stats(from_timestamp=time.time() - 3600)),
+    ('get_pair_data', lambda db: db.get_pair_data('BTC/USDC')),
+])
+def test_no_full_scan_of_trade_history(db, name, call):
+    statements = _traced_statements(db, lambda: call(db))
+    assert statements, f"{name} no ha executat cap SELECT"
+    assert _full_scans(db, statements) == []
@@ -2,20 +2,33 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles 
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 import uvicorn
+import asyncio
+import hashlib
+import threading
 import os
 import time
+import json
 import json5 
 import math
-from datetime import datetime
-from core.database import BotDatabase 
+import numpy as np
+from collections import OrderedDict
+from core.database import BotDatabase, VERSION_ALL, data_version, downsample_ohlcv, timeframe_to_ms, CANDLE_FIELDS
 from utils.telegram import send_msg
 from utils.logger import log
 from dotenv import load_dotenv 
 
+try:
+    import orjson
+except ImportError:  # Dependència opcional: sense ella es fa servir json estàndard
+    orjson = None
+
 app = FastAPI()
+# Respuestas comprimidas (el stream SSE queda excluido por Starlette)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 static_dir = os.path.join(BASE_DIR, "static")
@@ -28,6 +41,14 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 db = BotDatabase()
 bot_instance = None 
+MIN_CHART_CANDLES = 100
+MAX_CHART_POINTS = 5000   # Tope de max_points que puede pedir el cliente
+STATUS_IDLE_REFRESH = 30  # Con el motor parado (sin recolector) el snapshot se recalcula como mucho cada 30s
+SSE_KEEPALIVE = 15   # Segundos entre comentarios de keep-alive del stream de eventos
+RESPONSE_CACHE_SIZE = 64
+_response_cache = OrderedDict()   # clave versionada -> cuerpo JSON ya serializado
+_response_cache_lock = threading.Lock()
+_BOOT_ID = f"{os.getpid()}-{time.time()}"   # Los contadores de versión empiezan de 0 en cada arranque
 
 class ConfigUpdate(BaseModel):
     content: str
@@ -67,13 +88,41 @@ def _calculate_rsi(candles, period=14):
     except:
         return 50.0
 
+def _json_bytes(data):
+    if orjson: return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+def _versioned_json(request, key, build):
+    """
+    Respuesta JSON para una clave que incluye las versiones de los datos que usa.
+    Mismo ETag que el cliente -> 304 sin recalcular nada; si no, cuerpo de la caché LRU o build().
+    build() devuelve (datos, cacheable): lo no cacheable se sirve sin ETag.
+    """
+    etag = 'W/"' + hashlib.blake2b(repr((_BOOT_ID, key)).encode(), digest_size=12).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get('if-none-match', ''): return Response(status_code=304, headers=headers)
+    with _response_cache_lock:
+        body = _response_cache.get(key)
+        if body is not None: _response_cache.move_to_end(key)
+    if body is None:
+        data, cacheable = build()
+        body = _json_bytes(data)
+        if not cacheable: return Response(content=body, media_type="application/json")
+        with _response_cache_lock:
+            _response_cache[key] = body
+            while len(_response_cache) > RESPONSE_CACHE_SIZE: _response_cache.popitem(last=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 def start_server(bot, host=None, port=None):
     global bot_instance
     bot_instance = bot
     load_dotenv('config/.env', override=True)
     if host is None: host = os.getenv('WEB_HOST', '127.0.0.1') 
     if port is None: port = int(os.getenv('WEB_PORT', 8001))
-    uvicorn.run(app, host=host, port=port, log_level="error")
+    try:
+        uvicorn.run(app, host=host, port=port, log_level="error")
+    finally:
+        db.close()
 
 def format_uptime(seconds):
     if seconds < 0: return "0s"
@@ -98,156 +147,104 @@ def get_account_info_api():
     return bot_instance.connector.get_account_status()
 # ---------------------------------
 
+EMPTY_STATUS = {
+    "active_pairs": [], "balance_usdc": 0, "total_usdc_value": 0, "portfolio_distribution": [], "session_trades_distribution": [], "global_trades_distribution": [], "strategies": [],
+    "stats": { "session": {"trades":0,"profit":0,"best_coin":"-","uptime":"-"}, "global": {"trades":0,"profit":0,"best_coin":"-","uptime":"-"} }
+}
+
+def _refresh_status():
+    """Republica el snapshot tras una acción que cambia estadísticas (sin esperar al próximo ciclo del recolector)"""
+    try:
+        if bot_instance: bot_instance.publish_status()
+    except Exception as e: log.error(f"Error publicando estado: {e}")
+
+def _refresh_status_if_idle():
+    """Con el motor parado no hay recolector: el snapshot se recalcula aquí como mucho cada STATUS_IDLE_REFRESH s"""
+    if bot_instance and not bot_instance.is_running and time.time() - bot_instance.status_checked_at > STATUS_IDLE_REFRESH:
+        _refresh_status()
+
 @app.get("/api/status")
 def get_status():
+    # Lee el snapshot que publica el bot tras cada ciclo; con el motor parado se recalcula aquí cada STATUS_IDLE_REFRESH s
     if not bot_instance: return {"status": "Offline"}
     
     try:
-        status_text = "Stopped"
-        if bot_instance.is_running:
-            status_text = "Paused" if bot_instance.is_paused else "Running"
-
-        prices = db.get_all_prices()
-        
-        all_balances_cache = {}
-        try:
-            if bot_instance.connector and bot_instance.connector.exchange:
-                all_balances_cache = bot_instance.connector.exchange.fetch_balance()
-        except: pass
-        
-        def get_bal_safe(asset):
-            if not all_balances_cache: return 0.0
-            data = all_balances_cache.get(asset, {})
-            free = float(data.get('free', 0.0))
-            used = float(data.get('used', 0.0))
-            return free + used
-
-        portfolio = []
-        current_total_equity = 0.0
-        
-        usdc_balance = get_bal_safe('USDC')
-        portfolio.append({"name": "USDC", "value": round(usdc_balance, 2)})
-        current_total_equity += usdc_balance
-
-        holding_values = {}
-        current_prices_map = {}
-
-        pairs_to_check = []
-        if bot_instance and bot_instance.config:
-            pairs_to_check = [p['symbol'] for p in bot_instance.config.get('pairs', [])]
-        
-        for symbol in pairs_to_check:
-            base = symbol.split('/')[0]
-            try:
-                qty = get_bal_safe(base)
-                price = prices.get(symbol, 0.0)
-                if price == 0 and bot_instance.connector.exchange: 
-                    price = bot_instance.connector.fetch_current_price(symbol)
-                
-                if price > 0:
-                    current_prices_map[symbol] = price 
-                    val = qty * price
-                    holding_values[symbol] = val 
-                    if val > 0.5: 
-                        portfolio.append({"name": base, "value": round(val, 2)})
-                        current_total_equity += val
-            except: pass
-
-        # 1. Obtenim estadístiques de la SESSIÓ ACTUAL
-        session_start_ts = bot_instance.global_start_time
-        session_stats = db.get_stats(from_timestamp=session_start_ts)
-        session_cash_flow = session_stats['per_coin_stats']['cash_flow']
-        
-        # 2. Obtenim estadístiques GLOBALS
-        global_trades_stats = db.get_stats(from_timestamp=0) 
-        
-        session_uptime_str = format_uptime(time.time() - session_start_ts) if bot_instance.is_running else "OFF"
-        first_run_ts = db.get_first_run_timestamp()
-        total_uptime_str = format_uptime(time.time() - first_run_ts)
-
-        strategies_data = []
-        acc_global_pnl = 0.0
-        acc_session_pnl = 0.0
-
-        for symbol in pairs_to_check:
-            try:
-                pair_config = next((p for p in bot_instance.config['pairs'] if p['symbol'] == symbol), None)
-                if not pair_config: continue
-
-                strat_conf = pair_config.get('strategy', {})
-                is_enabled = pair_config.get('enabled', False)
-
-                trades_count = global_trades_stats['per_coin_stats']['trades'].get(symbol, 0)
-                curr_price = current_prices_map.get(symbol, 0.0)
-                curr_val = holding_values.get(symbol, 0.0)
-                
-                # --- CÀLCUL PNL SESSIÓ ---
-                cf_session = session_cash_flow.get(symbol, 0.0)
-                qty_delta = session_stats['per_coin_stats']['qty_delta'].get(symbol, 0.0)
-                strat_pnl_session = (qty_delta * curr_price) + cf_session
-
-                # --- CÀLCUL PNL GLOBAL (SISTEMA CAIXA REGISTRADORA) ---
-                accumulated_history = db.get_accumulated_pnl(symbol)
-                strat_pnl_global = accumulated_history + strat_pnl_session
-                # -------------------------
-
-                acc_global_pnl += strat_pnl_global
-                acc_session_pnl += strat_pnl_session
-
-                if is_enabled or trades_count > 0 or curr_val > 1.0:
-                    strategies_data.append({
-                        "symbol": symbol,
-                        "enabled": is_enabled,
-                        "grids": strat_conf.get('grids_quantity', '-'),
-                        "amount": strat_conf.get('amount_per_grid', '-'),
-                        "spread": strat_conf.get('grid_spread', '-'),
-                        "total_trades": trades_count,
-                        "total_pnl": round(strat_pnl_global, 2),  
-                        "session_pnl": round(strat_pnl_session, 2)
-                    })
-            except Exception as e:
-                log.error(f"Error procesando stats {symbol}: {e}")
-
-        return {
-            "status": status_text,
-            "active_pairs": bot_instance.active_pairs if bot_instance else [], 
-            "balance_usdc": round(usdc_balance, 2),
-            "total_usdc_value": round(current_total_equity, 2),
-            "portfolio_distribution": portfolio,
-            "session_trades_distribution": session_stats['trades_distribution'],
-            "global_trades_distribution": global_trades_stats['trades_distribution'],
-            "strategies": strategies_data,
-            "stats": {
-                "session": {
-                    "trades": session_stats['trades'],
-                    "profit": round(acc_session_pnl, 2),
-                    "best_coin": session_stats['best_coin'],
-                    "uptime": session_uptime_str
-                },
-                "global": {
-                    "trades": global_trades_stats['trades'],
-                    "profit": round(acc_global_pnl, 2),
-                    "best_coin": global_trades_stats['best_coin'],
-                    "uptime": total_uptime_str
-                }
-            }
+        status_text = bot_instance.engine_status()
+
+        if bot_instance.status_snapshot is None: _refresh_status()
+        else: _refresh_status_if_idle()
+        snap = bot_instance.status_snapshot
+        if snap is None: return dict(EMPTY_STATUS, status=status_text)
+
+        now = time.time()
+        session_uptime_str = format_uptime(now - snap['session_start']) if bot_instance.is_running else "OFF"
+        stats = {
+            "session": dict(snap['stats']['session'], uptime=session_uptime_str),
+            "global": dict(snap['stats']['global'], uptime=format_uptime(now - snap['first_run']))
         }
+        return dict(snap, status=status_text, stats=stats)
     except Exception as e:
         log.error(f"FATAL API ERROR: {e}")
-        return {
-            "status": "Error", "active_pairs": [], "balance_usdc": 0, "total_usdc_value": 0, "portfolio_distribution": [], "session_trades_distribution": [], "global_trades_distribution": [], "strategies": [],
-            "stats": { "session": {"trades":0,"profit":0,"best_coin":"-","uptime":"-"}, "global": {"trades":0,"profit":0,"best_coin":"-","uptime":"-"} }
-        }
+        return dict(EMPTY_STATUS, status="Error")
+
+@app.get("/api/events")
+async def events_stream(request: Request):
+    """Server-Sent Events: el dashboard recibe solo los cambios (precio, órdenes, trades, equity, motor, estado)"""
+    if not bot_instance: raise HTTPException(status_code=503, detail="Bot no iniciado")
+    bus = bot_instance.events
+    # Al reconectar, EventSource envía Last-Event-ID y se reenvía lo que se haya perdido
+    header = request.headers.get('last-event-id', '')
+    last_id = int(header) if header.isdigit() else bus.last_id
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    def notify(): loop.call_soon_threadsafe(wake.set)
+
+    async def stream():
+        nonlocal last_id
+        bus.add_waiter(notify)
+        try:
+            yield f"retry: 3000\nid: {last_id}\nevent: engine\ndata: {json.dumps({'status': bot_instance.engine_status()})}\n\n"
+            while not await request.is_disconnected():
+                # Se limpia ANTES de leer: lo que se publique después vuelve a despertar al cliente
+                wake.clear()
+                events = bus.since(last_id)
+                if events is None:
+                    last_id = bus.last_id
+                    yield f"id: {last_id}\nevent: resync\ndata: {{}}\n\n"
+                    continue
+                for event_id, kind, payload in events:
+                    last_id = event_id
+                    yield f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+                if events: continue
+                try: await asyncio.wait_for(wake.wait(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    # Motor parado: los cambios de saldo también llegan por push (evento 'status')
+                    await loop.run_in_executor(None, _refresh_status_if_idle)
+        finally:
+            bus.remove_waiter(notify)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/history/balance")
-def get_balance_history_api():
-    try:
-        full_hist = db.get_balance_history(from_timestamp=0)
-        session_start = bot_instance.global_start_time if bot_instance else 0
-        session_hist = [x for x in full_hist if x[0] >= session_start]
-        def fmt(rows): return [[r[0]*1000, round(r[1], 2)] for r in rows]
-        return { "global": fmt(full_hist), "session": fmt(session_hist) }
-    except: return {"global": [], "session": []}
+def get_balance_history_api(request: Request, hours: float = 0, max_points: int = 500, start: int = 0, end: int = 0):
+    # Rango: start/end en ms (zoom) o las últimas 'hours' (0 = todo). Series reducidas con LTTB a max_points
+    max_points = max(10, min(max_points, MAX_CHART_POINTS))
+    session_start = bot_instance.global_start_time if bot_instance else 0
+    to_ts = end / 1000 if end > 0 else None
+    def build():
+        try:
+            from_ts = start / 1000 if start > 0 else (time.time() - hours * 3600 if hours > 0 else 0)
+            def fmt(rows): return [[r[0]*1000, round(r[1], 2)] for r in rows]
+            return {
+                "global": fmt(db.get_balance_series(from_ts, max_points, to_ts)),
+                "session": fmt(db.get_balance_series(max(session_start, start / 1000), max_points, to_ts))
+            }, True
+        except: return {"global": [], "session": []}, False
+    # Una ventana relativa (últimas N horas) también avanza sola: se renueva cada 5 min aunque no haya datos nuevos
+    window = int(time.time() // 300) if hours > 0 and start <= 0 else 0
+    key = ('balance', hours, max_points, start, end, session_start, window, data_version(VERSION_ALL, 'balance'))
+    return _versioned_json(request, key, build)
 
 @app.get("/api/orders")
 def get_all_orders():
@@ -281,9 +278,9 @@ def get_all_orders():
 def get_wallet_data():
     if not bot_instance or not bot_instance.connector.exchange: return []
     try:
-        balances = bot_instance.connector.exchange.fetch_balance()
+        balances = bot_instance.connector.get_balance_snapshot()
         if not balances: return []
-        tickers = bot_instance.connector.exchange.fetch_tickers()
+        tickers = bot_instance.connector.get_all_tickers()
         wallet_list = []
         items = balances.get('total', {}).items()
         for asset, total_qty in items:
@@ -324,6 +321,7 @@ def liquidate_asset_api(req: LiquidateRequest):
             if order:
                 msg = f"Activo {asset} liquidado a USDC."
                 log.success(msg)
+                _refresh_status()
                 send_msg(f"🔥 <b>LIQUIDACIÓN MANUAL</b>\nSe ha vendido todo el {asset} a USDC.")
                 return {"status": "success", "message": msg}
             else: raise HTTPException(status_code=400, detail="Error al ejecutar la orden de venta.")
@@ -355,6 +353,7 @@ def clear_history_api(req: ClearHistoryRequest):
     except: pass
     try:
         count = db.delete_history_smart(symbol, keep_ids)
+        _refresh_status()
         return {"status": "success", "message": f"Historial limpiado. Borrados: {count}"}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -371,6 +370,7 @@ def adjust_balance_api(req: BalanceAdjustRequest):
             value_usdc = amount * price
             db.adjust_coin_initial_balance(symbol, value_usdc)
         db.adjust_balance_history(value_usdc)
+        _refresh_status()
         tipo = "Ingrés" if amount > 0 else "Retirada"
         log.info(f"💰 AJUST CAPITAL: {tipo} de {amount} {asset} ({value_usdc:.2f} USDC)")
         send_msg(f"📝 <b>CAPITAL {tipo.upper()}</b>\nS'ha ajustat la comptabilitat: {amount} {asset}")
@@ -392,6 +392,7 @@ def reset_stats_api():
             if bot_instance.active_pairs:
                 log.info("📸 Forçant snapshot inicial de preus per Reset...")
                 bot_instance.capture_initial_snapshots()
+        _refresh_status()
         send_msg("⚠️ <b>RESET TOTAL</b>\nSe han borrado todas las estadísticas y reiniciado el punto 0.")
         return {"status": "success", "message": "Reset Total completado. PnL a 0."}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
@@ -412,6 +413,7 @@ def reset_session_chart_api():
             bot_instance.global_start_time = new_time
             initial_equity = bot_instance.calculate_total_equity()
             db.set_session_start_balance(initial_equity)
+        _refresh_status()
         return {"status": "success", "message": "Gráfica/PnL Sesión reiniciados."}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -420,6 +422,7 @@ def reset_global_pnl_api():
     try:
         db.clear_all_trades_history()
         db.reset_global_pnl_history()
+        _refresh_status()
         return {"status": "success", "message": "Historial de PnL Global reiniciado a 0."}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -441,6 +444,7 @@ def reset_coin_session_api(req: CoinResetRequest):
                 price = bot_instance.connector.fetch_current_price(req.symbol)
                 db.set_coin_initial_balance(req.symbol, qty * price)
              except: pass
+        _refresh_status()
         return {"status": "success", "message": f"Sesión reiniciada para {req.symbol}."}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -455,6 +459,7 @@ def reset_coin_global_api(req: CoinResetRequest):
                 price = bot_instance.connector.fetch_current_price(req.symbol)
                 db.set_coin_initial_balance(req.symbol, qty * price)
              except: pass
+        _refresh_status()
         return {"status": "success", "message": f"Historial Global borrado para {req.symbol}."}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
@@ -496,17 +501,33 @@ def close_order_api(req: CloseOrderRequest):
     else: raise HTTPException(status_code=400, detail="Error cerrando orden.")
 
 @app.get("/api/details/{symbol:path}")
-def get_pair_details(symbol: str, timeframe: str = '15m'):
+def get_pair_details(request: Request, symbol: str, timeframe: str = '15m', max_points: int = 500, start: int = 0, end: int = 0):
+    # start/end en ms acotan el rango de velas; si no caben en max_points se agrupan en velas mayores (OHLC)
+    max_points = max(10, min(max_points, MAX_CHART_POINTS))
+    running = bool(bot_instance and bot_instance.is_running)
+    session_start = bot_instance.global_start_time if bot_instance else 0
+    key = ('details', symbol, timeframe, max_points, start, end, running, session_start,
+           data_version(VERSION_ALL, ('market', symbol), ('trades', symbol), ('candles', symbol, timeframe)))
+    return _versioned_json(request, key, lambda: _build_pair_details(symbol, timeframe, max_points, start, end or None))
+
+def _build_pair_details(symbol, timeframe, max_points=500, start=0, end=None):
     try:
+        cacheable = True
         data = db.get_pair_data(symbol)
-        raw_candles = data.get('candles', [])
-        if not raw_candles and bot_instance and bot_instance.is_running:
-            try: raw_candles = bot_instance.connector.fetch_candles(symbol, timeframe=timeframe, limit=500)
+        candles = db.get_candle_arrays(symbol, timeframe, start, end)
+        # Pocas velas agregadas (p.ej. 4h desde 500 de 15m) o timeframe menor que la base: buffer del conector.
+        # Solo se lee (sin llamar al exchange): el recolector lo mantiene mientras se consulte y versiona sus cambios.
+        if len(candles['time']) < MIN_CHART_CANDLES and bot_instance and bot_instance.is_running:
+            try:
+                bot_instance.watch_chart_timeframe(symbol, timeframe)
+                raw = np.array(bot_instance.connector.peek_candles(symbol, timeframe), dtype=np.float64).reshape(-1, len(CANDLE_FIELDS))
+                raw = raw[(raw[:, 0] >= start) & (raw[:, 0] <= (end or np.inf))]
+                if len(raw) > len(candles['time']):
+                    candles = {name: raw[:, i] for i, name in enumerate(CANDLE_FIELDS)}
             except: pass
-        chart_data = []
-        for candle in raw_candles:
-            dt = datetime.fromtimestamp(candle[0]/1000).strftime('%Y-%m-%d %H:%M')
-            chart_data.append([dt, candle[1], candle[4], candle[3], candle[2]])
+        candles = downsample_ohlcv(candles, max_points, timeframe_to_ms(timeframe) or 60000)
+        # [tiempo ms, open, close, low, high]: el navegador ya no tiene que parsear fechas en texto
+        chart_data = np.column_stack([candles[f] for f in ('time', 'open', 'close', 'low', 'high')]).tolist()
 
         pnl_value_session = 0.0
         global_pnl = 0.0
@@ -515,6 +536,7 @@ def get_pair_details(symbol: str, timeframe: str = '15m'):
             current_price = data.get('price', 0.0)
             if current_price == 0 and bot_instance.is_running: 
                 current_price = bot_instance.connector.fetch_current_price(symbol)
+                cacheable = False
 
             if current_price > 0:
                 # --- PnL SESSIÓ ---
@@ -538,10 +560,10 @@ def get_pair_details(symbol: str, timeframe: str = '15m'):
             "grid_lines": data.get('grid_levels', []),
             "session_pnl": round(pnl_value_session, 2), 
             "global_pnl": round(global_pnl, 2)   
-        }
+        }, cacheable
     except Exception as e:
         log.error(f"Error details {symbol}: {e}")
-        return {"symbol": symbol, "price": 0, "open_orders": [], "trades": [], "chart_data": [], "grid_lines": [], "session_pnl": 0, "global_pnl": 0}
+        return {"symbol": symbol, "price": 0, "open_orders": [], "trades": [], "chart_data": [], "grid_lines": [], "session_pnl": 0, "global_pnl": 0}, False
 
 @app.get("/api/config")
 def get_config():
@@ -588,6 +610,7 @@ def panic_cancel_all_api():
 def panic_sell_all_api():
     if bot_instance:
         bot_instance.panic_sell_all()
+        _refresh_status()
         return {"status": "success", "message": "Venta pánico ejecutada."}
     return {"status": "error", "detail": "Bot no iniciado"}
 
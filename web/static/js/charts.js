@@ -136,18 +136,21 @@ export function renderLineChart(domId, data, color) {
         });
     }
 
-    const formattedData = data.map(d => ({ time: d[0] / 1000, value: d[1] }));
-    const uniqueData = [];
-    const seenTimes = new Set();
-    formattedData.sort((a, b) => a.time - b.time);
-    formattedData.forEach(item => {
-        if (!seenTimes.has(item.time)) { seenTimes.add(item.time); uniqueData.push(item); }
-    });
-
-    chartInstances[domId].series.setData(uniqueData);
+    // Serie ya reducida (LTTB) y ordenada en el servidor para el rango pedido
+    chartInstances[domId].series.setData(data.map(d => ({ time: d[0] / 1000, value: d[1] })));
     chartInstances[domId].chart.timeScale().fitContent();
 }
 
+// Añade un punto de equity recibido por push (sin recargar la serie)
+export function appendLinePoint(domId, timeMs, value) {
+    const inst = chartInstances[domId];
+    if (!inst) return;
+    const last = inst.series.dataByIndex(Infinity, LightweightCharts.MismatchDirection.NearestLeft);
+    const time = timeMs / 1000;
+    if (last && time < last.time) return;
+    inst.series.update({ time, value });
+}
+
 // --- LIGHTWEIGHT CHARTS (Velas / Principal) ---
 export function renderCandleChart(safeSym, data, gridLines, activeOrders = [], chartType = 'candles') {
     if (typeof LightweightCharts === 'undefined') return;
@@ -222,35 +225,16 @@ export function renderCandleChart(safeSym, data, gridLines, activeOrders = [], c
     // Limpiar líneas anteriores
     const mainSeries = chartInstances[domId].mainSeries;
 
-    // Dibujar Grid (Líneas punteadas)
-    const formattedData = data.map(d => {
-        const dateParts = d[0].split(/[- :]/); 
-        const dateObj = new Date(dateParts[0], dateParts[1]-1, dateParts[2], dateParts[3], dateParts[4]);
-        return { time: dateObj.getTime() / 1000, open: parseFloat(d[1]), high: parseFloat(d[4]), low: parseFloat(d[3]), close: parseFloat(d[2]), value: parseFloat(d[2]) };
-    });
-
-    // Dibujar Órdenes Activas
-    const uniqueData = [];
-    const seenTimes = new Set();
-    formattedData.sort((a, b) => a.time - b.time);
-    formattedData.forEach(item => {
-        if (!seenTimes.has(item.time)) { seenTimes.add(item.time); uniqueData.push(item); }
-    });
+    // El servidor ya envía las velas ordenadas, sin duplicados y acotadas a max_points: [tiempo ms, open, close, low, high]
+    const uniqueData = data.map(d => ({ time: d[0] / 1000, open: d[1], high: d[4], low: d[3], close: d[2], value: d[2] }));
 
     mainSeries.setData(uniqueData);
     axisSeries.setData(uniqueData.map(d => ({ time: d.time, value: d.close })));
+    // Ancho de vela real (puede venir agrupada): lo usa updateLastCandle para abrir la siguiente
+    const n = uniqueData.length;
+    chartInstances[domId].barSeconds = n > 1 ? uniqueData[n - 1].time - uniqueData[n - 2].time : 0;
 
-    // Líneas
-    chartInstances[domId].activeLines.forEach(line => mainSeries.removePriceLine(line));
-    chartInstances[domId].activeLines = [];
-
-    activeOrders.forEach(o => {
-        const isBuy = o.side === 'buy';
-        const line = mainSeries.createPriceLine({
-            price: parseFloat(o.price), color: isBuy ? colors.up : colors.down, lineWidth: 2, lineStyle: LightweightCharts.LineStyle.Solid, axisLabelVisible: true, title: (isBuy ? 'C' : 'V') + ` ${fmtInt(o.amount)}`,
-        });
-        chartInstances[domId].activeLines.push(line);
-    });
+    setOrderLines(safeSym, activeOrders);
     
     // Zoom Inicial
     if (!chartInstances[domId].initialZoomDone) {
@@ -265,6 +249,40 @@ export function renderCandleChart(safeSym, data, gridLines, activeOrders = [], c
     }
 }
 
+// Líneas de las órdenes abiertas sobre la serie principal
+export function setOrderLines(safeSym, orders) {
+    const inst = chartInstances[`chart-${safeSym}`];
+    if (!inst) return;
+    const colors = getThemeColors();
+    inst.activeLines.forEach(line => inst.mainSeries.removePriceLine(line));
+    inst.activeLines = (orders || []).map(o => {
+        const isBuy = o.side === 'buy';
+        return inst.mainSeries.createPriceLine({
+            price: parseFloat(o.price), color: isBuy ? colors.up : colors.down, lineWidth: 2, lineStyle: LightweightCharts.LineStyle.Solid, axisLabelVisible: true, title: (isBuy ? 'C' : 'V') + ` ${fmtInt(o.amount)}`,
+        });
+    });
+}
+
+// Aplica un precio recibido por push a la última vela (o abre la siguiente) sin volver a pedir el gráfico
+export function updateLastCandle(safeSym, timeMs, price) {
+    const inst = chartInstances[`chart-${safeSym}`];
+    if (!inst || !inst.barSeconds) return;
+    const last = inst.mainSeries.dataByIndex(Infinity, LightweightCharts.MismatchDirection.NearestLeft);
+    if (!last) return;
+    const time = timeMs / 1000;
+    if (time < last.time) return;
+    let bar;
+    if (time < last.time + inst.barSeconds) {
+        const prev = last.close ?? last.value;
+        bar = { time: last.time, open: last.open ?? prev, high: Math.max(last.high ?? prev, price), low: Math.min(last.low ?? prev, price), close: price, value: price };
+    } else {
+        const start = last.time + Math.floor((time - last.time) / inst.barSeconds) * inst.barSeconds;
+        bar = { time: start, open: price, high: price, low: price, close: price, value: price };
+    }
+    inst.mainSeries.update(inst.activeType === 'line' ? { time: bar.time, value: price } : bar);
+    inst.axisSeries.update({ time: bar.time, value: price });
+}
+
 // Reset Zoom
 export function resetChartZoom(safeSym) {
     const domId = `chart-${safeSym}`;
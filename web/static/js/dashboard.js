@@ -1,6 +1,6 @@
 // Archivo: gridbot_binance/web/static/js/dashboard.js
-import { fmtUSDC, fmtPrice, fmtInt, fmtCrypto, fmtPct, updateColorValue } from './utils.js';
-import { renderDonut, renderLineChart, renderCandleChart, resetChartZoom, destroyChart } from './charts.js';
+import { fmtUSDC, fmtPrice, fmtInt, fmtCrypto, fmtPct, fmtUptime, updateColorValue } from './utils.js';
+import { renderDonut, renderLineChart, renderCandleChart, resetChartZoom, destroyChart, setOrderLines, updateLastCandle, appendLinePoint } from './charts.js';
 import { loadConfigForm, saveConfigForm, toggleCard, changeRsiTf, applyStrategy, setManual, analyzeSymbol } from './config.js';
 
 // --- ESTADO GLOBAL ---
@@ -8,7 +8,21 @@ let currentMode = 'home';
 let currentTimeframe = '15m';
 let currentChartType = 'candles'; 
 let dataCache = {}; 
-let fullGlobalHistory = []; 
+let currentHistoryHours = 'all'; 
+const CHART_MAX_POINTS = 500;   // Puntos por gráfica: el servidor reduce (LTTB / velas agrupadas) el rango pedido
+
+// --- PUSH (SSE) ---
+const POLL_INTERVAL_MS = 4000;
+let eventSource = null;
+let sseConnected = false;
+let pollTimer = null;
+let engineWaiters = [];
+// Copia local de lo que llega por push: los eventos se aplican aquí en lugar de volver a pedir los endpoints
+let statusData = null;      // Último /api/status + cambios recibidos (evento 'status')
+let engineState = null;
+let globalOrders = {};      // symbol -> órdenes abiertas (tabla global de la home)
+let lastPrices = {};        // symbol -> último precio recibido
+let symbolTrades = [];      // Historial del par abierto
 
 // --- EXPORTAR A WINDOW (Perquè funcioni l'onclick de l'HTML) ---
 window.loadConfigForm = loadConfigForm;
@@ -226,18 +240,9 @@ function filterHistory(hours) {
         else if(val.includes(`(${hours})`)) btn.classList.add('active');
     });
 
-    if (!fullGlobalHistory || fullGlobalHistory.length === 0) return;
-
-    let filteredData = [];
-    if (hours === 'all') {
-        filteredData = fullGlobalHistory;
-    } else {
-        const now = Date.now();
-        const cutoff = now - (hours * 3600 * 1000);
-        filteredData = fullGlobalHistory.filter(d => d[0] >= cutoff);
-    }
-
-    renderLineChart('balanceChartGlobal', filteredData, '#3b82f6');
+    // El servidor ya devuelve el rango pedido con un nº de puntos acotado (rollups)
+    currentHistoryHours = hours;
+    loadBalanceCharts();
 }
 
 // --- NOU: GESTIÓ D'INGRESSOS I RETIRADES ---
@@ -291,37 +296,76 @@ async function openCapitalAdjustment() {
 
 // --- WALLET ---
 async function loadHome() {
+    await loadStatus();
+    loadBalanceCharts();
+    loadGlobalOrders();
+}
+
+function renderEngineStatus(status) {
+    const badge = document.getElementById('status-badge');
+    let engineBtn = document.getElementById('btn-engine-toggle');
+    if (engineBtn) engineBtn.remove(); 
+    
+    engineState = status;
+    const isStopped = status === 'Stopped';
+    document.querySelectorAll('.tf-controls').forEach(el => { el.style.display = isStopped ? 'none' : 'inline-flex'; });
+
+    if(isStopped) { badge.innerText = 'DETENIDO'; badge.className = 'badge bg-danger me-2'; }
+    else { badge.innerText = status === 'Paused' ? 'PAUSADO' : 'OPERATIVO'; badge.className = status === 'Paused' ? 'badge bg-warning text-dark me-2' : 'badge bg-success me-2'; }
+}
+
+async function loadStatus() {
     try {
         const res = await fetch('/api/status');
         const data = await res.json();
+        if (!data.stats) return;
+        statusData = data;
         if (data.active_pairs) syncTabs(data.active_pairs);
-        
-        const badge = document.getElementById('status-badge');
-        let engineBtn = document.getElementById('btn-engine-toggle');
-        if (engineBtn) engineBtn.remove(); 
-        
-        const isStopped = data.status === 'Stopped';
-        document.querySelectorAll('.tf-controls').forEach(el => { el.style.display = isStopped ? 'none' : 'inline-flex'; });
+        renderEngineStatus(data.status);
+        renderStatus();
+    } catch(e) { console.error(e); }
+}
+
+// Evento 'status': solo trae las claves cambiadas; si falta alguna versión se pide el snapshot entero
+function applyStatusChanges(d) {
+    if (!statusData || d.version !== statusData.version + 1) { loadStatus(); return; }
+    Object.assign(statusData, d.changes, { version: d.version });
+    if (d.changes.active_pairs) syncTabs(d.changes.active_pairs);
+    if (currentMode === 'home') renderStatus();
+    else if (d.changes.strategies) renderSymbolPnl(currentMode);
+}
+
+function renderUptime() {
+    if (!statusData || !statusData.first_run) return;
+    const now = Date.now() / 1000;
+    const el = (id) => document.getElementById(id);
+    if (el('dash-uptime-session')) el('dash-uptime-session').innerText = engineState === 'Stopped' ? 'OFF' : fmtUptime(now - statusData.session_start);
+    if (el('dash-uptime-total')) el('dash-uptime-total').innerText = fmtUptime(now - statusData.first_run);
+}
 
-        if(isStopped) { badge.innerText = 'DETENIDO'; badge.className = 'badge bg-danger me-2'; }
-        else { badge.innerText = data.status === 'Paused' ? 'PAUSADO' : 'OPERATIVO'; badge.className = data.status === 'Paused' ? 'badge bg-warning text-dark me-2' : 'badge bg-success me-2'; }
+function renderSymbolPnl(symbol) {
+    const st = statusData && statusData.strategies.find(s => s.symbol === symbol);
+    if (!st) return;
+    const safe = symbol.replace('/', '_');
+    updateColorValue(`sess-pnl-${safe}`, st.session_pnl, ' $');
+    updateColorValue(`glob-pnl-${safe}`, st.total_pnl, ' $');
+}
 
+function renderStatus() {
+    const data = statusData;
+    try {
         document.getElementById('total-balance').innerText = `${fmtUSDC(data.total_usdc_value)} USDC`;
         updateColorValue('dash-profit-session', data.stats.session.profit, ' $');
         updateColorValue('dash-profit-total', data.stats.global.profit, ' $');
         document.getElementById('dash-trades-session').innerText = fmtInt(data.stats.session.trades);
         document.getElementById('dash-coin-session').innerText = data.stats.session.best_coin;
-        document.getElementById('dash-uptime-session').innerText = data.stats.session.uptime;
         document.getElementById('dash-trades-total').innerText = fmtInt(data.stats.global.trades);
         document.getElementById('dash-coin-total').innerText = data.stats.global.best_coin;
-        document.getElementById('dash-uptime-total').innerText = data.stats.global.uptime;
+        renderUptime();
 
         renderDonut('pieChart', data.portfolio_distribution, true);
         renderDonut('sessionTradesChart', data.session_trades_distribution, false);
         renderDonut('globalTradesChart', data.global_trades_distribution, false);
-        
-        loadBalanceCharts();
-        loadGlobalOrders();
 
         const stTable = document.getElementById('strategies-table-body');
         if(stTable) {
@@ -337,7 +381,7 @@ async function loadHome() {
 async function loadSymbol(symbol) {
     const safe = symbol.replace('/', '_');
     try {
-        const res = await fetch(`/api/details/${symbol}?timeframe=${currentTimeframe}&_=${Date.now()}`);
+        const res = await fetch(`/api/details/${symbol}?timeframe=${currentTimeframe}&max_points=${CHART_MAX_POINTS}`);
         if (!res.ok) return;
         const data = await res.json();
         
@@ -345,24 +389,45 @@ async function loadSymbol(symbol) {
         
         renderCandleChart(safe, data.chart_data, data.grid_lines, data.open_orders, currentChartType);
         
-        document.getElementById(`count-buy-${safe}`).innerText = data.open_orders.filter(o => o.side === 'buy').length;
-        document.getElementById(`count-sell-${safe}`).innerText = data.open_orders.filter(o => o.side === 'sell').length;
+        renderSymbolOrders(symbol, data.open_orders);
         updateColorValue(`sess-pnl-${safe}`, data.session_pnl, ' $');
         updateColorValue(`glob-pnl-${safe}`, data.global_pnl, ' $');
-        
-        const allOrders = [...data.open_orders].sort((a,b) => b.price - a.price);
-        document.getElementById(`orders-${safe}`).innerHTML = allOrders.map(o => `<tr><td><b class="${o.side=='buy'?'text-buy':'text-sell'}">${o.side.toUpperCase()}</b></td><td>${fmtPrice(o.price)}</td><td>${fmtCrypto(o.amount)}</td></tr>`).join('');
-        
-        document.getElementById(`trades-${safe}`).innerHTML = data.trades.map(t => {
-            let idBadge = t.buy_id || '-';
-            if(t.side === 'sell' && t.buy_id) idBadge = '⮑ ' + t.buy_id; 
-            return `<tr><td><span class="badge bg-secondary">${idBadge}</span></td><td>${new Date(t.timestamp).toLocaleTimeString()}</td><td><span class="badge ${t.side=='buy'?'bg-buy':'bg-sell'}">${t.side.toUpperCase()}</span></td><td>${fmtPrice(t.price)}</td><td>${fmtUSDC(t.cost)}</td></tr>`;
-        }).join('');
+        symbolTrades = data.trades;
+        renderSymbolTrades(symbol);
 
 // --- MANTENIMIENTO ---
     } catch(e) { console.error(e); }
 }
 
+function renderSymbolOrders(symbol, orders) {
+    const safe = symbol.replace('/', '_');
+    const tbody = document.getElementById(`orders-${safe}`);
+    if (!tbody) return;
+    document.getElementById(`count-buy-${safe}`).innerText = orders.filter(o => o.side === 'buy').length;
+    document.getElementById(`count-sell-${safe}`).innerText = orders.filter(o => o.side === 'sell').length;
+    const allOrders = [...orders].sort((a,b) => b.price - a.price);
+    tbody.innerHTML = allOrders.map(o => `<tr><td><b class="${o.side=='buy'?'text-buy':'text-sell'}">${o.side.toUpperCase()}</b></td><td>${fmtPrice(o.price)}</td><td>${fmtCrypto(o.amount)}</td></tr>`).join('');
+}
+
+function renderSymbolTrades(symbol) {
+    const tbody = document.getElementById(`trades-${symbol.replace('/', '_')}`);
+    if (!tbody) return;
+    tbody.innerHTML = symbolTrades.map(t => {
+        let idBadge = t.buy_id || '-';
+        if(t.side === 'sell' && t.buy_id) idBadge = '⮑ ' + t.buy_id; 
+        return `<tr><td><span class="badge bg-secondary">${idBadge}</span></td><td>${new Date(t.timestamp).toLocaleTimeString()}</td><td><span class="badge ${t.side=='buy'?'bg-buy':'bg-sell'}">${t.side.toUpperCase()}</span></td><td>${fmtPrice(t.price)}</td><td>${fmtUSDC(t.cost)}</td></tr>`;
+    }).join('');
+}
+
+// Evento 'trades': se añaden al historial del par abierto (mismo tope de 50 filas que el servidor)
+function applyTrades(symbol, trades) {
+    const known = new Set(symbolTrades.map(t => String(t.id)));
+    const fresh = trades.filter(t => !known.has(String(t.id)));
+    if (fresh.length === 0) return;
+    symbolTrades = [...fresh, ...symbolTrades].sort((a, b) => b.timestamp - a.timestamp).slice(0, 50);
+    renderSymbolTrades(symbol);
+}
+
 async function loadWallet() { 
     // --- LÒGICA D'ACTUALITZACIÓ INFO COMPTE ---
     // Forcem la visibilitat inicial per assegurar que es veu alguna cosa
@@ -429,8 +494,9 @@ function updateAccountBadge(info) {
     }
 }
 
-async function loadGlobalOrders() { try { const res = await fetch('/api/orders'); const orders = await res.json(); const tbody = document.getElementById('global-orders-table'); if(orders.length === 0) { tbody.innerHTML = '<tr><td colspan="8" class="text-center text-muted py-3">No hay órdenes</td></tr>'; return; } orders.sort((a,b) => a.symbol.localeCompare(b.symbol) || b.price - a.price); tbody.innerHTML = orders.map(o => { const isBuy = o.side === 'buy'; let pnlDisplay = '-', pnlClass = ''; if(!isBuy && o.entry_price > 0) { const pnl = ((o.current_price - o.entry_price)/o.entry_price)*100; pnlDisplay = fmtPct(pnl); pnlClass = pnl>=0 ? 'text-success fw-bold':'text-danger fw-bold'; } return `<tr><td class="fw-bold">${o.symbol}</td><td><span class="badge ${isBuy?'bg-success':'bg-danger'}">${isBuy?'COMPRA':'VENTA'}</span></td><td>${fmtPrice(o.price)}</td><td class="text-muted">${isBuy?'-':fmtPrice(o.entry_price)}</td><td>${fmtPrice(o.current_price)}</td><td class="${pnlClass}">${pnlDisplay}</td><td>${fmtUSDC(o.total_value)}</td><td class="text-end"><button class="btn btn-sm btn-outline-secondary" onclick="closeOrder('${o.symbol}','${o.id}','${o.side}',${o.amount})"><i class="fa-solid fa-times"></i></button></td></tr>`; }).join(''); } catch(e) {} }
-async function loadBalanceCharts() { try { const res = await fetch('/api/history/balance'); if (!res.ok) return; const data = await res.json(); fullGlobalHistory = data.global; renderLineChart('balanceChartSession', data.session, '#0ecb81'); const activeBtn = document.querySelector('.hist-btn.active'); if(activeBtn && activeBtn.innerText === '24h') filterHistory(24); else if(activeBtn && activeBtn.innerText === '7d') filterHistory(168); else renderLineChart('balanceChartGlobal', fullGlobalHistory, '#3b82f6'); } catch(e) { console.error("Error loading charts", e); } }
+async function loadGlobalOrders() { try { const res = await fetch('/api/orders'); const orders = await res.json(); globalOrders = {}; orders.forEach(o => { (globalOrders[o.symbol] = globalOrders[o.symbol] || []).push(o); if (o.current_price) lastPrices[o.symbol] = lastPrices[o.symbol] || o.current_price; }); renderGlobalOrders(); } catch(e) {} }
+function renderGlobalOrders() { const tbody = document.getElementById('global-orders-table'); if(!tbody) return; const orders = Object.values(globalOrders).flat(); if(orders.length === 0) { tbody.innerHTML = '<tr><td colspan="8" class="text-center text-muted py-3">No hay órdenes</td></tr>'; return; } orders.sort((a,b) => a.symbol.localeCompare(b.symbol) || b.price - a.price); tbody.innerHTML = orders.map(o => { const isBuy = o.side === 'buy'; const currentPrice = lastPrices[o.symbol] || o.current_price || 0; let pnlDisplay = '-', pnlClass = ''; if(!isBuy && o.entry_price > 0) { const pnl = ((currentPrice - o.entry_price)/o.entry_price)*100; pnlDisplay = fmtPct(pnl); pnlClass = pnl>=0 ? 'text-success fw-bold':'text-danger fw-bold'; } return `<tr><td class="fw-bold">${o.symbol}</td><td><span class="badge ${isBuy?'bg-success':'bg-danger'}">${isBuy?'COMPRA':'VENTA'}</span></td><td>${fmtPrice(o.price)}</td><td class="text-muted">${isBuy?'-':fmtPrice(o.entry_price)}</td><td>${fmtPrice(currentPrice)}</td><td class="${pnlClass}">${pnlDisplay}</td><td>${fmtUSDC(o.amount * o.price)}</td><td class="text-end"><button class="btn btn-sm btn-outline-secondary" onclick="closeOrder('${o.symbol}','${o.id}','${o.side}',${o.amount})"><i class="fa-solid fa-times"></i></button></td></tr>`; }).join(''); }
+async function loadBalanceCharts() { try { const hours = currentHistoryHours === 'all' ? 0 : currentHistoryHours; const res = await fetch(`/api/history/balance?hours=${hours}&max_points=${CHART_MAX_POINTS}`); if (!res.ok) return; const data = await res.json(); renderLineChart('balanceChartSession', data.session, '#0ecb81'); renderLineChart('balanceChartGlobal', data.global, '#3b82f6'); } catch(e) { console.error("Error loading charts", e); } }
 async function closeOrder(s, i, side, a) { const result = await Swal.fire({ title: '¿Cancelar Orden?', text: `${side.toUpperCase()} ${s} - Cantidad: ${a}`, icon: 'warning', showCancelButton: true, confirmButtonColor: '#d33', cancelButtonColor: '#3085d6', confirmButtonText: 'Sí, cancelar' }); if (result.isConfirmed) { postAction('/api/close_order', { symbol: s, order_id: i, side: side, amount: a }); } }
 async function liquidateAsset(a) { const result = await Swal.fire({ title: `¿Liquidar ${a}?`, text: "Se cancelarán las órdenes y se venderá todo a mercado.", icon: 'warning', showCancelButton: true, confirmButtonColor: '#d33', confirmButtonText: 'Sí, vender todo' }); if (result.isConfirmed) { postAction('/api/liquidate_asset', { asset: a }, loadWallet); } }
 async function clearHistory(s) { const result = await Swal.fire({ title: '¿Borrar Historial?', text: `Se eliminarán los trades antiguos de ${s} de la base de datos.`, icon: 'question', showCancelButton: true, confirmButtonText: 'Sí, borrar' }); if (result.isConfirmed) { postAction('/api/history/clear', { symbol: s }); } }
@@ -477,6 +543,9 @@ async function executeEngineAction(url, actionTitle, targetStatus) {
     });
 
     try {
+        // El evento 'engine' puede llegar antes que la respuesta del POST: nos suscribimos antes
+        const eventWait = sseConnected ? waitEngineEvent(targetStatus, 20000) : null;
+
         // 2. Ejecutar Acción
         const res = await fetch(url, { 
             method: 'POST', 
@@ -490,55 +559,116 @@ async function executeEngineAction(url, actionTitle, targetStatus) {
             return;
         }
 
-        // 3. Polling hasta confirmar estado en /api/status
+        // 3. Confirmación: por el stream de eventos si está conectado; si no, polling de /api/status
+        const confirmed = eventWait ? await eventWait : await pollEngineStatus(targetStatus);
+        if (confirmed) {
+            // Recargamos la UI completa ahora que sabemos que ha cambiado
+            await loadHome();
+            Swal.fire({
+                title: 'Operación Finalizada',
+                text: `El sistema está: ${targetStatus.toUpperCase()}`,
+                icon: 'success',
+                timer: 2000,
+                showConfirmButton: false
+            });
+        } else {
+            Swal.fire({
+                title: 'Tiempo de espera agotado',
+                text: 'El estado no se ha actualizado a tiempo, revisa los logs.',
+                icon: 'warning'
+            });
+        }
+    } catch (e) {
+        Swal.fire('Error', 'Error de conexión', 'error');
+    }
+}
+
+function waitEngineEvent(targetStatus, timeoutMs) {
+    return new Promise(resolve => {
+        const waiter = { target: targetStatus, resolve };
+        engineWaiters.push(waiter);
+        setTimeout(() => { engineWaiters = engineWaiters.filter(w => w !== waiter); resolve(false); }, timeoutMs);
+    });
+}
+
+function pollEngineStatus(targetStatus) {
+    return new Promise(resolve => {
         let attempts = 0;
-        const maxAttempts = 15; // 15 intentos (aprox 20s)
-        let finished = false; // Bandera para evitar múltiples alertas
-        
-        // Intervalo aumentado de 1.5s a 2.5s para no saturar
+        const maxAttempts = 8; // 8 intentos (aprox 20s)
+        // Check cada 2.5s (más lento para evitar BAN)
         const checkInterval = setInterval(async () => {
-            if (finished) { clearInterval(checkInterval); return; } // Doble seguridad
-            
             attempts++;
             try {
-                // Consultamos estado silenciosamente
                 const sRes = await fetch('/api/status');
                 const sData = await sRes.json();
-                
-                // Si el estado ya coincide con el objetivo (Running/Stopped/Paused)
-                if (sData.status === targetStatus) {
-                    finished = true;
-                    clearInterval(checkInterval);
-                    
-                    // Recargamos la UI completa ahora que sabemos que ha cambiado
-                    await loadHome();
-                    
-                    Swal.fire({
-                        title: 'Operación Finalizada',
-                        text: `El sistema está: ${targetStatus.toUpperCase()}`,
-                        icon: 'success',
-                        timer: 2000,
-                        showConfirmButton: false
-                    });
-                } else if (attempts >= maxAttempts) {
-                    finished = true;
-                    clearInterval(checkInterval);
-                    
-                    // Timeout
-                    Swal.fire({
-                        title: 'Tiempo de espera agotado',
-                        text: 'El estado no se ha actualizado a tiempo, revisa los logs.',
-                        icon: 'warning'
-                    });
-                }
+                if (sData.status === targetStatus) { clearInterval(checkInterval); resolve(true); return; }
             } catch(e) {
                 console.error("Polling error", e);
             }
-        }, 2500); // Check cada 2.5s (más lento para evitar BAN)
+            if (attempts >= maxAttempts) { clearInterval(checkInterval); resolve(false); }
+        }, 2500);
+    });
+}
 
-    } catch (e) {
-        Swal.fire('Error', 'Error de conexión', 'error');
-    }
+// --- PUSH DE CAMBIOS (SSE) CON FALLBACK A POLLING ---
+function refreshCurrentView() {
+    if(currentMode === 'home') { loadHome(); } 
+    else if(currentMode !== 'config' && currentMode !== 'wallet') loadSymbol(currentMode);
+}
+
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(refreshCurrentView, POLL_INTERVAL_MS);
+}
+
+function stopPolling() {
+    if (pollTimer) { clearInterval(pollTimer); pollTimer = null; }
+}
+
+function connectEvents() {
+    if (!window.EventSource) { startPolling(); return; }
+    eventSource = new EventSource('/api/events');
+    eventSource.onopen = () => { sseConnected = true; stopPolling(); };
+    eventSource.onerror = () => {
+        // El navegador reintenta solo; mientras tanto (o si lo da por perdido) se vuelve al polling
+        sseConnected = false;
+        startPolling();
+        if (eventSource.readyState === EventSource.CLOSED) setTimeout(connectEvents, 10000);
+    };
+
+    const on = (kind, handler) => eventSource.addEventListener(kind, ev => {
+        try { handler(JSON.parse(ev.data)); } catch(e) { console.error(`Evento ${kind}:`, e); }
+    });
+    on('engine', d => {
+        renderEngineStatus(d.status);
+        renderUptime();
+        engineWaiters.filter(w => w.target === d.status).forEach(w => w.resolve(true));
+        engineWaiters = engineWaiters.filter(w => w.target !== d.status);
+    });
+    // Los eventos traen el cambio: se aplica sobre el estado local, sin volver a pedir los endpoints
+    on('status', applyStatusChanges);
+    on('equity', d => {
+        appendLinePoint('balanceChartGlobal', d.time, d.equity);
+        if (statusData && d.time >= statusData.session_start * 1000) appendLinePoint('balanceChartSession', d.time, d.equity);
+    });
+    on('orders', d => {
+        globalOrders[d.symbol] = d.open_orders;
+        if (currentMode === 'home') renderGlobalOrders();
+        else if (currentMode === d.symbol) {
+            renderSymbolOrders(d.symbol, d.open_orders);
+            setOrderLines(d.symbol.replace('/', '_'), d.open_orders);
+        }
+    });
+    on('trades', d => { if (currentMode === d.symbol) applyTrades(d.symbol, d.trades); });
+    on('price', d => {
+        lastPrices[d.symbol] = d.price;
+        const safe = d.symbol.replace('/', '_');
+        const el = document.getElementById(`price-${safe}`);
+        if (el) el.innerText = `${fmtPrice(d.price)} USDC`;
+        if (currentMode === d.symbol) updateLastCandle(safe, Date.now(), d.price);
+        else if (currentMode === 'home' && globalOrders[d.symbol]) renderGlobalOrders();
+    });
+    // Nos hemos perdido eventos (buffer agotado o bot reiniciado): recarga completa de la vista
+    on('resync', () => { dataCache = {}; refreshCurrentView(); });
 }
 
 function changeTheme(themeName, reloadData = true) {
@@ -559,9 +689,7 @@ function changeTheme(themeName, reloadData = true) {
     }
 }
 
-// Loop principal
+// Loop principal: cambios por push; el polling solo se usa sin conexión SSE
 init();
-setInterval(() => {
-    if(currentMode === 'home') { loadHome(); } 
-    else if(currentMode !== 'config' && currentMode !== 'wallet') loadSymbol(currentMode);
-}, 4000);
\ No newline at end of file
+connectEvents();
+setInterval(renderUptime, 30000);   // El uptime avanza solo: se calcula en local desde el snapshot
\ No newline at end of file
@@ -26,6 +26,16 @@ export const fmtCrypto = (num) => {
     return val.toLocaleString('es-ES', { minimumFractionDigits: dec, maximumFractionDigits: dec });
 };
 
+// Mismo formato que format_uptime() del servidor
+export const fmtUptime = (seconds) => {
+    if (!(seconds > 0)) return '0h 0m';
+    seconds = Math.floor(seconds);
+    const days = Math.floor(seconds / 86400);
+    const hours = Math.floor((seconds % 86400) / 3600);
+    const mins = Math.floor((seconds % 3600) / 60);
+    return days > 0 ? `${days}d ${hours}h ${mins}m` : `${hours}h ${mins}m`;
+};
+
 export const fmtPct = (num) => {
     if (!num) return '0,00%';
     return parseFloat(num).toLocaleString('es-ES', { minimumFractionDigits: 2, maximumFractionDigits: 2 }) + '%';